@@ -0,0 +1,72 @@
+import hashlib
+import json
+import logging
+import traceback
+from typing import Callable, Iterable, Optional
+
+import folder_paths
+
+
+class NodeInfoCache:
+    """
+    Pre-serialized /object_info catalog.
+    Each node's info is built once and rebuilt only when a directory or model list that its
+    INPUT_TYPES read has changed since (see folder_paths.record_listing_dependencies). Nodes that
+    read neither are rebuilt after folder_paths.UNTRACKED_DEPENDENCY_TTL seconds.
+    """
+    def __init__(self, node_info: Callable[[str], dict]):
+        self.node_info = node_info
+        self.entries: dict[str, tuple[bytes, dict]] = {}  # node class -> (json, dependencies)
+        self.catalog: Optional[tuple[tuple, bytes, str]] = None  # (entries it was built from, body, etag)
+
+    def _build(self, node_class: str) -> Optional[bytes]:
+        try:
+            with folder_paths.record_listing_dependencies() as dependencies:
+                info = self.node_info(node_class)
+            data = json.dumps(info).encode("utf-8")
+        except Exception:
+            logging.error(f"[ERROR] An error occurred while retrieving information for the '{node_class}' node.")
+            logging.error(traceback.format_exc())
+            self.entries.pop(node_class, None)
+            return None
+        self.entries[node_class] = (data, dependencies)
+        return data
+
+    def _is_current(self, dependencies: dict, stamps: dict) -> bool:
+        for dependency, stamp in dependencies.items():
+            if dependency not in stamps:
+                stamps[dependency] = folder_paths.listing_dependency_stamp(dependency)
+            if stamps[dependency] != stamp:
+                return False
+        return True
+
+    def get_node(self, node_class: str, stamps: Optional[dict] = None) -> Optional[bytes]:
+        """JSON node info for node_class, rebuilt if out of date. None if it couldn't be built."""
+        entry = self.entries.get(node_class)
+        if entry is not None and self._is_current(entry[1], stamps if stamps is not None else {}):
+            return entry[0]
+        return self._build(node_class)
+
+    def get_catalog(self, node_classes: Iterable[str]) -> tuple[bytes, str]:
+        """JSON object of every node's info and its ETag"""
+        stamps = {}  # each dependency is checked once per catalog
+        parts = []
+        for node_class in node_classes:
+            data = self.get_node(node_class, stamps)
+            if data is not None:
+                parts.append((node_class, data))
+
+        # The tuple holds the json bytes objects, which are only replaced when a node is rebuilt
+        key = tuple(parts)
+        if self.catalog is None or self.catalog[0] != key:
+            body = b"{" + b", ".join(json.dumps(name).encode("utf-8") + b": " + data for name, data in parts) + b"}"
+            etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+            self.catalog = (key, body, etag)
+        return self.catalog[1], self.catalog[2]
+
+    def invalidate(self, node_class: Optional[str] = None):
+        if node_class is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(node_class, None)
+        self.catalog = None
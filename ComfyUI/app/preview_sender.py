@@ -0,0 +1,181 @@
+import asyncio
+import json
+import logging
+import struct
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from protocol import BinaryEventTypes
+
+
+def _contain(image, max_size):
+    if max_size is not None:
+        if hasattr(Image, 'Resampling'):
+            resampling = Image.Resampling.BILINEAR
+        else:
+            resampling = Image.Resampling.LANCZOS
+
+        image = ImageOps.contain(image, (max_size, max_size), resampling)
+    return image
+
+
+def encode_preview_image(image_data) -> bytes:
+    """Payload of a PREVIEW_IMAGE message: image type header followed by the encoded image"""
+    image_type, image, max_size = image_data[0], image_data[1], image_data[2]
+    image = _contain(image, max_size)
+    type_num = 1
+    if image_type == "JPEG":
+        type_num = 1
+    elif image_type == "PNG":
+        type_num = 2
+
+    bytesIO = BytesIO()
+    header = struct.pack(">I", type_num)
+    bytesIO.write(header)
+    image.save(bytesIO, format=image_type, quality=95, compress_level=1)
+    return bytesIO.getvalue()
+
+
+def encode_preview_image_with_metadata(image_data, metadata=None) -> bytearray:
+    """Payload of a PREVIEW_IMAGE_WITH_METADATA message: metadata length, JSON metadata, encoded image"""
+    image_type, image, max_size = image_data[0], image_data[1], image_data[2]
+    image = _contain(image, max_size)
+
+    mimetype = "image/png" if image_type == "PNG" else "image/jpeg"
+
+    # Prepare metadata
+    if metadata is None:
+        metadata = {}
+    metadata["image_type"] = mimetype
+
+    # Serialize metadata as JSON
+    metadata_json = json.dumps(metadata).encode('utf-8')
+    metadata_length = len(metadata_json)
+
+    # Prepare image data
+    bytesIO = BytesIO()
+    image.save(bytesIO, format=image_type, quality=95, compress_level=1)
+    image_bytes = bytesIO.getvalue()
+
+    # Combine metadata and image
+    combined_data = bytearray()
+    combined_data.extend(struct.pack(">I", metadata_length))
+    combined_data.extend(metadata_json)
+    combined_data.extend(image_bytes)
+    return combined_data
+
+
+def encode_preview(event, data):
+    """Encode an UNENCODED_PREVIEW_IMAGE or PREVIEW_IMAGE_WITH_METADATA event into (binary event, payload)"""
+    if event == BinaryEventTypes.UNENCODED_PREVIEW_IMAGE:
+        return BinaryEventTypes.PREVIEW_IMAGE, encode_preview_image(data)
+    # data is (preview_image, metadata)
+    preview_image, metadata = data
+    return BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, encode_preview_image_with_metadata(preview_image, metadata)
+
+
+class _ClientPreviews:
+    def __init__(self):
+        self.waiting = OrderedDict()  # stream -> newest preview not yet being encoded: (event, data, generation)
+        self.encoding = False
+        self.outbox = deque()  # encoded previews not yet written: (event, payload, generation)
+        self.outbox_bytes = 0
+        self.sender = None
+        self.generation = 0
+        self.dropped = 0
+
+    def idle(self):
+        return not self.waiting and not self.encoding and not self.outbox and self.sender is None
+
+
+class PreviewSender:
+    """
+    Encodes preview images on a thread pool and sends them per client, so the event loop only
+    ever writes bytes that are already encoded.
+    Each client has at most one preview encoding and one waiting per stream (event type and node);
+    a newer preview of the same node replaces the waiting one, other nodes' previews queue up. Encoded previews not yet written to the client are kept under max_client_bytes,
+    dropping the oldest first (the newest one is always kept).
+    """
+    def __init__(self, send_bytes, max_workers: int = 2, max_client_bytes: int = 16 * 1024 * 1024):
+        self.send_bytes = send_bytes  # async (event, data, sid)
+        self.pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="preview_encode")
+        self.max_client_bytes = max_client_bytes
+        self.clients: dict = {}
+
+    def submit(self, event, data, sid=None):
+        """Queue a preview event for sid. Must be called on the event loop."""
+        client = self.clients.get(sid)
+        if client is None:
+            client = self.clients[sid] = _ClientPreviews()
+        stream = self._stream(event, data)
+        if stream in client.waiting:
+            client.dropped += 1
+        # Previews without metadata are shown on whichever node is executing, so they go stale
+        # when the client moves on to the next node
+        generation = client.generation if event == BinaryEventTypes.UNENCODED_PREVIEW_IMAGE else None
+        client.waiting[stream] = (event, data, generation)
+        self._start_encode(sid, client)
+
+    @staticmethod
+    def _stream(event, data):
+        """Previews of one stream supersede each other, e.g. the sampling steps of one node"""
+        if event == BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA:
+            metadata = data[1] or {}
+            return (event, metadata.get("node_id"), metadata.get("display_node_id"))
+        return (event, None, None)
+
+    def node_changed(self, sid=None):
+        """Drop previews without metadata that belong to the node sid was executing"""
+        client = self.clients.get(sid)
+        if client is None:
+            return
+        client.generation += 1
+        for stream in [k for k, v in client.waiting.items() if v[2] is not None]:
+            del client.waiting[stream]
+        for entry in [e for e in client.outbox if e[2] is not None]:
+            client.outbox.remove(entry)
+            client.outbox_bytes -= len(entry[1])
+
+    def _start_encode(self, sid, client):
+        if client.encoding or not client.waiting:
+            return
+        _, (event, data, generation) = client.waiting.popitem(last=False)
+        client.encoding = True
+        future = asyncio.get_running_loop().run_in_executor(self.pool, encode_preview, event, data)
+        future.add_done_callback(lambda f: self._encoded(sid, client, f, generation))
+
+    def _encoded(self, sid, client, future, generation):
+        client.encoding = False
+        try:
+            event, payload = future.result()
+        except Exception as e:
+            logging.warning(f"Failed to encode preview image: {e}")
+        else:
+            if generation is None or generation == client.generation:
+                client.outbox.append((event, payload, generation))
+                client.outbox_bytes += len(payload)
+                while client.outbox_bytes > self.max_client_bytes and len(client.outbox) > 1:
+                    _, dropped, _ = client.outbox.popleft()
+                    client.outbox_bytes -= len(dropped)
+                    client.dropped += 1
+                if client.sender is None:
+                    client.sender = asyncio.create_task(self._send(sid, client))
+        self._start_encode(sid, client)
+        self._forget_if_idle(sid, client)
+
+    async def _send(self, sid, client):
+        try:
+            while client.outbox:
+                event, payload, _ = client.outbox.popleft()
+                client.outbox_bytes -= len(payload)
+                await self.send_bytes(event, payload, sid)
+        finally:
+            client.sender = None
+            self._forget_if_idle(sid, client)
+
+    def _forget_if_idle(self, sid, client):
+        if client.idle() and self.clients.get(sid) is client:
+            del self.clients[sid]
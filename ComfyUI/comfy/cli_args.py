@@ -41,6 +41,8 @@ parser.add_argument("--tls-keyfile", type=str, help="Path to TLS (SSL) key file.
 parser.add_argument("--tls-certfile", type=str, help="Path to TLS (SSL) certificate file. Enables TLS, makes app accessible at https://... requires --tls-keyfile to function")
 parser.add_argument("--enable-cors-header", type=str, default=None, metavar="ORIGIN", nargs="?", const="*", help="Enable CORS (Cross-Origin Resource Sharing) with optional origin or allow all with default '*'.")
 parser.add_argument("--max-upload-size", type=float, default=100, help="Set the maximum upload size in MB.")
+parser.add_argument("--attachment-cache-size", type=float, default=512, metavar="MB", help="Memory budget in MB for images posted inline with prompts. Attachments of queued prompts are never evicted.")
+parser.add_argument("--max-history-size", type=float, default=512, metavar="MB", help="Memory budget in MB for the prompt history, the oldest entries are dropped first.")
 
 parser.add_argument("--base-directory", type=str, default=None, help="Set the ComfyUI base directory for models, custom_nodes, input, output, temp, and user directories.")
 parser.add_argument("--extra-model-paths-config", type=str, default=None, metavar="PATH", nargs='+', action='append', help="Load one or more extra_model_paths.yaml files.")
@@ -106,6 +108,11 @@ cache_group.add_argument("--cache-classic", action="store_true", help="Use the o
 cache_group.add_argument("--cache-lru", type=int, default=0, help="Use LRU caching with a maximum of N node results cached. May use more RAM/VRAM.")
 cache_group.add_argument("--cache-none", action="store_true", help="Reduced RAM/VRAM usage at the expense of executing every node for each run.")
 
+parser.add_argument("--prompt-workers", type=int, default=1, metavar="N", help="Execute up to N prompts at the same time, each worker with its own node cache.")
+parser.add_argument("--prompt-worker-devices", type=str, default="", metavar="DEVICES", help="Comma separated device per prompt worker, assigned round robin, e.g. \"cpu,cuda:0\". Only the ONNX nodes run on the device of their worker, torch nodes (e.g. BiRefNet HR, Florence-2) use the default torch device.")
+parser.add_argument("--prompt-worker-threads", type=int, default=0, metavar="N", help="CPU threads per prompt worker. Defaults to the CPU count divided by --prompt-workers.")
+parser.add_argument("--parallel-branches", type=int, default=1, metavar="N", help="Run up to N independent branches of a prompt at the same time. Nodes that share a resource tag (their RESOURCES attribute, \"gpu\" when not set) still run one at a time.")
+
 attn_group = parser.add_mutually_exclusive_group()
 attn_group.add_argument("--use-split-cross-attention", action="store_true", help="Use the split cross attention optimization. Ignored when xformers is used.")
 attn_group.add_argument("--use-quad-cross-attention", action="store_true", help="Use the sub-quadratic cross attention optimization . Ignored when xformers is used.")
@@ -1403,6 +1403,7 @@ def unload_all_models():
 
 
 #TODO: might be cleaner to put this somewhere else
+import contextvars
 import threading
 
 class InterruptProcessingException(Exception):
@@ -1411,22 +1412,64 @@ class InterruptProcessingException(Exception):
 interrupt_processing_mutex = threading.RLock()
 
 interrupt_processing = False
-def interrupt_current_processing(value=True):
+# Prompt workers can run several prompts at once, so each prompt is interrupted separately.
+# interrupt_processing is only used by code that runs outside of a prompt.
+processing_prompts = set()
+interrupted_prompts = set()
+current_processing_prompt = contextvars.ContextVar("current_processing_prompt", default=None)
+
+def begin_prompt_processing(prompt_id):
+    """Run the current context as prompt_id until end_prompt_processing(token)"""
     global interrupt_processing
     global interrupt_processing_mutex
     with interrupt_processing_mutex:
-        interrupt_processing = value
+        if len(processing_prompts) == 0:
+            interrupt_processing = False
+        processing_prompts.add(prompt_id)
+        interrupted_prompts.discard(prompt_id)
+    return current_processing_prompt.set(prompt_id)
+
+def end_prompt_processing(token):
+    global interrupt_processing_mutex
+    prompt_id = current_processing_prompt.get()
+    with interrupt_processing_mutex:
+        processing_prompts.discard(prompt_id)
+        interrupted_prompts.discard(prompt_id)
+    current_processing_prompt.reset(token)
+
+def interrupt_current_processing(value=True, prompt_id=None):
+    """Interrupt (or clear the interrupt of) prompt_id, or everything that is running when it is None"""
+    global interrupt_processing
+    global interrupt_processing_mutex
+    with interrupt_processing_mutex:
+        if prompt_id is None:
+            interrupt_processing = value
+            prompt_ids = set(processing_prompts)
+        else:
+            prompt_ids = {prompt_id} & processing_prompts
+        if value:
+            interrupted_prompts.update(prompt_ids)
+        else:
+            interrupted_prompts.difference_update(prompt_ids)
 
 def processing_interrupted():
     global interrupt_processing
     global interrupt_processing_mutex
+    prompt_id = current_processing_prompt.get()
     with interrupt_processing_mutex:
+        if prompt_id is not None:
+            return prompt_id in interrupted_prompts
         return interrupt_processing
 
 def throw_exception_if_processing_interrupted():
     global interrupt_processing
     global interrupt_processing_mutex
+    prompt_id = current_processing_prompt.get()
     with interrupt_processing_mutex:
-        if interrupt_processing:
+        if prompt_id is not None:
+            if prompt_id in interrupted_prompts:
+                interrupted_prompts.discard(prompt_id)
+                raise InterruptProcessingException()
+        elif interrupt_processing:
             interrupt_processing = False
             raise InterruptProcessingException()
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from comfy.cli_args import args
+
+ATTACHMENT_SUFFIX = " [attachment]"
+
+
+class AttachmentStoreFull(Exception):
+    pass
+
+
+def is_attachment(value) -> bool:
+    return isinstance(value, str) and value.endswith(ATTACHMENT_SUFFIX)
+
+
+def attachment_name(value: str) -> str:
+    """Strip the " [attachment]" annotation"""
+    return value[:-len(ATTACHMENT_SUFFIX)]
+
+
+class AttachmentStore:
+    """
+    In-memory store for images posted together with a prompt, so loader nodes can decode them
+    without writing them to the input directory first.
+    Attachments are content addressed: the name is "<sha256><ext>", the same digest LoadImage's
+    IS_CHANGED returns for a file with these bytes, so cache signatures don't change.
+    Attachments of queued or running prompts are pinned, the others are evicted least recently
+    used once the store is over max_bytes.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.size = 0
+        self.pins: dict[str, set[str]] = {}  # prompt_id -> names
+
+    def _pinned(self) -> set[str]:
+        return set().union(*self.pins.values()) if self.pins else set()
+
+    def put(self, data: bytes, filename: str = "", prompt_id: Optional[str] = None) -> str:
+        """Store data and return its name, pinned to prompt_id until release(prompt_id)"""
+        digest = hashlib.sha256(data).hexdigest()
+        name = digest + os.path.splitext(filename)[1].lower()
+        with self.lock:
+            if name in self.entries:
+                self.entries.move_to_end(name)
+            else:
+                pinned = self._pinned()
+                for old in list(self.entries):
+                    if self.size + len(data) <= self.max_bytes:
+                        break
+                    if old not in pinned:
+                        self.size -= len(self.entries.pop(old))
+                if self.size + len(data) > self.max_bytes:
+                    raise AttachmentStoreFull(f"Attachment store is full ({self.size} bytes in use by queued prompts)")
+                self.entries[name] = data
+                self.size += len(data)
+            if prompt_id is not None:
+                self.pins.setdefault(prompt_id, set()).add(name)
+        return name
+
+    def get(self, name: str) -> Optional[bytes]:
+        with self.lock:
+            data = self.entries.get(name)
+            if data is not None:
+                self.entries.move_to_end(name)
+            return data
+
+    def digest(self, name: str) -> str:
+        """sha256 of an attachment's bytes"""
+        return os.path.splitext(name)[0]
+
+    def pin(self, name: str, prompt_id: str) -> bool:
+        """Keep an already stored attachment until prompt_id is released. False if it isn't stored."""
+        with self.lock:
+            if name not in self.entries:
+                return False
+            self.pins.setdefault(prompt_id, set()).add(name)
+            return True
+
+    def release(self, prompt_id: str):
+        with self.lock:
+            self.pins.pop(prompt_id, None)
+
+    def __contains__(self, name: str) -> bool:
+        with self.lock:
+            return name in self.entries
+
+
+attachment_store = AttachmentStore(int(args.attachment_cache_size * 1024 * 1024))
+
+
+def pin_prompt_attachments(prompt: dict, prompt_id: str) -> list[str]:
+    """Pin the attachments a prompt references to prompt_id and return the names that are missing"""
+    missing = []
+    for node in prompt.values():
+        if not isinstance(node, dict):
+            continue
+        for value in node.get("inputs", {}).values():
+            if is_attachment(value) and not attachment_store.pin(attachment_name(value), prompt_id):
+                missing.append(attachment_name(value))
+    return missing
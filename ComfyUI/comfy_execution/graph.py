@@ -209,28 +209,43 @@ class ExecutionList(TopologicalSort):
             self.unblockedEvent.clear()
             available = self.get_ready_nodes()
         if len(available) == 0:
-            cycled_nodes = self.get_nodes_in_cycle()
-            # Because cycles composed entirely of static nodes are caught during initial validation,
-            # we will 'blame' the first node in the cycle that is not a static node.
-            blamed_node = cycled_nodes[0]
-            for node_id in cycled_nodes:
-                display_node_id = self.dynprompt.get_display_node_id(node_id)
-                if display_node_id != node_id:
-                    blamed_node = display_node_id
-                    break
-            ex = DependencyCycleError("Dependency cycle detected")
-            error_details = {
-                "node_id": blamed_node,
-                "exception_message": str(ex),
-                "exception_type": "graph.DependencyCycleError",
-                "traceback": [],
-                "current_inputs": []
-            }
+            error_details, ex = self.get_cycle_error()
             return None, error_details, ex
 
         self.staged_node_id = self.ux_friendly_pick_node(available)
         return self.staged_node_id, None, None
 
+    def get_cycle_error(self):
+        cycled_nodes = self.get_nodes_in_cycle()
+        # Because cycles composed entirely of static nodes are caught during initial validation,
+        # we will 'blame' the first node in the cycle that is not a static node.
+        blamed_node = cycled_nodes[0]
+        for node_id in cycled_nodes:
+            display_node_id = self.dynprompt.get_display_node_id(node_id)
+            if display_node_id != node_id:
+                blamed_node = display_node_id
+                break
+        ex = DependencyCycleError("Dependency cycle detected")
+        error_details = {
+            "node_id": blamed_node,
+            "exception_message": str(ex),
+            "exception_type": "graph.DependencyCycleError",
+            "traceback": [],
+            "current_inputs": []
+        }
+        return error_details, ex
+
+    def get_schedulable_nodes(self, running):
+        """
+        All ready nodes that aren't already running, in the order ux_friendly_pick_node prefers.
+        Used by the concurrent scheduler, which may start several of them at once.
+        """
+        available = [node_id for node_id in self.get_ready_nodes() if node_id not in running]
+        if len(available) <= 1:
+            return available
+        first = self.ux_friendly_pick_node(available)
+        return [first] + [node_id for node_id in available if node_id != first]
+
     def ux_friendly_pick_node(self, node_list):
         # If an output node is available, do that first.
         # Technically this has no effect on the overall length of execution, but it feels better as a user
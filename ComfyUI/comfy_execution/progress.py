@@ -1,4 +1,5 @@
 from __future__ import annotations
+import contextvars
 
 from typing import TypedDict, Dict, Optional, Tuple
 from typing_extensions import override
@@ -321,16 +322,20 @@ class ProgressRegistry:
 
 # Global registry instance
 global_progress_registry: ProgressRegistry | None = None
+# Registry of the prompt running in the current context, so concurrent prompt workers don't share one
+current_progress_registry: contextvars.ContextVar[ProgressRegistry | None] = contextvars.ContextVar("current_progress_registry", default=None)
 
 def reset_progress_state(prompt_id: str, dynprompt: "DynamicPrompt") -> None:
     global global_progress_registry
 
     # Reset existing handlers if registry exists
-    if global_progress_registry is not None:
-        global_progress_registry.reset_handlers()
+    previous_registry = current_progress_registry.get() or global_progress_registry
+    if previous_registry is not None:
+        previous_registry.reset_handlers()
 
     # Create new registry
     global_progress_registry = ProgressRegistry(prompt_id, dynprompt)
+    current_progress_registry.set(global_progress_registry)
 
 
 def add_progress_handler(handler: ProgressHandler) -> None:
@@ -341,6 +346,9 @@ def add_progress_handler(handler: ProgressHandler) -> None:
 
 def get_progress_state() -> ProgressRegistry:
     global global_progress_registry
+    registry = current_progress_registry.get()
+    if registry is not None:
+        return registry
     if global_progress_registry is None:
         from comfy_execution.graph import DynamicPrompt
 
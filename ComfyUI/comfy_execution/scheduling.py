@@ -0,0 +1,123 @@
+from __future__ import annotations
+import asyncio
+import contextlib
+import threading
+from typing import Callable, Iterable, Optional
+
+# Nodes that don't declare RESOURCES are assumed to use the GPU (and comfy.model_management),
+# so untagged nodes never run at the same time as each other.
+DEFAULT_NODE_RESOURCES = frozenset(["gpu"])
+
+# Tags that are also exclusive across prompt workers, because comfy.model_management and the
+# cached llama.cpp models are not safe to use from several threads at once.
+PROCESS_EXCLUSIVE_RESOURCES = frozenset(["gpu", "llm"])
+_process_locks = {name: threading.Lock() for name in PROCESS_EXCLUSIVE_RESOURCES}
+
+def get_process_lock(resource: str) -> threading.Lock:
+    """The process-wide lock of one of the PROCESS_EXCLUSIVE_RESOURCES tags, for code outside of nodes"""
+    return _process_locks[resource]
+
+def get_node_resources(class_def) -> frozenset[str]:
+    """Get the resource tags a node contends for.
+
+    Nodes declare them with a RESOURCES class attribute, e.g. RESOURCES = ("cpu",) or
+    RESOURCES = ("llm",). Nodes sharing a tag never run concurrently. An empty tuple means
+    the node can run alongside anything.
+    """
+    resources = getattr(class_def, "RESOURCES", None)
+    if resources is None:
+        return DEFAULT_NODE_RESOURCES
+    if isinstance(resources, str):
+        resources = (resources,)
+    return frozenset(r.lower() for r in resources)
+
+class ResourceScheduler:
+    """
+    Decides which ready nodes may start, given the nodes that are already running.
+    At most max_workers nodes run at once and each resource tag is held by at most
+    capacities.get(tag, 1) nodes.
+    """
+    def __init__(self, max_workers: int, capacities: Optional[dict[str, int]] = None):
+        self.max_workers = max(1, max_workers)
+        self.capacities = capacities or {}
+        self.running: dict[str, frozenset[str]] = {}
+        self.in_use: dict[str, int] = {}
+
+    def can_start(self, resources: Iterable[str]) -> bool:
+        if len(self.running) >= self.max_workers:
+            return False
+        return all(self.in_use.get(r, 0) < self.capacities.get(r, 1) for r in resources)
+
+    def acquire(self, node_id: str, resources: frozenset[str]):
+        assert node_id not in self.running, f"Node {node_id} is already running"
+        self.running[node_id] = resources
+        for r in resources:
+            self.in_use[r] = self.in_use.get(r, 0) + 1
+
+    def release(self, node_id: str):
+        for r in self.running.pop(node_id):
+            self.in_use[r] -= 1
+
+    def is_running(self, node_id: str) -> bool:
+        return node_id in self.running
+
+    def pick(self, candidates: Iterable[str], get_resources: Callable[[str], frozenset[str]]) -> list[str]:
+        """Acquire resources for as many candidates as possible (in order) and return them"""
+        picked = []
+        for node_id in candidates:
+            if self.is_running(node_id):
+                continue
+            resources = get_resources(node_id)
+            if self.can_start(resources):
+                self.acquire(node_id, resources)
+                picked.append(node_id)
+        return picked
+
+class _LockWaiter:
+    """
+    Waits for a lock in a worker thread. If the waiting task is cancelled, the lock is released
+    by whichever side sees the other finish last, so it can't be left held by nobody.
+    """
+    def __init__(self, lock: threading.Lock):
+        self.lock = lock
+        self.guard = threading.Lock()
+        self.acquired = False
+        self.abandoned = False
+
+    def wait(self):
+        while True:
+            got_lock = self.lock.acquire(timeout=0.1)
+            with self.guard:
+                if self.abandoned:
+                    if got_lock:
+                        self.lock.release()
+                    return
+                if got_lock:
+                    self.acquired = True
+                    return
+
+    def abandon(self):
+        with self.guard:
+            self.abandoned = True
+            if self.acquired:
+                self.lock.release()
+
+@contextlib.asynccontextmanager
+async def hold_process_resources(resources: Iterable[str]):
+    """Hold the process-wide locks of the given tags, waiting off the event loop when contended"""
+    locks = [_process_locks[r] for r in sorted(resources) if r in _process_locks]
+    acquired = []
+    try:
+        for lock in locks:
+            if not lock.acquire(blocking=False):
+                waiter = _LockWaiter(lock)
+                try:
+                    await asyncio.to_thread(waiter.wait)
+                except BaseException:
+                    waiter.abandon()
+                    raise
+            acquired.append(lock)
+        yield
+    finally:
+        for lock in reversed(acquired):
+            lock.release()
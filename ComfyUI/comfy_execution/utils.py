@@ -1,5 +1,6 @@
 import contextvars
-from typing import Optional, NamedTuple
+import os
+from typing import Any, Optional, NamedTuple
 
 class ExecutionContext(NamedTuple):
     """
@@ -44,3 +45,32 @@ class CurrentNodeContext:
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self.token is not None:
             current_executing_context.reset(self.token)
+
+class WorkerContext(NamedTuple):
+    """
+    Context information about the prompt worker running the current prompt.
+
+    Attributes:
+        worker_id: Index of the prompt worker
+        device: Device or provider the worker is pinned to (e.g. "cpu", "cuda:1"), None for no preference
+        threads: CPU thread budget of the worker, None for no limit
+        server: The server view the worker reports through
+    """
+    worker_id: int
+    device: Optional[str]
+    threads: Optional[int]
+    server: Any
+
+current_worker_context: contextvars.ContextVar[Optional[WorkerContext]] = contextvars.ContextVar("current_worker_context", default=None)
+
+def get_worker_context() -> Optional[WorkerContext]:
+    """Get the worker context, or None when prompts run on the single default worker."""
+    return current_worker_context.get(None)
+
+def configured_worker_contexts(args, server: Any = None) -> list[WorkerContext]:
+    """The contexts of the prompt workers --prompt-workers starts, empty for the single default worker."""
+    if args.prompt_workers <= 1:
+        return []
+    devices = [d.strip() for d in args.prompt_worker_devices.split(",") if d.strip()] or [None]
+    threads = args.prompt_worker_threads or max(1, (os.cpu_count() or 1) // args.prompt_workers)
+    return [WorkerContext(worker_id=i, device=devices[i % len(devices)], threads=threads, server=server) for i in range(args.prompt_workers)]
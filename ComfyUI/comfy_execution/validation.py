@@ -1,4 +1,11 @@
 from __future__ import annotations
+import copy
+import hashlib
+import json
+from collections import OrderedDict
+
+import folder_paths
+from comfy_execution.graph_utils import is_link
 
 
 def validate_node_input(
@@ -37,3 +44,87 @@ def validate_node_input(
     else:
         # In non-strict mode, there must be at least one type in common
         return len(received_types.intersection(input_types)) > 0
+
+
+class ValidationTemplate:
+    """
+    The validated form of one workflow structure: what validate_prompt found for each node,
+    the literal input values it was validated with (before and after conversion) and the
+    directories and model lists each node's INPUT_TYPES read.
+    """
+    def __init__(self, outputs: list[str], raw: dict, converted: dict, dependencies: dict, always_validate: set[str]):
+        self.outputs = outputs
+        self.raw = raw
+        self.converted = converted
+        self.dependencies = dependencies
+        self.always_validate = always_validate
+
+    def changed_nodes(self, raw: dict) -> set[str]:
+        """Nodes that have to be validated again for a prompt whose literal inputs are raw"""
+        changed = set(self.always_validate)
+        stamps = {}
+        for node_id, dependencies in self.dependencies.items():
+            if node_id in changed:
+                continue
+            if raw.get(node_id) != self.raw.get(node_id):
+                changed.add(node_id)
+                continue
+            for dependency, stamp in dependencies.items():
+                if dependency not in stamps:
+                    stamps[dependency] = folder_paths.listing_dependency_stamp(dependency)
+                if stamps[dependency] != stamp:
+                    changed.add(node_id)
+                    break
+        return changed
+
+    def apply(self, prompt: dict, skip: set[str]):
+        """Give the unchanged nodes the converted values validation would have produced"""
+        for node_id, converted in self.converted.items():
+            if node_id not in skip:
+                prompt[node_id]["inputs"].update(copy.deepcopy(converted))
+
+    def update(self, prompt: dict, raw: dict, dependencies: dict):
+        """Take over the values of nodes that were validated again"""
+        for node_id, node_dependencies in dependencies.items():
+            self.raw[node_id] = raw.get(node_id)
+            self.converted[node_id] = literal_inputs(prompt[node_id])
+            self.dependencies[node_id] = node_dependencies
+
+
+def literal_inputs(node: dict) -> dict:
+    return {name: copy.deepcopy(value) for name, value in node.get("inputs", {}).items() if not is_link(value)}
+
+
+def prompt_structure_key(prompt: dict, partial_execution_list) -> str:
+    """Hash of a prompt's graph (node classes, links and input names) ignoring widget values"""
+    structure = []
+    for node_id in sorted(prompt, key=str):
+        node = prompt[node_id]
+        inputs = node.get("inputs", {}) if isinstance(node, dict) else {}
+        structure.append([str(node_id), node.get("class_type") if isinstance(node, dict) else None,
+                          sorted([name, value if is_link(value) else None] for name, value in inputs.items())])
+    partial = sorted(partial_execution_list) if partial_execution_list is not None else None
+    data = json.dumps([structure, partial], default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+class ValidationTemplateCache:
+    """Most recently used validation templates by prompt structure"""
+    def __init__(self, max_templates: int = 64):
+        self.max_templates = max_templates
+        self.templates: OrderedDict[str, ValidationTemplate] = OrderedDict()
+
+    def get(self, key: str) -> ValidationTemplate | None:
+        template = self.templates.get(key)
+        if template is not None:
+            self.templates.move_to_end(key)
+        return template
+
+    def put(self, key: str, template: ValidationTemplate):
+        self.templates[key] = template
+        self.templates.move_to_end(key)
+        while len(self.templates) > self.max_templates:
+            self.templates.popitem(last=False)
+
+    def clear(self):
+        self.templates.clear()
@@ -10,9 +10,13 @@ from .birefnet_hr_node import NODE_CLASS_MAPPINGS as BIREFNET_HR_MAPPINGS, NODE_
 from .image_resize_nodes import NODE_CLASS_MAPPINGS as RESIZE_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as RESIZE_DISPLAY
 from .smart_resize_nodes import NODE_CLASS_MAPPINGS as SMART_RESIZE_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as SMART_RESIZE_DISPLAY
 from .memory_management_nodes import NODE_CLASS_MAPPINGS as MEMORY_MAPPINGS, NODE_DISPLAY_NAME_MAPPINGS as MEMORY_DISPLAY
+from . import onnx_session_pool
 
 # Merge all node mappings
 NODE_CLASS_MAPPINGS = {**BEN2_MAPPINGS, **BIREFNET_MAPPINGS, **BIREFNET_HR_MAPPINGS, **RESIZE_MAPPINGS, **SMART_RESIZE_MAPPINGS, **MEMORY_MAPPINGS}
 NODE_DISPLAY_NAME_MAPPINGS = {**BEN2_DISPLAY, **BIREFNET_DISPLAY, **BIREFNET_HR_DISPLAY, **RESIZE_DISPLAY, **SMART_RESIZE_DISPLAY, **MEMORY_DISPLAY}
 
+# Warm the shared ONNX session pool (ONNX_PRELOAD_MODELS) so the first request skips session creation
+onnx_session_pool.start_preload()
+
 __all__ = ["NODE_CLASS_MAPPINGS", "NODE_DISPLAY_NAME_MAPPINGS"]
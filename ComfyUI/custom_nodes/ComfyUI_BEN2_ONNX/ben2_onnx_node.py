@@ -5,10 +5,14 @@ Uses ONNX runtime for inference - no GPL3 dependencies
 
 import os
 import torch
-import numpy as np
-from PIL import Image, ImageFilter
 import folder_paths
-import torch.nn.functional as F
+
+from . import mask_cache
+from .onnx_batching import get_chunk_size, run_batched
+from .onnx_session_pool import get_session
+from .tensor_ops import (
+    preprocess_batch, letterbox_batch, crop_letterbox, postprocess_masks, resize_images, refine_and_composite
+)
 
 try:
     import onnxruntime
@@ -16,6 +20,9 @@ except ImportError:
     print("Warning: onnxruntime not installed. Install with: pip install onnxruntime or onnxruntime-gpu")
     onnxruntime = None
 
+# BEN2 input resolution
+MODEL_SIZE = (1024, 1024)
+
 
 class BEN2_ONNX_RemoveBg:
     """
@@ -23,10 +30,6 @@ class BEN2_ONNX_RemoveBg:
     Uses the ONNX model from PramaLLC/BEN2 for background removal
     """
     
-    def __init__(self):
-        self.session = None
-        self.model_path = None
-    
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -40,6 +43,11 @@ class BEN2_ONNX_RemoveBg:
                 "sensitivity": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 1.0, "step": 0.01}),
                 "mask_blur": ("INT", {"default": 0, "min": 0, "max": 64, "step": 1}),
                 "mask_offset": ("INT", {"default": 0, "min": -64, "max": 64, "step": 1}),
+                "max_batch_size": ("INT", {"default": 4, "min": 1, "max": 64, "step": 1, "tooltip": "Images stacked into a single ONNX run. Lower this if the GPU runs out of memory"}),
+                "resize_mode": (["stretch", "letterbox"], {"default": "stretch", "tooltip": "letterbox keeps the aspect ratio and pads to the model input instead of squashing the image"}),
+                "original_width": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1, "tooltip": "Connect from Smart Resize to output at the original size in one resample (0 = keep input size)"}),
+                "original_height": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1, "tooltip": "Connect from Smart Resize to output at the original size in one resample (0 = keep input size)"}),
+                "use_mask_cache": ("BOOLEAN", {"default": True, "tooltip": "Reuse masks of previously seen images (same pixels and settings) instead of running the model again"}),
             }
         }
     
@@ -47,6 +55,7 @@ class BEN2_ONNX_RemoveBg:
     RETURN_NAMES = ("image", "mask")
     FUNCTION = "remove_background"
     CATEGORY = "image/preprocessing"
+    RESOURCES = ("onnx",)
     
     def get_model_path(self):
         """Get the path to the BEN2 ONNX model"""
@@ -64,41 +73,11 @@ class BEN2_ONNX_RemoveBg:
         return model_path
     
     def load_model(self, provider="CPU"):
-        """Load the ONNX model with specified provider"""
+        """Get the shared ONNX session for the specified provider"""
         if onnxruntime is None:
             raise ImportError("onnxruntime not installed. Install with: pip install onnxruntime or onnxruntime-gpu")
         
-        model_path = self.get_model_path()
-        
-        # Only reload if model path changed or session doesn't exist
-        if self.session is None or self.model_path != model_path:
-            providers_map = {
-                "CPU": ["CPUExecutionProvider"],
-                "CUDA": ["CUDAExecutionProvider", "CPUExecutionProvider"],
-                "DirectML": ["DmlExecutionProvider", "CPUExecutionProvider"],
-            }
-            
-            providers = providers_map.get(provider, ["CPUExecutionProvider"])
-            
-            # Create session options with explicit thread settings
-            # This prevents pthread_setaffinity_np errors on containers with limited CPUs
-            sess_options = onnxruntime.SessionOptions()
-            sess_options.intra_op_num_threads = int(os.environ.get('OMP_NUM_THREADS', '8'))
-            sess_options.inter_op_num_threads = int(os.environ.get('OMP_NUM_THREADS', '8'))
-            sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
-            
-            print(f"Loading BEN2 ONNX model from {model_path} with providers: {providers}")
-            print(f"Thread settings: intra={sess_options.intra_op_num_threads}, inter={sess_options.inter_op_num_threads}")
-            self.session = onnxruntime.InferenceSession(model_path, sess_options=sess_options, providers=providers)
-            self.model_path = model_path
-    
-    def tensor2pil(self, image):
-        """Convert tensor to PIL Image"""
-        return Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
-    
-    def pil2tensor(self, image):
-        """Convert PIL Image to tensor"""
-        return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+        return get_session(self.get_model_path(), provider)
     
     def parse_hex_color(self, hex_color):
         """Parse hex color to RGB tuple"""
@@ -119,60 +98,36 @@ class BEN2_ONNX_RemoveBg:
             print(f"Invalid hex color: {hex_color}, using white as fallback")
             return (255, 255, 255)
     
-    def preprocess_image(self, image_tensor):
-        """Preprocess image for model input"""
-        # Convert ComfyUI tensor format to PIL
-        pil_image = self.tensor2pil(image_tensor)
-        
-        # Convert to RGB if needed
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        original_size = pil_image.size
-        
-        # Resize to 1024x1024
-        resized = pil_image.resize((1024, 1024), Image.BILINEAR)
-        
-        # Convert to tensor and normalize to [0, 1]
-        img_array = np.array(resized).astype(np.float32) / 255.0
-        
-        # Transpose to CHW format
-        img_array = img_array.transpose(2, 0, 1)
-        
-        # Add batch dimension
-        img_array = np.expand_dims(img_array, axis=0)
-        
-        return img_array, pil_image, original_size
-    
-    def postprocess_mask(self, result_np, original_size):
-        """Postprocess model output to get mask"""
-        result = torch.from_numpy(result_np)
-        
-        if len(result.shape) == 3:
-            result = result.unsqueeze(0)
-        
-        # Resize to original size
-        w, h = original_size
-        result = torch.squeeze(F.interpolate(result, size=(h, w), mode='bilinear'), 0)
-        
-        # Normalize to [0, 1]
-        ma = torch.max(result)
-        mi = torch.min(result)
-        if ma > mi:
-            result = (result - mi) / (ma - mi)
-        
-        # Convert to numpy array [0, 255]
-        mask_array = (result * 255).permute(1, 2, 0).cpu().data.numpy().astype(np.uint8)
-        mask_array = np.squeeze(mask_array)
+    def compute_masks(self, session, image, output_size, max_batch_size, resize_mode):
+        """Raw [N,H,W] masks at output_size, before sensitivity and edge refinement"""
+        # Float32 [3,H,W] per frame
+        chunk_size = get_chunk_size(session, max_batch_size, 3 * MODEL_SIZE[0] * MODEL_SIZE[1] * 4)
+        masks = []
+        
+        for start in range(0, image.shape[0], chunk_size):
+            chunk = image[start:start + chunk_size]
+            
+            # Preprocess the chunk into a single [N,3,1024,1024] input
+            if resize_mode == "letterbox":
+                input_data, box = letterbox_batch(chunk, MODEL_SIZE)
+            else:
+                input_data = preprocess_batch(chunk, MODEL_SIZE)
+            
+            # Run inference (ONNX Runtime takes host memory)
+            outputs = run_batched(session, input_data.cpu().numpy(), chunk_size)
+            
+            # Postprocess straight to the output size on the image's device
+            result = torch.from_numpy(outputs[0]).to(chunk.device)
+            if resize_mode == "letterbox":
+                result = crop_letterbox(result, box, MODEL_SIZE)
+            masks.append(postprocess_masks(result, output_size))
         
-        return mask_array
+        return torch.cat(masks, dim=0)
     
     def remove_background(self, image, provider="CPU", background_color="none", custom_hex_color="#FFFFFF", 
-                         sensitivity=1.0, mask_blur=0, mask_offset=0):
+                         sensitivity=1.0, mask_blur=0, mask_offset=0, max_batch_size=4,
+                         resize_mode="stretch", original_width=0, original_height=0, use_mask_cache=True):
         """Remove background from image using BEN2 ONNX model"""
-        # Load model
-        self.load_model(provider)
-        
         # Determine background color
         color_presets = {
             "white": (255, 255, 255),
@@ -189,73 +144,38 @@ class BEN2_ONNX_RemoveBg:
         else:
             bg_color = None  # None means transparent (RGBA)
         
-        # Process each image in batch
-        batch_size = image.shape[0]
-        output_images = []
-        output_masks = []
-        
-        for i in range(batch_size):
-            # Preprocess
-            input_data, original_pil, original_size = self.preprocess_image(image[i])
-            
-            # Run inference
-            input_name = self.session.get_inputs()[0].name
-            outputs = self.session.run(None, {input_name: input_data})
-            
-            # Postprocess to get mask
-            mask_array = self.postprocess_mask(outputs[0], original_size)
-            
-            # Apply sensitivity adjustment
-            mask_tensor = torch.from_numpy(mask_array.astype(np.float32) / 255.0)
-            mask_tensor = mask_tensor * (1 + (1 - sensitivity))
-            mask_tensor = torch.clamp(mask_tensor, 0, 1)
-            mask_array = (mask_tensor.numpy() * 255).astype(np.uint8)
-            
-            mask_pil = Image.fromarray(mask_array)
-            
-            # Apply mask blur
-            if mask_blur > 0:
-                mask_pil = mask_pil.filter(ImageFilter.GaussianBlur(radius=mask_blur))
-            
-            # Apply mask offset (expand/contract)
-            if mask_offset > 0:
-                # Expand mask
-                for _ in range(mask_offset):
-                    mask_pil = mask_pil.filter(ImageFilter.MaxFilter(3))
-            elif mask_offset < 0:
-                # Contract mask
-                for _ in range(-mask_offset):
-                    mask_pil = mask_pil.filter(ImageFilter.MinFilter(3))
-            
-            # Create RGBA image with alpha channel
-            result_image = original_pil.copy()
-            if result_image.mode != 'RGBA':
-                result_image = result_image.convert('RGBA')
-            result_image.putalpha(mask_pil)
-            
-            # Handle background based on user choice
-            if bg_color is None:
-                # Keep RGBA format (4 channels with transparency)
-                result_tensor = self.pil2tensor(result_image)
-            else:
-                # Add solid background color and convert to RGB
-                bg_image = Image.new('RGB', result_image.size, bg_color)
-                bg_image.paste(result_image, mask=mask_pil)
-                result_tensor = self.pil2tensor(bg_image)
-            
-            # Convert mask to tensor (single channel)
-            mask_tensor = torch.from_numpy(mask_array.astype(np.float32) / 255.0).unsqueeze(0).unsqueeze(0)
-            
-            output_images.append(result_tensor)
-            output_masks.append(mask_tensor)
+        # Output at the upstream original size when Smart Resize passes it through
+        if original_width > 0 and original_height > 0:
+            output_size = (original_height, original_width)
+        else:
+            output_size = tuple(image.shape[1:3])
         
-        # Stack all results
-        final_images = torch.cat(output_images, dim=0)
-        final_masks = torch.cat(output_masks, dim=0).squeeze(1)  # Remove channel dimension for mask
+        # Masks of repeat images come from the cache, only the rest go through the model
+        batch_size = image.shape[0]
+        masks = [None] * batch_size
+        missing = list(range(batch_size))
+        keys = None
+        if use_mask_cache:
+            keys = mask_cache.make_keys("BEN2_ONNX_RemoveBg", self.get_model_path(), image, {
+                "resize_mode": resize_mode,
+                "output_size": list(output_size),
+            })
+            masks, missing = mask_cache.lookup(keys, image.device)
+            if len(missing) < batch_size:
+                print(f"[BEN2_ONNX_RemoveBg] Mask cache: {batch_size - len(missing)}/{batch_size} hits")
+        
+        if missing:
+            session = self.load_model(provider)
+            computed = self.compute_masks(session, image[missing], output_size, max_batch_size, resize_mode)
+            for i, mask in zip(missing, computed):
+                masks[i] = mask_cache.put(keys[i], mask) if keys is not None else mask
+        
+        final_images, final_masks = refine_and_composite(
+            resize_images(image, output_size), torch.stack(masks, dim=0), bg_color, sensitivity, mask_blur, mask_offset
+        )
         
         return (final_images, final_masks)
 
-
 NODE_CLASS_MAPPINGS = {
     "BEN2_ONNX_RemoveBg": BEN2_ONNX_RemoveBg
 }
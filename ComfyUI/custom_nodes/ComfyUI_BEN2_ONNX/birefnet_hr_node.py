@@ -7,17 +7,23 @@ MIT License - Free for commercial use
 import os
 import torch
 import numpy as np
-from PIL import Image, ImageFilter
+from PIL import Image
 import folder_paths
 import torch.nn.functional as F
 from torchvision import transforms
 
+from . import mask_cache
+from .tensor_ops import refine_and_composite
+
 # Register BiRefNet_HR models directory
 birefnet_hr_dir = os.path.join(folder_paths.models_dir, "birefnet_hr")
 os.makedirs(birefnet_hr_dir, exist_ok=True)
 if birefnet_hr_dir not in folder_paths.folder_names_and_paths:
     folder_paths.folder_names_and_paths["birefnet_hr"] = ([birefnet_hr_dir], set())
 
+# Weights file names saved by save_pretrained / huggingface-cli, in order of preference
+WEIGHTS_FILES = ("model.safetensors", "pytorch_model.bin")
+
 try:
     from transformers import AutoModelForImageSegmentation
 except ImportError:
@@ -53,6 +59,7 @@ class BiRefNet_HR_RemoveBg:
                 "mask_offset": ("INT", {"default": 0, "min": -64, "max": 64, "step": 1}),
                 "process_resolution": ("INT", {"default": 2048, "min": 1024, "max": 2560, "step": 256, "tooltip": "Higher resolution for better quality. BiRefNet_HR supports up to 2560x2560"}),
                 "use_fp16": ("BOOLEAN", {"default": True, "tooltip": "Use half precision (faster, less VRAM)"}),
+                "use_mask_cache": ("BOOLEAN", {"default": True, "tooltip": "Reuse masks of previously seen images (same pixels and settings) instead of running the model again"}),
             }
         }
     
@@ -60,6 +67,16 @@ class BiRefNet_HR_RemoveBg:
     RETURN_NAMES = ("image", "mask")
     FUNCTION = "remove_background"
     CATEGORY = "image/preprocessing"
+    RESOURCES = ("gpu",)
+    
+    def get_weights_path(self, model_variant):
+        """Weights file of a local model, searched in the HuggingFace cache layout too (falls back to the directory)"""
+        model_path = os.path.join(birefnet_hr_dir, model_variant)
+        for root, _, files in os.walk(model_path):
+            for name in WEIGHTS_FILES:
+                if name in files:
+                    return os.path.join(root, name)
+        return model_path
     
     def load_model(self, model_variant, use_fp16=True):
         """Load BiRefNet model from local ComfyUI models directory"""
@@ -129,10 +146,6 @@ class BiRefNet_HR_RemoveBg:
         """Convert tensor to PIL Image"""
         return Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
     
-    def pil2tensor(self, image):
-        """Convert PIL Image to tensor"""
-        return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
-    
     def parse_hex_color(self, hex_color):
         """Parse hex color to RGB tuple"""
         hex_color = hex_color.strip().lstrip('#')
@@ -211,11 +224,8 @@ class BiRefNet_HR_RemoveBg:
     def remove_background(self, image, model_variant="BiRefNet_HR", 
                          background_color="none", custom_hex_color="#FFFFFF",
                          sensitivity=1.0, mask_blur=0, mask_offset=0,
-                         process_resolution=2048, use_fp16=True):
+                         process_resolution=2048, use_fp16=True, use_mask_cache=True):
         """Remove background using BiRefNet_HR model"""
-        # Load model
-        self.load_model(model_variant, use_fp16)
-        
         # Determine background color
         color_presets = {
             "white": (255, 255, 255),
@@ -232,14 +242,26 @@ class BiRefNet_HR_RemoveBg:
         else:
             bg_color = None  # None means transparent (RGBA)
         
-        # Process each image in batch
+        # Masks of repeat images come from the cache, only the rest go through the model
         batch_size = image.shape[0]
-        output_images = []
-        output_masks = []
+        output_masks = [None] * batch_size
+        missing = list(range(batch_size))
+        keys = None
+        if use_mask_cache:
+            keys = mask_cache.make_keys("BiRefNet_HR_RemoveBg", self.get_weights_path(model_variant), image, {
+                "process_resolution": process_resolution,
+                "fp16": use_fp16 and self.device == "cuda",
+            })
+            output_masks, missing = mask_cache.lookup(keys, "cpu")
+            if len(missing) < batch_size:
+                print(f"[BiRefNet_HR_RemoveBg] Mask cache: {batch_size - len(missing)}/{batch_size} hits")
+        
+        if missing:
+            self.load_model(model_variant, use_fp16)
         
-        for i in range(batch_size):
+        for i in missing:
             # Preprocess
-            input_tensor, original_pil, original_size = self.preprocess_image(
+            input_tensor, _, original_size = self.preprocess_image(
                 image[i], process_resolution, use_fp16
             )
             
@@ -250,51 +272,15 @@ class BiRefNet_HR_RemoveBg:
             # Postprocess to get mask
             mask_array = self.postprocess_mask(preds, original_size)
             
-            # Apply sensitivity adjustment
-            mask_tensor = torch.from_numpy(mask_array.astype(np.float32) / 255.0)
-            mask_tensor = mask_tensor * (1 + (1 - sensitivity))
-            mask_tensor = torch.clamp(mask_tensor, 0, 1)
-            mask_array = (mask_tensor.numpy() * 255).astype(np.uint8)
-            
-            mask_pil = Image.fromarray(mask_array)
-            
-            # Apply mask blur
-            if mask_blur > 0:
-                mask_pil = mask_pil.filter(ImageFilter.GaussianBlur(radius=mask_blur))
-            
-            # Apply mask offset (expand/contract)
-            if mask_offset > 0:
-                for _ in range(mask_offset):
-                    mask_pil = mask_pil.filter(ImageFilter.MaxFilter(3))
-            elif mask_offset < 0:
-                for _ in range(-mask_offset):
-                    mask_pil = mask_pil.filter(ImageFilter.MinFilter(3))
-            
-            # Create RGBA image with alpha channel
-            result_image = original_pil.copy()
-            if result_image.mode != 'RGBA':
-                result_image = result_image.convert('RGBA')
-            result_image.putalpha(mask_pil)
-            
-            # Handle background based on user choice
-            if bg_color is None:
-                # Keep RGBA format (4 channels with transparency)
-                result_tensor = self.pil2tensor(result_image)
-            else:
-                # Add solid background color and convert to RGB
-                bg_image = Image.new('RGB', result_image.size, bg_color)
-                bg_image.paste(result_image, mask=mask_pil)
-                result_tensor = self.pil2tensor(bg_image)
-            
-            # Convert mask to tensor (single channel)
-            mask_tensor = torch.from_numpy(mask_array.astype(np.float32) / 255.0).unsqueeze(0).unsqueeze(0)
-            
-            output_images.append(result_tensor)
-            output_masks.append(mask_tensor)
+            output_masks[i] = torch.from_numpy(mask_array.astype(np.float32) / 255.0)
+            if keys is not None:
+                output_masks[i] = mask_cache.put(keys[i], output_masks[i])
         
-        # Stack all results
-        final_images = torch.cat(output_images, dim=0)
-        final_masks = torch.cat(output_masks, dim=0).squeeze(1)  # Remove channel dimension for mask
+        # Refine all masks and composite as one batch
+        masks = torch.stack(output_masks, dim=0).to(image.device)
+        final_images, final_masks = refine_and_composite(
+            image, masks, bg_color, sensitivity, mask_blur, mask_offset
+        )
         
         return (final_images, final_masks)
 
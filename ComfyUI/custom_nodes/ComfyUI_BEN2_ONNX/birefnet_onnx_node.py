@@ -6,11 +6,18 @@ BiRefNet: Bilateral Reference for High-Resolution Dichotomous Image Segmentation
 
 import os
 import torch
-import numpy as np
-from PIL import Image, ImageFilter
 import folder_paths
 import torch.nn.functional as F
 
+from . import mask_cache
+from .onnx_batching import run_batched
+from .onnx_session_pool import get_session
+from .tensor_ops import (
+    IMAGENET_MEAN, IMAGENET_STD, preprocess_batch, letterbox_batch, crop_letterbox,
+    postprocess_masks, resize_images, refine_and_composite
+)
+from .tiled_inference import get_fixed_spatial_size, run_tiled, to_probabilities
+
 try:
     import onnxruntime
 except ImportError:
@@ -25,11 +32,6 @@ class BiRefNet_ONNX_RemoveBg:
     MIT License - Free for commercial use
     """
     
-    def __init__(self):
-        self.session = None
-        self.model_path = None
-        self.current_model = None
-    
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -45,6 +47,13 @@ class BiRefNet_ONNX_RemoveBg:
                 "mask_blur": ("INT", {"default": 0, "min": 0, "max": 64, "step": 1}),
                 "mask_offset": ("INT", {"default": 0, "min": -64, "max": 64, "step": 1}),
                 "process_resolution": ("INT", {"default": 1024, "min": 512, "max": 2048, "step": 64}),
+                "inference_mode": (["standard", "tiled"], {"default": "standard", "tooltip": "tiled: overlapping native-resolution tiles guided by a low-res global pass, for fine detail on large images"}),
+                "tile_overlap": ("INT", {"default": 128, "min": 0, "max": 512, "step": 16, "tooltip": "Pixels shared between neighbouring tiles in tiled mode"}),
+                "max_batch_size": ("INT", {"default": 4, "min": 1, "max": 64, "step": 1, "tooltip": "Images or tiles stacked into a single ONNX run"}),
+                "resize_mode": (["stretch", "letterbox"], {"default": "stretch", "tooltip": "letterbox keeps the aspect ratio and pads to the model input instead of squashing the image"}),
+                "original_width": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1, "tooltip": "Connect from Smart Resize to output at the original size in one resample (0 = keep input size)"}),
+                "original_height": ("INT", {"default": 0, "min": 0, "max": 16384, "step": 1, "tooltip": "Connect from Smart Resize to output at the original size in one resample (0 = keep input size)"}),
+                "use_mask_cache": ("BOOLEAN", {"default": True, "tooltip": "Reuse masks of previously seen images (same pixels and settings) instead of running the model again"}),
             }
         }
     
@@ -52,6 +61,7 @@ class BiRefNet_ONNX_RemoveBg:
     RETURN_NAMES = ("image", "mask")
     FUNCTION = "remove_background"
     CATEGORY = "image/preprocessing"
+    RESOURCES = ("onnx",)
     
     def get_model_path(self, model_variant):
         """Get the path to the BiRefNet ONNX model"""
@@ -84,42 +94,11 @@ class BiRefNet_ONNX_RemoveBg:
         return model_path
     
     def load_model(self, model_variant, provider="CPU"):
-        """Load the ONNX model with specified provider"""
+        """Get the shared ONNX session for the variant and provider"""
         if onnxruntime is None:
             raise ImportError("onnxruntime not installed. Install with: pip install onnxruntime or onnxruntime-gpu")
         
-        model_path = self.get_model_path(model_variant)
-        
-        # Only reload if model changed or session doesn't exist
-        if self.session is None or self.model_path != model_path or self.current_model != model_variant:
-            providers_map = {
-                "CPU": ["CPUExecutionProvider"],
-                "CUDA": ["CUDAExecutionProvider", "CPUExecutionProvider"],
-                "DirectML": ["DmlExecutionProvider", "CPUExecutionProvider"],
-            }
-            
-            providers = providers_map.get(provider, ["CPUExecutionProvider"])
-            
-            # Create session options with explicit thread settings
-            # This prevents pthread_setaffinity_np errors on containers with limited CPUs
-            sess_options = onnxruntime.SessionOptions()
-            sess_options.intra_op_num_threads = int(os.environ.get('OMP_NUM_THREADS', '8'))
-            sess_options.inter_op_num_threads = int(os.environ.get('OMP_NUM_THREADS', '8'))
-            sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
-            
-            print(f"Loading BiRefNet ONNX model ({model_variant}) from {model_path} with providers: {providers}")
-            print(f"Thread settings: intra={sess_options.intra_op_num_threads}, inter={sess_options.inter_op_num_threads}")
-            self.session = onnxruntime.InferenceSession(model_path, sess_options=sess_options, providers=providers)
-            self.model_path = model_path
-            self.current_model = model_variant
-    
-    def tensor2pil(self, image):
-        """Convert tensor to PIL Image"""
-        return Image.fromarray(np.clip(255. * image.cpu().numpy().squeeze(), 0, 255).astype(np.uint8))
-    
-    def pil2tensor(self, image):
-        """Convert PIL Image to tensor"""
-        return torch.from_numpy(np.array(image).astype(np.float32) / 255.0).unsqueeze(0)
+        return get_session(self.get_model_path(model_variant), provider)
     
     def parse_hex_color(self, hex_color):
         """Parse hex color to RGB tuple"""
@@ -137,74 +116,54 @@ class BiRefNet_ONNX_RemoveBg:
             print(f"Invalid hex color: {hex_color}, using white as fallback")
             return (255, 255, 255)
     
-    def preprocess_image(self, image_tensor, process_resolution):
-        """Preprocess image for model input"""
-        pil_image = self.tensor2pil(image_tensor)
-        
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        original_size = pil_image.size
-        
-        # Resize to processing resolution (BiRefNet typically uses 1024x1024)
-        resized = pil_image.resize((process_resolution, process_resolution), Image.BILINEAR)
-        
-        # Convert to array and normalize
-        img_array = np.array(resized).astype(np.float32) / 255.0
-        
-        # Normalize with ImageNet stats
-        mean = np.array([0.485, 0.456, 0.406])
-        std = np.array([0.229, 0.224, 0.225])
-        img_array = (img_array - mean) / std
-        
-        # Transpose to CHW format
-        img_array = img_array.transpose(2, 0, 1)
-        
-        # Add batch dimension
-        img_array = np.expand_dims(img_array, axis=0).astype(np.float32)
-        
-        return img_array, pil_image, original_size
-    
-    def postprocess_mask(self, result_np, original_size):
-        """Postprocess model output to get mask"""
-        result = torch.from_numpy(result_np)
-        
-        if len(result.shape) == 4:
-            result = result.squeeze(0).squeeze(0)
-        elif len(result.shape) == 3:
-            result = result.squeeze(0)
-        
-        # Apply sigmoid if not already applied
-        if result.max() > 1.0 or result.min() < 0.0:
-            result = torch.sigmoid(result)
-        
-        # Resize to original size
-        w, h = original_size
-        result = F.interpolate(
-            result.unsqueeze(0).unsqueeze(0),
-            size=(h, w),
-            mode='bilinear',
-            align_corners=False
-        ).squeeze()
-        
-        # Normalize to [0, 1]
-        ma = torch.max(result)
-        mi = torch.min(result)
-        if ma > mi:
-            result = (result - mi) / (ma - mi)
-        
-        # Convert to numpy array [0, 255]
-        mask_array = (result * 255).cpu().data.numpy().astype(np.uint8)
-        
-        return mask_array
+    def compute_masks(self, session, image, output_size, process_resolution, inference_mode,
+                      tile_overlap, max_batch_size, resize_mode):
+        """Raw [N,H,W] masks at output_size, before sensitivity and edge refinement"""
+        # Models exported with a fixed spatial size dictate the processing resolution
+        fixed_size = get_fixed_spatial_size(session)
+        model_size = fixed_size if fixed_size is not None else (process_resolution, process_resolution)
+        original_size = tuple(image.shape[1:3])
+        
+        # Preprocess the whole batch with ImageNet normalization
+        if resize_mode == "letterbox":
+            input_data, box = letterbox_batch(image, model_size, IMAGENET_MEAN, IMAGENET_STD)
+        else:
+            input_data = preprocess_batch(image, model_size, IMAGENET_MEAN, IMAGENET_STD)
+        
+        # Run inference (ONNX Runtime takes host memory)
+        outputs = run_batched(session, input_data.cpu().numpy(), max_batch_size)
+        
+        # Get the output (BiRefNet typically outputs list, take last one)
+        output_data = outputs[-1]
+        result = torch.from_numpy(output_data).to(image.device)
+        if resize_mode == "letterbox":
+            result = crop_letterbox(result, box, model_size)
+        
+        if inference_mode == "tiled" and model_size[0] == model_size[1]:
+            # The standard pass becomes the low-res guide for native-resolution tiles
+            if result.dim() == 3:
+                result = result.unsqueeze(1)
+            guides = F.interpolate(
+                to_probabilities(result[:, :1].float()), size=original_size,
+                mode='bilinear', align_corners=False
+            )[:, 0]
+            result = torch.stack([
+                run_tiled(session, image[i], guides[i], model_size[0], tile_overlap,
+                          max_batch_size, IMAGENET_MEAN, IMAGENET_STD)
+                for i in range(image.shape[0])
+            ], dim=0)
+        elif inference_mode == "tiled":
+            print(f"Tiled mode needs a square model input, got {model_size}; using standard mode")
+        
+        # Postprocess straight to the output size on the image's device
+        return postprocess_masks(result, output_size, sigmoid_if_logits=True)
     
     def remove_background(self, image, model_variant="general", provider="CPU", 
                          background_color="none", custom_hex_color="#FFFFFF", 
-                         sensitivity=1.0, mask_blur=0, mask_offset=0, process_resolution=1024):
+                         sensitivity=1.0, mask_blur=0, mask_offset=0, process_resolution=1024,
+                         inference_mode="standard", tile_overlap=128, max_batch_size=4,
+                         resize_mode="stretch", original_width=0, original_height=0, use_mask_cache=True):
         """Remove background from image using BiRefNet ONNX model"""
-        # Load model
-        self.load_model(model_variant, provider)
-        
         # Determine background color
         color_presets = {
             "white": (255, 255, 255),
@@ -221,77 +180,42 @@ class BiRefNet_ONNX_RemoveBg:
         else:
             bg_color = None  # None means transparent (RGBA)
         
-        # Process each image in batch
-        batch_size = image.shape[0]
-        output_images = []
-        output_masks = []
-        
-        for i in range(batch_size):
-            # Preprocess
-            input_data, original_pil, original_size = self.preprocess_image(image[i], process_resolution)
-            
-            # Run inference
-            input_name = self.session.get_inputs()[0].name
-            outputs = self.session.run(None, {input_name: input_data})
-            
-            # Get the output (BiRefNet typically outputs list, take last one)
-            if isinstance(outputs, (list, tuple)) and len(outputs) > 0:
-                output_data = outputs[-1] if len(outputs) > 1 else outputs[0]
-            else:
-                output_data = outputs
-            
-            # Postprocess to get mask
-            mask_array = self.postprocess_mask(output_data, original_size)
-            
-            # Apply sensitivity adjustment
-            mask_tensor = torch.from_numpy(mask_array.astype(np.float32) / 255.0)
-            mask_tensor = mask_tensor * (1 + (1 - sensitivity))
-            mask_tensor = torch.clamp(mask_tensor, 0, 1)
-            mask_array = (mask_tensor.numpy() * 255).astype(np.uint8)
-            
-            mask_pil = Image.fromarray(mask_array)
-            
-            # Apply mask blur
-            if mask_blur > 0:
-                mask_pil = mask_pil.filter(ImageFilter.GaussianBlur(radius=mask_blur))
-            
-            # Apply mask offset (expand/contract)
-            if mask_offset > 0:
-                for _ in range(mask_offset):
-                    mask_pil = mask_pil.filter(ImageFilter.MaxFilter(3))
-            elif mask_offset < 0:
-                for _ in range(-mask_offset):
-                    mask_pil = mask_pil.filter(ImageFilter.MinFilter(3))
-            
-            # Create RGBA image with alpha channel
-            result_image = original_pil.copy()
-            if result_image.mode != 'RGBA':
-                result_image = result_image.convert('RGBA')
-            result_image.putalpha(mask_pil)
-            
-            # Handle background based on user choice
-            if bg_color is None:
-                # Keep RGBA format (4 channels with transparency)
-                result_tensor = self.pil2tensor(result_image)
-            else:
-                # Add solid background color and convert to RGB
-                bg_image = Image.new('RGB', result_image.size, bg_color)
-                bg_image.paste(result_image, mask=mask_pil)
-                result_tensor = self.pil2tensor(bg_image)
-            
-            # Convert mask to tensor (single channel)
-            mask_tensor = torch.from_numpy(mask_array.astype(np.float32) / 255.0).unsqueeze(0).unsqueeze(0)
-            
-            output_images.append(result_tensor)
-            output_masks.append(mask_tensor)
+        # Output at the upstream original size when Smart Resize passes it through
+        if original_width > 0 and original_height > 0:
+            output_size = (original_height, original_width)
+        else:
+            output_size = tuple(image.shape[1:3])
         
-        # Stack all results
-        final_images = torch.cat(output_images, dim=0)
-        final_masks = torch.cat(output_masks, dim=0).squeeze(1)  # Remove channel dimension for mask
+        # Masks of repeat images come from the cache, only the rest go through the model
+        batch_size = image.shape[0]
+        masks = [None] * batch_size
+        missing = list(range(batch_size))
+        keys = None
+        if use_mask_cache:
+            keys = mask_cache.make_keys("BiRefNet_ONNX_RemoveBg", self.get_model_path(model_variant), image, {
+                "process_resolution": process_resolution,
+                "inference_mode": inference_mode,
+                "tile_overlap": tile_overlap if inference_mode == "tiled" else None,
+                "resize_mode": resize_mode,
+                "output_size": list(output_size),
+            })
+            masks, missing = mask_cache.lookup(keys, image.device)
+            if len(missing) < batch_size:
+                print(f"[BiRefNet_ONNX_RemoveBg] Mask cache: {batch_size - len(missing)}/{batch_size} hits")
+        
+        if missing:
+            session = self.load_model(model_variant, provider)
+            computed = self.compute_masks(session, image[missing], output_size, process_resolution,
+                                          inference_mode, tile_overlap, max_batch_size, resize_mode)
+            for i, mask in zip(missing, computed):
+                masks[i] = mask_cache.put(keys[i], mask) if keys is not None else mask
+        
+        final_images, final_masks = refine_and_composite(
+            resize_images(image, output_size), torch.stack(masks, dim=0), bg_color, sensitivity, mask_blur, mask_offset
+        )
         
         return (final_images, final_masks)
 
-
 NODE_CLASS_MAPPINGS = {
     "BiRefNet_ONNX_RemoveBg": BiRefNet_ONNX_RemoveBg
 }
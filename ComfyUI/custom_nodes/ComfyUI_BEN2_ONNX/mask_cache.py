@@ -0,0 +1,261 @@
+"""
+Persistent content-addressed cache for background removal masks
+Masks are keyed on a hash of the input pixels, the model file and every setting that
+changes the raw mask, so repeat images skip inference no matter how they were uploaded.
+Sensitivity, blur, offset and background color are applied after the cache and are not
+part of the key. Masks are stored as zlib compressed 8-bit images, and put() hands back the
+stored 8-bit mask so a miss returns exactly what a later hit will.
+
+Environment:
+    REMBG_MASK_CACHE_DIR: Disk location (default <user dir>/cache/rembg_masks, "" disables disk)
+    REMBG_MASK_CACHE_MB: Disk budget in MB, least recently used masks are evicted (default 2048)
+    REMBG_MASK_CACHE_MEM_MB: In-memory budget in MB for compressed masks (default 256)
+"""
+
+import hashlib
+import json
+import os
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+import folder_paths
+
+_CACHE_VERSION = 1
+_HEADER = struct.Struct("<II")
+
+_lock = threading.Lock()
+_memory = OrderedDict()  # key -> compressed blob
+_memory_bytes = 0
+_disk_bytes = None
+_model_fingerprints = {}
+_stats = {"hits": 0, "misses": 0}
+
+
+def _cache_dir():
+    default = os.path.join(folder_paths.get_user_directory(), "cache", "rembg_masks")
+    path = os.environ.get('REMBG_MASK_CACHE_DIR', default).strip()
+    return path or None
+
+
+def _disk_budget():
+    return int(os.environ.get('REMBG_MASK_CACHE_MB', '2048')) * 1024 * 1024
+
+
+def _memory_budget():
+    return int(os.environ.get('REMBG_MASK_CACHE_MEM_MB', '256')) * 1024 * 1024
+
+
+def image_digests(images):
+    """BLAKE2b of each [H,W,C] image in a ComfyUI IMAGE batch (pixel bytes plus shape)"""
+    digests = []
+    for image in images:
+        data = image.detach().to("cpu", torch.float32).contiguous().numpy()
+        h = hashlib.blake2b(digest_size=20)
+        h.update(str(data.shape).encode("ascii"))
+        h.update(memoryview(data).cast("B"))
+        digests.append(h.hexdigest())
+    return digests
+
+
+def model_fingerprint(model_path):
+    """Cheap identity of a model file or directory: real path, size and mtime"""
+    real_path = os.path.realpath(model_path)
+    try:
+        st = os.stat(real_path)
+    except OSError:
+        # Not downloaded yet, entries made now simply won't match once it is
+        return real_path
+    stamp = (st.st_size, st.st_mtime_ns)
+    entry = _model_fingerprints.get(real_path)
+    if entry is None or entry[0] != stamp:
+        entry = (stamp, f"{real_path}:{st.st_size}:{st.st_mtime_ns}")
+        _model_fingerprints[real_path] = entry
+    return entry[1]
+
+
+def make_keys(node, model_path, images, params):
+    """
+    One cache key per image in the batch
+
+    Args:
+        node: Node name, so different models never share entries
+        model_path: Model file (or directory) the masks come from
+        images: [N,H,W,C] input batch
+        params: Settings that change the raw mask (resolution, resize mode, output size, ...)
+    """
+    base = json.dumps({
+        "v": _CACHE_VERSION,
+        "node": node,
+        "model": model_fingerprint(model_path),
+        "params": params,
+    }, sort_keys=True)
+    return [hashlib.sha256(f"{base}|{digest}".encode("utf-8")).hexdigest() for digest in image_digests(images)]
+
+
+def quantize(mask):
+    """The mask as it reads back from the cache: 8-bit levels as float32, on the same device"""
+    return (mask.detach().float().clamp(0, 1) * 255).round() / 255
+
+
+def _encode(mask):
+    array = (mask.detach().float().clamp(0, 1) * 255).round().to(torch.uint8).cpu().numpy()
+    return _HEADER.pack(array.shape[0], array.shape[1]) + zlib.compress(array.tobytes(), 3)
+
+
+def _decode(blob):
+    height, width = _HEADER.unpack_from(blob)
+    data = zlib.decompress(blob[_HEADER.size:])
+    array = np.frombuffer(data, dtype=np.uint8).reshape(height, width)
+    return torch.from_numpy(array.astype(np.float32) / 255.0)
+
+
+def _entry_path(cache_dir, key):
+    return os.path.join(cache_dir, key[:2], f"{key}.mask")
+
+
+def _remember_locked(key, blob):
+    global _memory_bytes
+    old = _memory.pop(key, None)
+    if old is not None:
+        _memory_bytes -= len(old)
+    _memory[key] = blob
+    _memory_bytes += len(blob)
+    budget = _memory_budget()
+    while _memory_bytes > budget and len(_memory) > 1:
+        _, evicted = _memory.popitem(last=False)
+        _memory_bytes -= len(evicted)
+
+
+def get(key, device=None):
+    """Cached [H,W] mask for key on device, or None"""
+    with _lock:
+        blob = _memory.get(key)
+        if blob is not None:
+            _memory.move_to_end(key)
+
+    if blob is None:
+        cache_dir = _cache_dir()
+        if cache_dir:
+            path = _entry_path(cache_dir, key)
+            try:
+                with open(path, 'rb') as f:
+                    blob = f.read()
+                os.utime(path)  # LRU order on disk follows mtime
+            except OSError:
+                blob = None
+        if blob is not None:
+            with _lock:
+                _remember_locked(key, blob)
+
+    try:
+        mask = _decode(blob) if blob is not None else None
+    except (zlib.error, struct.error, ValueError):
+        mask = None
+
+    with _lock:
+        _stats["hits" if mask is not None else "misses"] += 1
+    if mask is not None and device is not None:
+        mask = mask.to(device)
+    return mask
+
+
+def _evict_disk(cache_dir):
+    """Drop the least recently used masks once the disk cache is over its budget"""
+    global _disk_bytes
+    entries = []
+    for shard in os.listdir(cache_dir):
+        shard_dir = os.path.join(cache_dir, shard)
+        if not os.path.isdir(shard_dir):
+            continue
+        for name in os.listdir(shard_dir):
+            path = os.path.join(shard_dir, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime_ns, st.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    budget = _disk_budget()
+    if total > budget:
+        entries.sort()
+        # Evict down to 90% so the directory scan does not run on every write
+        target = int(budget * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+    _disk_bytes = total
+
+
+def put(key, mask):
+    """
+    Store a [H,W] mask in memory and, if enabled, on disk
+
+    Returns:
+        The mask quantized like a cache hit, to use in place of the original
+    """
+    global _disk_bytes
+    blob = _encode(mask)
+    with _lock:
+        _remember_locked(key, blob)
+    stored = quantize(mask)
+
+    cache_dir = _cache_dir()
+    if not cache_dir:
+        return stored
+    path = _entry_path(cache_dir, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(blob)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[MaskCache] Could not write cache entry: {e}")
+        return stored
+
+    with _lock:
+        if _disk_bytes is None or _disk_bytes + len(blob) > _disk_budget():
+            _evict_disk(cache_dir)
+        else:
+            _disk_bytes += len(blob)
+    return stored
+
+
+def lookup(keys, device):
+    """Cached masks for a batch of keys (None where missing) and the indices that missed"""
+    masks = [get(key, device) for key in keys]
+    missing = [i for i, mask in enumerate(masks) if mask is None]
+    return masks, missing
+
+
+def stats():
+    with _lock:
+        return dict(_stats, memory_entries=len(_memory), memory_bytes=_memory_bytes)
+
+
+def clear(disk=False):
+    """Empty the in-memory cache (and the disk cache when disk=True)"""
+    global _memory_bytes, _disk_bytes
+    with _lock:
+        _memory.clear()
+        _memory_bytes = 0
+        _stats["hits"] = _stats["misses"] = 0
+        cache_dir = _cache_dir()
+        if disk and cache_dir and os.path.isdir(cache_dir):
+            for shard in os.listdir(cache_dir):
+                shard_dir = os.path.join(cache_dir, shard)
+                if os.path.isdir(shard_dir):
+                    for name in os.listdir(shard_dir):
+                        os.remove(os.path.join(shard_dir, name))
+            _disk_bytes = 0
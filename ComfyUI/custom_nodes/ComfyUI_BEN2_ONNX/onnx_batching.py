@@ -0,0 +1,118 @@
+"""
+Batched ONNX inference helpers
+Stacks preprocessed frames into a single [N,C,H,W] run instead of one run per image
+
+Chunks are capped by max_batch_size and by a per-provider memory budget, estimated as
+input bytes per frame times ACTIVATION_FACTOR to cover intermediate activations and outputs
+
+Environment:
+    ONNX_BATCH_MEMORY_MB: Memory budget per session.run call for every provider
+                          (default 2048 for CUDA, 1024 for DirectML, 4096 for CPU)
+"""
+
+import logging
+import os
+import weakref
+import numpy as np
+
+# Sessions whose graph failed a batched run despite declaring a dynamic batch dim
+_UNBATCHABLE_SESSIONS = weakref.WeakSet()
+
+# Default per-run memory budget in MB, by the session's primary execution provider
+PROVIDER_MEMORY_BUDGET_MB = {
+    "CUDAExecutionProvider": 2048,
+    "DmlExecutionProvider": 1024,
+    "CPUExecutionProvider": 4096,
+}
+DEFAULT_MEMORY_BUDGET_MB = 1024
+
+# Peak memory of a run relative to its input size (activations of the 1024px models dominate)
+ACTIVATION_FACTOR = 48
+
+
+def fixed_batch_size(session):
+    """Return the batch dimension baked into the model input, or None if it is dynamic"""
+    dim = session.get_inputs()[0].shape[0]
+    if isinstance(dim, int) and dim > 0:
+        return dim
+    return None
+
+
+def get_memory_budget(session):
+    """Per-run memory budget in bytes for the session's primary execution provider"""
+    override = os.environ.get('ONNX_BATCH_MEMORY_MB', '').strip()
+    if override:
+        return int(override) * 1024 * 1024
+    providers = session.get_providers()
+    provider = providers[0] if providers else None
+    return PROVIDER_MEMORY_BUDGET_MB.get(provider, DEFAULT_MEMORY_BUDGET_MB) * 1024 * 1024
+
+
+def get_chunk_size(session, max_batch_size, item_bytes=0):
+    """
+    Number of frames to send per session.run call
+
+    Args:
+        session: onnxruntime.InferenceSession
+        max_batch_size: Upper bound on frames per run
+        item_bytes: Input size of one frame in bytes, 0 to skip the memory budget
+    """
+    max_batch_size = max(1, int(max_batch_size))
+    if session in _UNBATCHABLE_SESSIONS:
+        return 1
+    fixed = fixed_batch_size(session)
+    if fixed is not None:
+        return fixed
+    if item_bytes > 0:
+        fits = get_memory_budget(session) // (item_bytes * ACTIVATION_FACTOR)
+        return max(1, min(max_batch_size, fits))
+    return max_batch_size
+
+
+def _run_chunk(session, input_name, chunk, chunk_size):
+    """Run one chunk, padding it up to a fixed batch size if needed"""
+    count = chunk.shape[0]
+    if count < chunk_size and fixed_batch_size(session) is not None:
+        # Fixed batch graph: repeat the last frame and drop the padded outputs
+        pad = np.repeat(chunk[-1:], chunk_size - count, axis=0)
+        chunk = np.concatenate([chunk, pad], axis=0)
+    outputs = session.run(None, {input_name: chunk})
+    return [out[:count] for out in outputs]
+
+
+def run_batched(session, input_data, max_batch_size=1):
+    """
+    Run a session over a [N,C,H,W] float32 array in chunks
+
+    Args:
+        session: onnxruntime.InferenceSession
+        input_data: Stacked model input, batch first
+        max_batch_size: Upper bound on frames per run, further limited by the memory budget
+                        (both ignored for fixed batch graphs)
+
+    Returns:
+        List of outputs, each concatenated back to N along the batch axis
+    """
+    input_name = session.get_inputs()[0].name
+    chunk_size = get_chunk_size(session, max_batch_size, input_data[0].nbytes if len(input_data) else 0)
+    total = input_data.shape[0]
+
+    results = []
+    start = 0
+    while start < total:
+        chunk = input_data[start:start + chunk_size]
+        try:
+            results.append(_run_chunk(session, input_name, chunk, chunk_size))
+        except Exception as e:
+            if chunk_size == 1 or fixed_batch_size(session) is not None:
+                raise
+            # Exported graph reshapes with a hard-coded batch of 1 - fall back to per-image runs
+            logging.warning("Batched ONNX run failed (%s), falling back to batch size 1 for this model", e)
+            _UNBATCHABLE_SESSIONS.add(session)
+            chunk_size = 1
+            continue
+        start += chunk.shape[0]
+
+    if len(results) == 1:
+        return results[0]
+    return [np.concatenate([r[k] for r in results], axis=0) for k in range(len(results[0]))]
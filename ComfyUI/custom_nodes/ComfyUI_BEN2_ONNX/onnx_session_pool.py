@@ -0,0 +1,323 @@
+"""
+Process-wide ONNX Runtime session pool
+Sessions are shared across node instances, keyed by (model path, provider, thread settings),
+and evicted least-recently-used once the pool exceeds its memory budget
+
+Environment:
+    ONNX_SESSION_POOL_MB: Memory budget for cached sessions, estimated from model file size (default 4096)
+    ONNX_PRELOAD_MODELS: Comma separated "model[:provider]" list created at import time,
+                         e.g. "ben2:CUDA,birefnet-general:CPU"
+    ONNX_OPTIMIZED_MODEL_DIR: If set, optimized graphs are saved here and loaded by later sessions
+    ONNX_GRAPH_OPT_LEVEL: Optimization level for saved graphs: basic, extended or all (default extended,
+                          "all" graphs are hardware specific and should not be shared between machines)
+
+With several prompt workers (--prompt-workers) each worker gets sessions sized to its CPU thread
+budget and, when pinned with --prompt-worker-devices, running on its own device. Preloading creates
+the sessions of every worker. Torch based nodes (BiRefNet HR, Florence-2) are not affected by the
+worker device and run on the default torch device
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import folder_paths
+from comfy.cli_args import args
+from comfy_execution.utils import configured_worker_contexts, current_worker_context, get_worker_context
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+PROVIDERS_MAP = {
+    "CPU": ["CPUExecutionProvider"],
+    "CUDA": ["CUDAExecutionProvider", "CPUExecutionProvider"],
+    "DirectML": ["DmlExecutionProvider", "CPUExecutionProvider"],
+}
+
+# Model names accepted by ONNX_PRELOAD_MODELS -> (models subdirectory, file name)
+PRELOAD_MODELS = {
+    "ben2": ("ben2_onnx", "BEN2_Base.onnx"),
+    "birefnet-general": ("birefnet_onnx", "BiRefNet-general.onnx"),
+    "birefnet-portrait": ("birefnet_onnx", "BiRefNet-portrait.onnx"),
+    "birefnet-general-lite": ("birefnet_onnx", "BiRefNet-general-lite.onnx"),
+    "birefnet-matting": ("birefnet_onnx", "BiRefNet-matting.onnx"),
+}
+
+_lock = threading.Lock()
+_sessions = OrderedDict()  # key -> (session, estimated bytes)
+_key_locks = {}  # key -> lock held while its session is created
+
+
+def get_thread_settings():
+    """Intra/inter op thread counts, explicit to avoid pthread_setaffinity_np errors in containers"""
+    worker = get_worker_context()
+    if worker is not None and worker.threads:
+        return worker.threads, worker.threads
+    threads = int(os.environ.get('OMP_NUM_THREADS', '8'))
+    return threads, threads
+
+
+def get_worker_device(provider):
+    """(provider, CUDA device id) after applying the device the current prompt worker is pinned to"""
+    worker = get_worker_context()
+    if worker is None or not worker.device:
+        return provider, None
+    device = worker.device.lower()
+    if device == "cpu":
+        return "CPU", None
+    if device.startswith("cuda"):
+        _, _, index = device.partition(":")
+        return "CUDA", int(index or 0)
+    return provider, None
+
+
+def get_memory_budget():
+    """Pool budget in bytes"""
+    return int(os.environ.get('ONNX_SESSION_POOL_MB', '4096')) * 1024 * 1024
+
+
+def _session_key(model_path, provider, device_id=None):
+    intra, inter = get_thread_settings()
+    return (os.path.realpath(model_path), provider, intra, inter, device_id)
+
+
+def _graph_opt_level():
+    """Configured ORT graph optimization level as (name, enum value)"""
+    levels = {
+        "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+        "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+        "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+    }
+    name = os.environ.get('ONNX_GRAPH_OPT_LEVEL', 'extended').strip().lower()
+    if name not in levels:
+        print(f"Unknown ONNX_GRAPH_OPT_LEVEL '{name}', using extended")
+        name = "extended"
+    return name, levels[name]
+
+
+def _file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(8 * 1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def _optimized_model_path(model_path, provider, level_name):
+    """Location of the persisted optimized graph, or None when persistence is disabled"""
+    cache_dir = os.environ.get('ONNX_OPTIMIZED_MODEL_DIR', '').strip()
+    if not cache_dir:
+        return None
+    base = os.path.splitext(os.path.basename(model_path))[0]
+    return os.path.join(cache_dir, f"{base}.{provider}.{level_name}.opt.onnx")
+
+
+def _source_info(model_path, previous=None):
+    """
+    Size, mtime and SHA-256 of the source model
+    The hash is reused from previous metadata when size and mtime are unchanged,
+    so a warm cold start does not rehash a ~1 GB model
+    """
+    st = os.stat(model_path)
+    info = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    if previous and previous.get("size") == info["size"] and previous.get("mtime_ns") == info["mtime_ns"]:
+        info["sha256"] = previous.get("sha256")
+    else:
+        info["sha256"] = _file_sha256(model_path)
+    return info
+
+
+def _load_metadata(opt_path):
+    try:
+        with open(opt_path + ".json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_optimized_model_valid(opt_path, model_path, level_name):
+    """Check a persisted graph against the source model hash and the running ORT version"""
+    if not os.path.exists(opt_path):
+        return False
+    meta = _load_metadata(opt_path)
+    if not meta:
+        return False
+    if meta.get("ort_version") != onnxruntime.__version__ or meta.get("opt_level") != level_name:
+        return False
+    source = meta.get("source", {})
+    current = _source_info(model_path, previous=source)
+    if current["sha256"] != source.get("sha256"):
+        return False
+    if current["mtime_ns"] != source.get("mtime_ns"):
+        # Same content, new timestamp (e.g. re-copied model): refresh so the next start skips the hash
+        _write_metadata(opt_path, current, level_name)
+    return True
+
+
+def _write_metadata(opt_path, source, level_name):
+    meta = {
+        "ort_version": onnxruntime.__version__,
+        "opt_level": level_name,
+        "source": source,
+    }
+    tmp_path = f"{opt_path}.json.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_path, opt_path + ".json")
+
+
+def _create_session(model_path, provider, intra, inter, device_id=None):
+    providers = PROVIDERS_MAP.get(provider, ["CPUExecutionProvider"])
+    if device_id is not None and provider == "CUDA":
+        providers = [("CUDAExecutionProvider", {"device_id": device_id})] + providers[1:]
+
+    sess_options = onnxruntime.SessionOptions()
+    sess_options.intra_op_num_threads = intra
+    sess_options.inter_op_num_threads = inter
+    sess_options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+
+    level_name, level = _graph_opt_level()
+    opt_path = _optimized_model_path(model_path, provider, level_name)
+
+    if opt_path is not None and _is_optimized_model_valid(opt_path, model_path, level_name):
+        # Graph is already optimized. A portable (basic/extended) graph still gets the
+        # hardware specific layout passes here; the saved fusions are not redone
+        if level_name == "all":
+            sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL
+        else:
+            sess_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        print(f"Loading optimized ONNX model from {opt_path} with providers: {providers}")
+        print(f"Thread settings: intra={intra}, inter={inter}")
+        return onnxruntime.InferenceSession(opt_path, sess_options=sess_options, providers=providers)
+
+    tmp_path = None
+    if opt_path is not None:
+        os.makedirs(os.path.dirname(opt_path), exist_ok=True)
+        sess_options.graph_optimization_level = level
+        tmp_path = f"{opt_path}.{os.getpid()}.tmp"
+        sess_options.optimized_model_filepath = tmp_path
+
+    print(f"Loading ONNX model from {model_path} with providers: {providers}")
+    print(f"Thread settings: intra={intra}, inter={inter}")
+    session = onnxruntime.InferenceSession(model_path, sess_options=sess_options, providers=providers)
+
+    if tmp_path is not None:
+        try:
+            source = _source_info(model_path)
+            os.replace(tmp_path, opt_path)
+            _write_metadata(opt_path, source, level_name)
+            print(f"Saved optimized ONNX model to {opt_path}")
+        except OSError as e:
+            print(f"Could not persist optimized ONNX model to {opt_path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return session
+
+
+def _evict_locked(keep_key):
+    """Drop least recently used sessions until the pool fits the budget"""
+    budget = get_memory_budget()
+    total = sum(size for _, size in _sessions.values())
+    for key in list(_sessions.keys()):
+        if total <= budget:
+            break
+        if key == keep_key:
+            continue
+        _, size = _sessions.pop(key)
+        total -= size
+        print(f"Evicted ONNX session {os.path.basename(key[0])} ({key[1]}) from pool")
+
+
+def get_session(model_path, provider="CPU"):
+    """Return a shared InferenceSession for the model, creating it on first use"""
+    if onnxruntime is None:
+        raise ImportError("onnxruntime not installed. Install with: pip install onnxruntime or onnxruntime-gpu")
+
+    provider, device_id = get_worker_device(provider)
+    key = _session_key(model_path, provider, device_id)
+
+    with _lock:
+        entry = _sessions.get(key)
+        if entry is not None:
+            _sessions.move_to_end(key)
+            return entry[0]
+        key_lock = _key_locks.setdefault(key, threading.Lock())
+
+    # Create outside the pool lock so other models stay available meanwhile
+    try:
+        with key_lock:
+            with _lock:
+                entry = _sessions.get(key)
+                if entry is not None:
+                    _sessions.move_to_end(key)
+                    return entry[0]
+
+            session = _create_session(key[0], provider, key[2], key[3], device_id)
+
+            with _lock:
+                _sessions[key] = (session, os.path.getsize(key[0]))
+                _evict_locked(keep_key=key)
+            return session
+    finally:
+        # Waiters already hold the lock object, later callers find the session in the pool
+        with _lock:
+            if _key_locks.get(key) is key_lock:
+                del _key_locks[key]
+
+
+def clear():
+    """Release every pooled session"""
+    with _lock:
+        _sessions.clear()
+
+
+def preload(spec=None):
+    """
+    Create sessions for the models listed in spec (defaults to ONNX_PRELOAD_MODELS)
+    Missing model files are skipped with a warning
+    """
+    if spec is None:
+        spec = os.environ.get('ONNX_PRELOAD_MODELS', '')
+
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, _, provider = item.partition(':')
+        name = name.strip().lower()
+        provider = provider.strip() or "CPU"
+
+        if name not in PRELOAD_MODELS:
+            print(f"Unknown model '{name}' in ONNX_PRELOAD_MODELS, expected one of: {', '.join(PRELOAD_MODELS)}")
+            continue
+
+        subdir, filename = PRELOAD_MODELS[name]
+        model_path = os.path.join(folder_paths.models_dir, subdir, filename)
+        if not os.path.exists(model_path):
+            print(f"Skipping preload of {name}: {model_path} not found")
+            continue
+
+        # Sessions are keyed by the worker's thread budget and device, so they are created
+        # the way each prompt worker will look them up
+        for worker in configured_worker_contexts(args) or [None]:
+            token = current_worker_context.set(worker)
+            try:
+                get_session(model_path, provider)
+            except Exception as e:
+                print(f"Failed to preload {name} ({provider}): {e}")
+            finally:
+                current_worker_context.reset(token)
+
+
+def start_preload():
+    """Preload configured models on a background thread so server startup is not blocked"""
+    if onnxruntime is None or not os.environ.get('ONNX_PRELOAD_MODELS', '').strip():
+        return None
+    thread = threading.Thread(target=preload, name="onnx-preload", daemon=True)
+    thread.start()
+    return thread
@@ -22,7 +22,7 @@ class SmartResizeForModel:
             "required": {
                 "image": ("IMAGE",),
                 "target_model": (["1024 (BEN2/BiRefNet)", "2048 (BiRefNet_HR)"], {"default": "2048 (BiRefNet_HR)"}),
-                "resize_mode": (["smart", "always_resize", "only_if_needed"], {"default": "smart"}),
+                "resize_mode": (["smart", "always_resize", "only_if_needed", "fit"], {"default": "smart", "tooltip": "fit: scale the long side to the model size, for the letterbox mode of the BEN2/BiRefNet nodes"}),
             },
             "optional": {
                 "interpolation": (["lanczos", "bicubic", "bilinear"], {"default": "lanczos"}),
@@ -33,6 +33,7 @@ class SmartResizeForModel:
     RETURN_NAMES = ("image", "original_width", "original_height")
     FUNCTION = "smart_resize"
     CATEGORY = "image/transform"
+    RESOURCES = ("cpu",)
     
     def tensor2pil(self, image):
         """Convert tensor to PIL Image"""
@@ -79,6 +80,17 @@ class SmartResizeForModel:
         
         return new_width, new_height
     
+    def calculate_fit_dimensions(self, orig_width, orig_height, target_side):
+        """
+        Calculate dimensions that fit inside a target_side x target_side square
+        
+        The long side becomes target_side, so a letterboxed model input only needs padding
+        """
+        scale = target_side / max(orig_width, orig_height)
+        new_width = max(1, min(target_side, int(round(orig_width * scale))))
+        new_height = max(1, min(target_side, int(round(orig_height * scale))))
+        return new_width, new_height
+    
     def smart_resize(self, image, target_model="2048 (BiRefNet_HR)", 
                      resize_mode="smart", interpolation="lanczos"):
         """
@@ -114,9 +126,16 @@ class SmartResizeForModel:
             tolerance = 0.05
             if abs(orig_pixels - target_pixels) / target_pixels < tolerance:
                 should_resize = False
+        elif resize_mode == "fit":
+            target_side = int(math.sqrt(target_pixels))
+            new_width, new_height = self.calculate_fit_dimensions(orig_width, orig_height, target_side)
+            should_resize = (new_width, new_height) != (orig_width, orig_height)
         # "always_resize" always resizes
         
-        if should_resize:
+        if should_resize and resize_mode == "fit":
+            print(f"Smart Resize: {orig_width}x{orig_height} → {new_width}x{new_height} "
+                  f"[Fit inside {model_name}²]")
+        elif should_resize:
             new_width, new_height = self.calculate_target_dimensions(
                 orig_width, orig_height, target_pixels
             )
@@ -168,6 +187,7 @@ class RestoreOriginalSize:
     RETURN_NAMES = ("image",)
     FUNCTION = "restore_size"
     CATEGORY = "image/transform"
+    RESOURCES = ("cpu",)
     
     def tensor2pil(self, image):
         """Convert tensor to PIL Image"""
@@ -0,0 +1,266 @@
+"""
+Tensor-native pre/post-processing shared by the background removal nodes
+All functions work on whole [N,H,W,C] / [N,H,W] batches and stay on the input device
+"""
+
+import math
+import torch
+import torch.nn.functional as F
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+# Padding color for letterboxed model input (before normalization)
+LETTERBOX_FILL = 0.5
+
+# Below this window width a plain max-pool is cheaper than the block prefix/suffix scan
+_RUNNING_MAX_MIN_SIZE = 17
+
+
+def to_rgb(images):
+    """Return the [N,H,W,3] RGB part of a ComfyUI IMAGE batch"""
+    channels = images.shape[-1]
+    if channels == 1:
+        return images.expand(-1, -1, -1, 3)
+    return images[..., :3]
+
+
+def _normalize(x, mean=None, std=None):
+    if mean is not None and std is not None:
+        mean_t = torch.tensor(mean, dtype=x.dtype, device=x.device).view(1, 3, 1, 1)
+        std_t = torch.tensor(std, dtype=x.dtype, device=x.device).view(1, 3, 1, 1)
+        x = (x - mean_t) / std_t
+    return x.contiguous()
+
+
+def preprocess_batch(images, size, mean=None, std=None):
+    """
+    Resize and normalize a ComfyUI IMAGE batch for model input
+
+    Args:
+        images: [N,H,W,C] float tensor in [0, 1]
+        size: (height, width) model input size
+        mean, std: Optional per-channel normalization
+
+    Returns:
+        [N,3,height,width] contiguous float32 tensor on the input device
+    """
+    x = to_rgb(images).permute(0, 3, 1, 2).float()
+    if tuple(x.shape[-2:]) != tuple(size):
+        x = F.interpolate(x, size=size, mode='bilinear', align_corners=False, antialias=True)
+    return _normalize(x.clamp(0, 1), mean, std)
+
+
+def letterbox_batch(images, size, mean=None, std=None):
+    """
+    Aspect-preserving resize into the model input, padded with neutral gray
+
+    Images that already touch the input size on their long side (e.g. from
+    SmartResizeForModel in fit mode) are only padded, never resampled
+
+    Returns:
+        ([N,3,height,width] model input, (top, left, valid_height, valid_width) box)
+    """
+    height, width = images.shape[1], images.shape[2]
+    scale = min(size[0] / height, size[1] / width)
+    new_h = max(1, min(size[0], round(height * scale)))
+    new_w = max(1, min(size[1], round(width * scale)))
+
+    x = to_rgb(images).permute(0, 3, 1, 2).float()
+    if (new_h, new_w) != (height, width):
+        x = F.interpolate(x, size=(new_h, new_w), mode='bilinear', align_corners=False, antialias=True)
+    x = x.clamp(0, 1)
+
+    top = (size[0] - new_h) // 2
+    left = (size[1] - new_w) // 2
+    x = F.pad(x, (left, size[1] - new_w - left, top, size[0] - new_h - top), value=LETTERBOX_FILL)
+    return _normalize(x, mean, std), (top, left, new_h, new_w)
+
+
+def crop_letterbox(result, box, size):
+    """
+    Cut the valid region of a letterboxed model output
+
+    Args:
+        result: [N,1,h,w] or [N,h,w] model output (h, w may differ from the input size)
+        box: (top, left, height, width) from letterbox_batch
+        size: (height, width) model input size the box refers to
+    """
+    out_h, out_w = result.shape[-2], result.shape[-1]
+    sy, sx = out_h / size[0], out_w / size[1]
+    top, left = int(round(box[0] * sy)), int(round(box[1] * sx))
+    height = max(1, int(round(box[2] * sy)))
+    width = max(1, int(round(box[3] * sx)))
+    return result[..., top:top + height, left:left + width]
+
+
+def resize_images(images, size):
+    """Resize a [N,H,W,C] image batch to (height, width)"""
+    if tuple(images.shape[1:3]) == tuple(size):
+        return images
+    x = images.permute(0, 3, 1, 2).float()
+    x = F.interpolate(x, size=size, mode='bicubic', align_corners=False, antialias=True)
+    return x.clamp(0, 1).permute(0, 2, 3, 1)
+
+
+def postprocess_masks(result, size, sigmoid_if_logits=False):
+    """
+    Resize raw model output back to image size and min-max normalize per image
+
+    Args:
+        result: [N,1,h,w] or [N,h,w] model output tensor
+        size: (height, width) of the original images
+        sigmoid_if_logits: Apply sigmoid to images whose values fall outside [0, 1]
+
+    Returns:
+        [N,H,W] float tensor in [0, 1]
+    """
+    if result.dim() == 3:
+        result = result.unsqueeze(1)
+    result = result[:, :1].float()
+
+    if sigmoid_if_logits:
+        flat = result.flatten(1)
+        is_logits = ((flat.amax(dim=1) > 1.0) | (flat.amin(dim=1) < 0.0)).view(-1, 1, 1, 1)
+        result = torch.where(is_logits, torch.sigmoid(result), result)
+
+    if tuple(result.shape[-2:]) != tuple(size):
+        result = F.interpolate(result, size=size, mode='bilinear', align_corners=False)
+
+    ma = result.amax(dim=(1, 2, 3), keepdim=True)
+    mi = result.amin(dim=(1, 2, 3), keepdim=True)
+    span = ma - mi
+    result = torch.where(span > 0, (result - mi) / span.clamp(min=1e-12), result)
+    return result.squeeze(1)
+
+
+def apply_sensitivity(masks, sensitivity):
+    """Scale mask strength, lower sensitivity pushes more pixels to foreground"""
+    return torch.clamp(masks * (1 + (1 - sensitivity)), 0, 1)
+
+
+def _gauss_box_radius(sigma, passes=3):
+    """
+    Fractional box radius whose repeated passes approximate a Gaussian of the given sigma,
+    computed the way PIL's extended box blur does (BoxBlur.c _gaussian_blur_radius)
+    """
+    sigma2 = sigma * sigma / passes
+    width = math.sqrt(12.0 * sigma2 + 1.0)
+    l = math.floor((width - 1.0) / 2.0)
+    a = (2 * l + 1) * (l * (l + 1) - 3 * sigma2)
+    a /= 6 * (sigma2 - (l + 1) * (l + 1))
+    return l + a
+
+
+def _box_blur(x, radius, dim):
+    """
+    Mean filter of fractional radius along dim using a running sum (edge replicate)
+    The two pixels just outside the integer window are weighted by the fractional part
+    """
+    l = int(radius)
+    frac = radius - l
+    pad = [0, 0, 0, 0]
+    pad[0 if dim == 3 else 2] = l + 2
+    pad[1 if dim == 3 else 3] = l + 1
+    padded = F.pad(x, pad, mode='replicate')
+    csum = padded.cumsum(dim=dim)
+    length = x.shape[dim]
+    inner = csum.narrow(dim, 2 * l + 2, length) - csum.narrow(dim, 1, length)
+    edges = padded.narrow(dim, 1, length) + padded.narrow(dim, 2 * l + 3, length)
+    return (inner + frac * edges) / (2 * radius + 1)
+
+
+def blur_masks(masks, radius):
+    """
+    Gaussian blur of [N,H,W] masks, equivalent to PIL GaussianBlur(radius)
+    Uses PIL's three extended (fractional) box passes per axis as running sums, so it
+    matches PIL at every radius and the cost does not grow with radius
+    """
+    if radius <= 0:
+        return masks
+    # float32 so it also runs on MPS, running-sum error stays below 0.1/255 at 8k widths
+    x = masks.unsqueeze(1).float()
+    box_radius = _gauss_box_radius(float(radius))
+    for dim in (3, 2):
+        for _ in range(3):
+            x = _box_blur(x, box_radius, dim=dim)
+    return x.squeeze(1).to(masks.dtype).clamp(0, 1)
+
+
+def _running_max(x, size, dim):
+    """
+    Max over a centered window of odd width along dim (3 or 2) of a [N,1,H,W] tensor
+    Wide windows use van Herk/Gil-Werman block prefix/suffix maxima, so the cost
+    stays flat as the window grows; narrow ones fall back to max_pool2d
+    """
+    length = x.shape[dim]
+    radius = size // 2
+    if size < _RUNNING_MAX_MIN_SIZE:
+        kernel = (1, size) if dim == 3 else (size, 1)
+        padding = (0, radius) if dim == 3 else (radius, 0)
+        return F.max_pool2d(x, kernel_size=kernel, stride=1, padding=padding)
+    extra = (-(length + 2 * radius)) % size
+    pad = [0, 0, 0, 0]
+    pad[0 if dim == 3 else 2] = radius
+    pad[1 if dim == 3 else 3] = radius + extra
+    padded = F.pad(x, pad, value=float('-inf'))
+
+    blocks = padded.unflatten(dim, (padded.shape[dim] // size, size))
+    prefix = blocks.cummax(dim=dim + 1).values.flatten(dim, dim + 1)
+    suffix = blocks.flip(dim + 1).cummax(dim=dim + 1).values.flip(dim + 1).flatten(dim, dim + 1)
+
+    # Window [i, i+size) spans at most two blocks: the tail of one and the head of the next
+    return torch.maximum(suffix.narrow(dim, 0, length), prefix.narrow(dim, size - 1, length))
+
+
+def offset_masks(masks, offset):
+    """
+    Expand (positive) or contract (negative) [N,H,W] masks by offset pixels
+
+    Same result as applying a 3x3 MaxFilter/MinFilter offset times, computed as a
+    single separable (2*offset+1)² max whose per-pixel cost does not grow with offset
+    """
+    if offset == 0:
+        return masks
+    size = 2 * abs(offset) + 1
+    x = masks.unsqueeze(1)
+    if offset < 0:
+        x = -x
+    x = _running_max(x, size, dim=3)
+    x = _running_max(x, size, dim=2)
+    if offset < 0:
+        x = -x
+    return x.squeeze(1)
+
+
+def composite(images, alpha, bg_color=None):
+    """
+    Apply alpha to an image batch
+
+    Args:
+        images: [N,H,W,C] source images
+        alpha: [N,H,W] alpha in [0, 1]
+        bg_color: None for RGBA output, or an (r, g, b) tuple in 0-255 for a solid background
+
+    Returns:
+        [N,H,W,4] RGBA batch, or [N,H,W,3] RGB batch composited over bg_color
+    """
+    rgb = to_rgb(images).float()
+    a = alpha.to(rgb.dtype).unsqueeze(-1)
+    if bg_color is None:
+        return torch.cat([rgb, a], dim=-1)
+    bg = torch.tensor(bg_color, dtype=rgb.dtype, device=rgb.device).view(1, 1, 1, 3) / 255.0
+    return rgb * a + bg * (1 - a)
+
+
+def refine_and_composite(images, masks, bg_color, sensitivity, mask_blur, mask_offset):
+    """
+    Shared mask refinement and compositing for the remove-bg nodes
+
+    Returns:
+        (composited images, sensitivity-adjusted masks)
+    """
+    masks = apply_sensitivity(masks, sensitivity)
+    alpha = blur_masks(masks, mask_blur)
+    alpha = offset_masks(alpha, mask_offset)
+    return composite(images, alpha, bg_color), masks
@@ -0,0 +1,132 @@
+"""
+Tiled (sliding-window) ONNX inference for high-resolution segmentation
+Overlapping tiles run at native resolution, guided by a low-resolution global pass
+"""
+
+import torch
+import torch.nn.functional as F
+
+from .onnx_batching import run_batched
+from .tensor_ops import to_rgb
+
+# Guide values outside this band count as certain: tiles there are skipped and
+# the guide wins over the tile prediction
+GUIDE_CERTAIN_LOW = 0.02
+GUIDE_CERTAIN_HIGH = 0.98
+
+
+def to_probabilities(x):
+    """Apply sigmoid if the model returned logits"""
+    if x.max() > 1.0 or x.min() < 0.0:
+        return torch.sigmoid(x)
+    return x
+
+
+def get_fixed_spatial_size(session):
+    """Return (height, width) baked into the model input, or None if either is dynamic"""
+    shape = session.get_inputs()[0].shape
+    if len(shape) == 4 and all(isinstance(d, int) and d > 0 for d in shape[2:]):
+        return shape[2], shape[3]
+    return None
+
+
+def tile_starts(length, tile, overlap):
+    """Tile origins covering [0, length) with at least overlap pixels shared between neighbours"""
+    if length <= tile:
+        return [0]
+    stride = max(1, tile - overlap)
+    starts = list(range(0, length - tile, stride))
+    starts.append(length - tile)
+    return starts
+
+
+def blend_window(tile, overlap, device):
+    """[tile, tile] weights ramping up over the overlap so seams cross-fade"""
+    ramp = torch.ones(tile, device=device)
+    if overlap > 0:
+        edge = torch.linspace(0, 1, overlap + 2, device=device)[1:-1]
+        ramp[:overlap] = edge
+        ramp[-overlap:] = torch.minimum(ramp[-overlap:], edge.flip(0))
+    return ramp.view(-1, 1) * ramp.view(1, -1)
+
+
+def guide_confidence(guide):
+    """0 where the guide is uncertain, ramping to 1 where it is certain"""
+    distance = torch.maximum(GUIDE_CERTAIN_LOW - guide, guide - GUIDE_CERTAIN_HIGH)
+    return torch.clamp(distance / GUIDE_CERTAIN_LOW + 1, 0, 1)
+
+
+def run_tiled(session, image, guide, tile, overlap, max_batch_size=1, mean=None, std=None):
+    """
+    Segment one image with overlapping native-resolution tiles
+
+    Args:
+        session: onnxruntime.InferenceSession taking [N,3,tile,tile]
+        image: [H,W,C] ComfyUI image
+        guide: [H,W] probabilities from a low-resolution pass over the whole image
+        tile: Tile edge length in pixels (the model input size)
+        overlap: Pixels shared between neighbouring tiles
+        max_batch_size: Tiles stacked per session run
+        mean, std: Per-channel input normalization
+
+    Returns:
+        [H,W] foreground probabilities on the image's device
+    """
+    device = image.device
+    height, width = image.shape[0], image.shape[1]
+    overlap = max(0, min(overlap, tile // 2))
+
+    # Images smaller than a tile in either direction are edge-padded up to it
+    x = to_rgb(image.unsqueeze(0)).permute(0, 3, 1, 2).float()
+    pad_h, pad_w = max(0, tile - height), max(0, tile - width)
+    if pad_h or pad_w:
+        x = F.pad(x, (0, pad_w, 0, pad_h), mode='replicate')
+    full_h, full_w = x.shape[2], x.shape[3]
+
+    if mean is not None and std is not None:
+        mean_t = torch.tensor(mean, dtype=x.dtype, device=device).view(1, 3, 1, 1)
+        std_t = torch.tensor(std, dtype=x.dtype, device=device).view(1, 3, 1, 1)
+    else:
+        mean_t = std_t = None
+
+    guide_full = F.pad(guide.view(1, 1, height, width), (0, pad_w, 0, pad_h), mode='replicate')[0, 0]
+
+    # Skip tiles the guide is already certain about
+    boxes = []
+    for top in tile_starts(full_h, tile, overlap):
+        for left in tile_starts(full_w, tile, overlap):
+            region = guide_full[top:top + tile, left:left + tile]
+            if region.max() <= GUIDE_CERTAIN_LOW or region.min() >= GUIDE_CERTAIN_HIGH:
+                continue
+            boxes.append((top, left))
+
+    accum = torch.zeros(full_h, full_w, device=device)
+    weight = torch.zeros(full_h, full_w, device=device)
+    window = blend_window(tile, overlap, device)
+    batch = max(1, int(max_batch_size))
+
+    # Only one tile batch is materialized at a time, so memory scales with tile size
+    for start in range(0, len(boxes), batch):
+        chunk_boxes = boxes[start:start + batch]
+        tiles = torch.cat([x[:, :, t:t + tile, l:l + tile] for t, l in chunk_boxes], dim=0)
+        if mean_t is not None:
+            tiles = (tiles - mean_t) / std_t
+
+        outputs = run_batched(session, tiles.contiguous().cpu().numpy(), batch)
+        preds = torch.from_numpy(outputs[-1]).to(device)
+        if preds.dim() == 3:
+            preds = preds.unsqueeze(1)
+        preds = to_probabilities(preds[:, 0].float())
+        if tuple(preds.shape[-2:]) != (tile, tile):
+            preds = F.interpolate(preds.unsqueeze(1), size=(tile, tile), mode='bilinear', align_corners=False)[:, 0]
+
+        for (t, l), pred in zip(chunk_boxes, preds):
+            accum[t:t + tile, l:l + tile] += pred * window
+            weight[t:t + tile, l:l + tile] += window
+
+    tiled = torch.where(weight > 0, accum / weight.clamp(min=1e-6), guide_full)
+
+    # Where the global pass is certain it overrides local tile hallucinations
+    confidence = guide_confidence(guide_full)
+    fused = confidence * guide_full + (1 - confidence) * tiled
+    return fused[:height, :width]
@@ -0,0 +1,241 @@
+# llm_result_cache.py
+# Content-addressed LRU cache for LLM node outputs (memory + disk)
+#
+# Entries are keyed by a SHA-256 over the model file hash, the node, the full prompt
+# and the sampling settings, so identical captions skip generation entirely.
+# Only reproducible runs are cached: greedy (temperature 0) or sampled with a fixed seed that
+# the nodes pass to every generation call.
+#
+# Environment:
+#   LLM_RESULT_CACHE_DIR           Disk location (default: <user dir>/cache/llm_results, "" disables disk)
+#   LLM_RESULT_CACHE_MEM_ENTRIES   In-memory entries (default 1024)
+#   LLM_RESULT_CACHE_DISK_ENTRIES  On-disk entries (default 20000)
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import folder_paths
+
+_CACHE_VERSION = 1
+
+_lock = threading.Lock()
+_memory: "OrderedDict[str, str]" = OrderedDict()
+_model_hashes: Dict[str, Dict[str, Any]] = {}
+_stats = {"hits": 0, "misses": 0}
+_disk_count: Optional[int] = None
+
+
+def _cache_dir() -> Optional[str]:
+    default = os.path.join(folder_paths.get_user_directory(), "cache", "llm_results")
+    path = os.environ.get("LLM_RESULT_CACHE_DIR", default).strip()
+    return path or None
+
+
+def _mem_limit() -> int:
+    return int(os.environ.get("LLM_RESULT_CACHE_MEM_ENTRIES", "1024"))
+
+
+def _disk_limit() -> int:
+    return int(os.environ.get("LLM_RESULT_CACHE_DISK_ENTRIES", "20000"))
+
+
+def is_deterministic(temperature: float, seed: Optional[int] = None) -> bool:
+    """
+    Greedy decoding gives the same output for the same prompt. Sampling does too when
+    the generation call reseeds the sampler with a fixed seed, otherwise it does not.
+    """
+    return temperature <= 0.0 or seed is not None
+
+
+def _load_hash_index(cache_dir: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(cache_dir, "model_hashes.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_hash_index(cache_dir: str, index: Dict[str, Any]):
+    path = os.path.join(cache_dir, "model_hashes.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, indent=2)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[LLMResultCache] Could not save model hash index: {e}")
+
+
+def model_hash(model_path: str) -> str:
+    """
+    SHA-256 of the GGUF file, computed once per (path, size, mtime) and remembered
+    in memory and next to the disk cache so restarts do not rehash multi-GB models
+    """
+    real_path = os.path.realpath(model_path)
+    st = os.stat(real_path)
+    stamp = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+    entry = _model_hashes.get(real_path)
+    if entry and entry["size"] == stamp["size"] and entry["mtime_ns"] == stamp["mtime_ns"]:
+        return entry["sha256"]
+
+    cache_dir = _cache_dir()
+    index = _load_hash_index(cache_dir) if cache_dir else {}
+    entry = index.get(real_path)
+    if not (entry and entry.get("size") == stamp["size"] and entry.get("mtime_ns") == stamp["mtime_ns"]):
+        print(f"[LLMResultCache] Hashing model file {real_path}...")
+        sha = hashlib.sha256()
+        with open(real_path, "rb") as f:
+            for chunk in iter(lambda: f.read(8 * 1024 * 1024), b""):
+                sha.update(chunk)
+        entry = dict(stamp, sha256=sha.hexdigest())
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            index[real_path] = entry
+            _save_hash_index(cache_dir, index)
+
+    _model_hashes[real_path] = entry
+    return entry["sha256"]
+
+
+def make_key(node: str, model_path: str, prompt: Any, temperature: float, seed: Optional[int], max_tokens: int,
+             options: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Content address for one generation request
+
+    prompt is the exact text (or chat messages) sent to the model, so it covers both
+    the template and the caption. The seed only influences sampling, so it is left
+    out of the key for greedy runs. options holds any other setting that changes the
+    output (e.g. constrained decoding).
+    """
+    payload = {
+        "v": _CACHE_VERSION,
+        "node": node,
+        "model": model_hash(model_path),
+        "prompt": prompt,
+        "temperature": float(temperature),
+        "seed": seed if temperature > 0.0 else None,
+        "max_tokens": int(max_tokens),
+        "options": options or {},
+    }
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+def _entry_path(cache_dir: str, key: str) -> str:
+    return os.path.join(cache_dir, key[:2], f"{key}.json")
+
+
+def _remember_locked(key: str, value: str):
+    _memory[key] = value
+    _memory.move_to_end(key)
+    while len(_memory) > _mem_limit():
+        _memory.popitem(last=False)
+
+
+def get(key: str) -> Optional[str]:
+    """Cached output for key, or None. Updates hit/miss counters"""
+    with _lock:
+        value = _memory.get(key)
+        if value is not None:
+            _memory.move_to_end(key)
+            _stats["hits"] += 1
+            return value
+
+    cache_dir = _cache_dir()
+    if cache_dir:
+        path = _entry_path(cache_dir, key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)["output"]
+            os.utime(path)  # LRU order on disk follows mtime
+        except (OSError, ValueError, KeyError):
+            value = None
+
+    with _lock:
+        if value is not None:
+            _remember_locked(key, value)
+            _stats["hits"] += 1
+        else:
+            _stats["misses"] += 1
+    return value
+
+
+def _evict_disk(cache_dir: str):
+    """Drop the least recently used files once the disk cache is over its limit"""
+    global _disk_count
+    entries = []
+    for shard in os.listdir(cache_dir):
+        shard_dir = os.path.join(cache_dir, shard)
+        if not os.path.isdir(shard_dir):
+            continue
+        for name in os.listdir(shard_dir):
+            path = os.path.join(shard_dir, name)
+            try:
+                entries.append((os.stat(path).st_mtime_ns, path))
+            except OSError:
+                pass
+
+    limit = _disk_limit()
+    if len(entries) > limit:
+        entries.sort()
+        # Evict down to 90% so the directory scan does not run on every write
+        for _, path in entries[:len(entries) - int(limit * 0.9)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        _disk_count = int(limit * 0.9)
+    else:
+        _disk_count = len(entries)
+
+
+def put(key: str, value: str):
+    """Store an output in memory and, if enabled, on disk"""
+    global _disk_count
+    with _lock:
+        _remember_locked(key, value)
+
+    cache_dir = _cache_dir()
+    if not cache_dir:
+        return
+    path = _entry_path(cache_dir, key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"output": value}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[LLMResultCache] Could not write cache entry: {e}")
+        return
+
+    with _lock:
+        if _disk_count is None or _disk_count + 1 > _disk_limit():
+            _evict_disk(cache_dir)
+        else:
+            _disk_count += 1
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        return dict(_stats, memory_entries=len(_memory))
+
+
+def clear(disk: bool = False):
+    """Empty the in-memory cache (and the disk cache when disk=True)"""
+    global _disk_count
+    with _lock:
+        _memory.clear()
+        _stats["hits"] = _stats["misses"] = 0
+        cache_dir = _cache_dir()
+        if disk and cache_dir and os.path.isdir(cache_dir):
+            for shard in os.listdir(cache_dir):
+                shard_dir = os.path.join(cache_dir, shard)
+                if os.path.isdir(shard_dir):
+                    for name in os.listdir(shard_dir):
+                        os.remove(os.path.join(shard_dir, name))
+            _disk_count = 0
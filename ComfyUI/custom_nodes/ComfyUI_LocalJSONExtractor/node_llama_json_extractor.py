@@ -4,6 +4,8 @@ import json
 import os
 from typing import Dict, Any
 
+from . import llm_result_cache
+
 # llama.cpp Python bindings
 try:
     from llama_cpp import Llama
@@ -12,9 +14,20 @@ except ImportError:
     LLAMA_AVAILABLE = False
     print("[LocalJSONExtractor] WARNING: llama-cpp-python not installed. Node will be disabled.")
 
+try:
+    from llama_cpp import LlamaGrammar
+except ImportError:
+    LlamaGrammar = None
+
 # ---- Simple global cache so model loads once per process
 _LLAMA_CACHE: Dict[str, Any] = {}
 
+# ---- KV state snapshots of static prompt prefixes, keyed by (_LLAMA_CACHE key, prefix)
+_PREFIX_STATE_CACHE: Dict[Any, Dict[str, Any]] = {}
+
+def _llm_cache_key(model_path: str, n_ctx: int, n_gpu_layers: int) -> str:
+    return f"{model_path}|ctx={n_ctx}|gpu={n_gpu_layers}"
+
 def _load_llm(model_path: str, n_ctx: int = 4096, n_gpu_layers: int = -1, seed: int = 0):
     """
     Load (or reuse) a GGUF model. n_gpu_layers=-1 tries to offload maximum layers to GPU.
@@ -23,7 +36,7 @@ def _load_llm(model_path: str, n_ctx: int = 4096, n_gpu_layers: int = -1, seed:
     if not LLAMA_AVAILABLE:
         raise RuntimeError("llama-cpp-python is not installed. Please install it first.")
     
-    key = f"{model_path}|ctx={n_ctx}|gpu={n_gpu_layers}"
+    key = _llm_cache_key(model_path, n_ctx, n_gpu_layers)
     if key in _LLAMA_CACHE:
         return _LLAMA_CACHE[key]
 
@@ -50,33 +63,143 @@ def _load_llm(model_path: str, n_ctx: int = 4096, n_gpu_layers: int = -1, seed:
     return llm
 
 
-def _build_prompt(caption: str, subject_priority: str = "auto") -> str:
+# ---- JSON schemas for grammar-constrained decoding
+_SUBJECT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "primary_subject": {"type": "string"},
+        "secondary_subjects": {"type": "array", "items": {"type": "string"}},
+        "nsfw": {"type": "boolean"},
+        "violence": {"type": "boolean"},
+    },
+    "required": ["primary_subject", "secondary_subjects", "nsfw", "violence"],
+}
+
+_SAFETY_LEVEL_SCHEMA = {"type": "string", "enum": ["SAFE", "BORDERLINE", "UNSAFE"]}
+
+_SAFETY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "classification": {
+            "type": "object",
+            "properties": {
+                domain: _SAFETY_LEVEL_SCHEMA
+                for domain in ["sexual", "violence", "hate", "disturbing", "drugs"]
+            },
+            "required": ["sexual", "violence", "hate", "disturbing", "drugs"],
+        },
+        "reasons": {"type": "array", "items": {"type": "string"}},
+        "confidence": {"type": "number"},
+    },
+    "required": ["classification", "reasons", "confidence"],
+}
+
+_SUBJECT_SAFETY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "primary_subject": _SUBJECT_SCHEMA["properties"]["primary_subject"],
+        "secondary_subjects": _SUBJECT_SCHEMA["properties"]["secondary_subjects"],
+        **_SAFETY_SCHEMA["properties"],
+    },
+    "required": ["primary_subject", "secondary_subjects", "classification", "reasons", "confidence"],
+}
+
+_GRAMMAR_CACHE: Dict[str, Any] = {}
+
+def _get_json_grammar(name: str, schema: Dict[str, Any]):
     """
-    Build a prompt for strict JSON extraction.
-    Uses a simpler format that works better with various chat templates.
-    
-    Args:
-        caption: The image caption to analyze
-        subject_priority: "product" (prioritize objects over people), 
-                         "person" (prioritize people), 
-                         or "auto" (detect automatically)
+    Compile (once) a llama.cpp grammar that only admits JSON matching schema.
+    Decoding then ends at the closing brace, so no free text needs to be skipped or repaired.
+    Returns None when the installed llama-cpp-python has no grammar support.
     """
-    
-    # Adjust instructions based on priority
+    if LlamaGrammar is None:
+        return None
+    if name not in _GRAMMAR_CACHE:
+        try:
+            _GRAMMAR_CACHE[name] = LlamaGrammar.from_json_schema(json.dumps(schema), verbose=False)
+        except Exception as e:
+            print(f"[LocalJSONExtractor] Could not build JSON grammar '{name}', decoding unconstrained: {e}")
+            _GRAMMAR_CACHE[name] = None
+    return _GRAMMAR_CACHE[name]
+
+
+def _prime_prompt_prefix(llm, llm_key: str, prefix: str) -> int:
+    """
+    Leave the llama.cpp context holding the evaluated tokens of a static prompt prefix,
+    so the next completion whose prompt starts with it only evaluates the remainder
+    (llama.cpp reuses the longest matching token prefix already in the KV cache).
+
+    The state after the prefix is snapshotted once per loaded model and prefix, and restored
+    when another prompt has overwritten the context. A reloaded model, a different n_ctx or a
+    failed restore drops the snapshot. Returns the number of prefix tokens ready for reuse
+    (0 means the caller just pays the full prompt as before).
+    """
+    cache_key = (llm_key, prefix)
+    entry = _PREFIX_STATE_CACHE.get(cache_key)
+    if entry is not None and (entry["llm"] is not llm or entry["n_ctx"] != llm.n_ctx()):
+        _PREFIX_STATE_CACHE.pop(cache_key, None)
+        entry = None
+
+    try:
+        if entry is None:
+            tokens = llm.tokenize(prefix.encode("utf-8"), special=True)
+            if len(tokens) >= llm.n_ctx():
+                return 0
+            llm.reset()
+            llm.eval(tokens)
+            _PREFIX_STATE_CACHE[cache_key] = {
+                "llm": llm,
+                "n_ctx": llm.n_ctx(),
+                "tokens": tokens,
+                "state": llm.save_state(),
+            }
+            print(f"[LocalJSONExtractor] Cached KV state for {len(tokens)}-token prompt prefix")
+            return len(tokens)
+
+        tokens = entry["tokens"]
+        # The previous call used the same prefix, its KV entries are still in place
+        if llm.n_tokens >= len(tokens) and llm.input_ids[:len(tokens)].tolist() == tokens:
+            return len(tokens)
+
+        llm.load_state(entry["state"])
+        return len(tokens)
+    except Exception as e:
+        print(f"[LocalJSONExtractor] Prompt prefix cache unavailable, evaluating full prompt: {e}")
+        _PREFIX_STATE_CACHE.pop(cache_key, None)
+        llm.reset()
+        return 0
+
+
+def _priority_instruction(subject_priority: str) -> str:
+    """Extra instruction deciding between person and product as the primary subject"""
     if subject_priority == "product":
-        priority_instruction = (
+        return (
             "IMPORTANT: If the caption mentions both a person AND an object/product, "
             "the primary_subject MUST be the object/product being held, worn, or used, NOT the person. "
             "Example: 'A person holding a blue bowl' -> primary_subject is 'blue bowl', NOT 'person'.\n"
         )
     elif subject_priority == "person":
-        priority_instruction = (
+        return (
             "IMPORTANT: If the caption mentions both a person AND objects, "
             "the primary_subject MUST be the person with their descriptors. "
             "Example: 'A woman in a red dress holding flowers' -> primary_subject is 'woman in a red dress'.\n"
         )
-    else:  # auto
-        priority_instruction = ""
+    return ""  # auto
+
+
+def _build_prompt(caption: str, subject_priority: str = "auto") -> str:
+    """
+    Build a prompt for strict JSON extraction.
+    Uses a simpler format that works better with various chat templates.
+    
+    Args:
+        caption: The image caption to analyze
+        subject_priority: "product" (prioritize objects over people), 
+                         "person" (prioritize people), 
+                         or "auto" (detect automatically)
+    """
+    
+    priority_instruction = _priority_instruction(subject_priority)
     
     system = (
         "You extract structured facts from a short image caption. "
@@ -120,8 +243,64 @@ def _coerce_json(txt: str) -> str:
     return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
 
 
+# Few-shot examples shared by every MultiDomainSafetyClassifier prompt, only the
+# trailing "Image: {caption}" line changes between requests
+_SAFETY_FEW_SHOT_PREFIX = (
+    "Image: A blue ceramic bowl on a wooden table\n"
+    'JSON: {"classification":{"sexual":"SAFE","violence":"SAFE","hate":"SAFE","disturbing":"SAFE","drugs":"SAFE"},"reasons":["neutral product photo"],"confidence":0.95}\n\n'
+    
+    "Image: A woman wearing a red bikini on a beach\n"
+    'JSON: {"classification":{"sexual":"BORDERLINE","violence":"SAFE","hate":"SAFE","disturbing":"SAFE","drugs":"SAFE"},"reasons":["swimwear in appropriate context"],"confidence":0.85}\n\n'
+    
+    "Image: A person with a bloody knife standing over another person\n"
+    'JSON: {"classification":{"sexual":"SAFE","violence":"UNSAFE","hate":"SAFE","disturbing":"UNSAFE","drugs":"SAFE"},"reasons":["depicts violence and blood"],"confidence":0.92}\n\n'
+)
+
+
+def _build_subject_safety_prefix(subject_priority: str = "auto") -> str:
+    """
+    Static part of the fused subject + safety prompt. It only depends on subject_priority,
+    so its KV state is snapshotted once per priority and reused for every caption.
+    """
+    return (
+        "Analyze each image caption. Return STRICT JSON with keys:\n"
+        f"{_priority_instruction(subject_priority)}"
+        "  primary_subject (string) - the main object/person with ONLY its physical/material descriptors, NO actions or states,\n"
+        "  secondary_subjects (array of strings) - other objects, actions, background elements, or context,\n"
+        "  classification (object) - SAFE, BORDERLINE or UNSAFE for each of sexual, violence, hate, disturbing, drugs,\n"
+        "  reasons (array of strings),\n"
+        "  confidence (number 0-1).\n\n"
+        
+        "Image: A blue ceramic bowl on a wooden table\n"
+        'JSON: {"primary_subject":"blue ceramic bowl","secondary_subjects":["wooden table"],"classification":{"sexual":"SAFE","violence":"SAFE","hate":"SAFE","disturbing":"SAFE","drugs":"SAFE"},"reasons":["neutral product photo"],"confidence":0.95}\n\n'
+        
+        "Image: A woman wearing a red bikini on a beach\n"
+        'JSON: {"primary_subject":"woman in a red bikini","secondary_subjects":["beach"],"classification":{"sexual":"BORDERLINE","violence":"SAFE","hate":"SAFE","disturbing":"SAFE","drugs":"SAFE"},"reasons":["swimwear in appropriate context"],"confidence":0.85}\n\n'
+        
+        "Image: A person with a bloody knife standing over another person\n"
+        'JSON: {"primary_subject":"person with a bloody knife","secondary_subjects":["standing over another person"],"classification":{"sexual":"SAFE","violence":"UNSAFE","hate":"SAFE","disturbing":"UNSAFE","drugs":"SAFE"},"reasons":["depicts violence and blood"],"confidence":0.92}\n\n'
+    )
+
+
 # ---------------- ComfyUI Node Definition ---------------- #
 
+def _default_model_path() -> str:
+    # Default model path - user should change this to their actual GGUF location
+    default_model_path = "C:/LLM/models/Llama-3.1-8B-Instruct-Q5_K_M.gguf"
+    
+    # Check if ComfyUI models directory exists and suggest it
+    comfy_models_llm = "C:/Users/genfp/AI_avatar/Comfy_vanila/ComfyUI/models/llm"
+    if os.path.exists(comfy_models_llm):
+        # Look for any .gguf file in that directory
+        try:
+            gguf_files = [f for f in os.listdir(comfy_models_llm) if f.endswith('.gguf')]
+            if gguf_files:
+                default_model_path = os.path.join(comfy_models_llm, gguf_files[0]).replace("\\", "/")
+        except:
+            pass
+    return default_model_path
+
+
 class LocalJSONExtractorLlama:
     """
     ComfyUI node: takes a caption string, returns STRICT JSON string.
@@ -130,19 +309,7 @@ class LocalJSONExtractorLlama:
 
     @classmethod
     def INPUT_TYPES(cls):
-        # Default model path - user should change this to their actual GGUF location
-        default_model_path = "C:/LLM/models/Llama-3.1-8B-Instruct-Q5_K_M.gguf"
-        
-        # Check if ComfyUI models directory exists and suggest it
-        comfy_models_llm = "C:/Users/genfp/AI_avatar/Comfy_vanila/ComfyUI/models/llm"
-        if os.path.exists(comfy_models_llm):
-            # Look for any .gguf file in that directory
-            try:
-                gguf_files = [f for f in os.listdir(comfy_models_llm) if f.endswith('.gguf')]
-                if gguf_files:
-                    default_model_path = os.path.join(comfy_models_llm, gguf_files[0]).replace("\\", "/")
-            except:
-                pass
+        default_model_path = _default_model_path()
         
         return {
             "required": {
@@ -156,6 +323,8 @@ class LocalJSONExtractorLlama:
                 "n_ctx": ("INT", {"default": 4096, "min": 1024, "max": 8192, "step": 256}),
                 "n_gpu_layers": ("INT", {"default": -1, "min": -1, "max": 80, "step": 1}),
                 "seed": ("INT", {"default": 0, "min": 0, "max": 2**31 - 1}),
+                "use_result_cache": ("BOOLEAN", {"default": True, "tooltip": "Reuse stored outputs for identical captions (greedy or fixed seed)"}),
+                "constrained_json": ("BOOLEAN", {"default": True, "tooltip": "Constrain decoding with a JSON schema grammar so output is always valid JSON"}),
             }
         }
 
@@ -163,6 +332,7 @@ class LocalJSONExtractorLlama:
     RETURN_NAMES = ("json",)
     FUNCTION = "run"
     CATEGORY = "LLM/Local"
+    RESOURCES = ("llm",)
 
     def run(
         self,
@@ -174,6 +344,8 @@ class LocalJSONExtractorLlama:
         n_ctx: int = 4096,
         n_gpu_layers: int = -1,
         seed: int = 0,
+        use_result_cache: bool = True,
+        constrained_json: bool = True,
     ):
         if not LLAMA_AVAILABLE:
             error_msg = (
@@ -187,20 +359,36 @@ class LocalJSONExtractorLlama:
             return ('{"primary_subject":"","secondary_subjects":[],"nsfw":false,"violence":false}',)
 
         try:
-            llm = _load_llm(model_path=model_path, n_ctx=n_ctx, n_gpu_layers=n_gpu_layers, seed=seed)
             prompt = _build_prompt(caption, subject_priority)
+            messages = [
+                {"role": "system", "content": "You are a strict JSON extraction engine."},
+                {"role": "user", "content": prompt},
+            ]
+
+            cache_key = None
+            if use_result_cache and llm_result_cache.is_deterministic(temperature, seed):
+                cache_key = llm_result_cache.make_key("LocalJSONExtractorLlama", model_path, messages, temperature, seed, max_new_tokens,
+                                                      options={"constrained_json": constrained_json})
+                cached = llm_result_cache.get(cache_key)
+                stats = llm_result_cache.stats()
+                if cached is not None:
+                    print(f"[LocalJSONExtractor] Result cache hit (hits={stats['hits']}, misses={stats['misses']}): {cached}")
+                    return (cached,)
+                print(f"[LocalJSONExtractor] Result cache miss (hits={stats['hits']}, misses={stats['misses']})")
+
+            llm = _load_llm(model_path=model_path, n_ctx=n_ctx, n_gpu_layers=n_gpu_layers, seed=seed)
+            grammar = _get_json_grammar("subject", _SUBJECT_SCHEMA) if constrained_json else None
 
             print(f"[LocalJSONExtractor] Generating JSON for caption: {caption[:100]}...")
             
             # llama.cpp chat completion
             out = llm.create_chat_completion(
-                messages=[
-                    {"role": "system", "content": "You are a strict JSON extraction engine."},
-                    {"role": "user", "content": prompt},
-                ],
+                messages=messages,
                 temperature=temperature,
                 max_tokens=max_new_tokens,
                 stop=None,  # you can add ']\n' or similar stops if desired
+                grammar=grammar,
+                seed=seed,  # reseed per call so cached outputs are reproducible
             )
 
             # Extract text
@@ -210,6 +398,9 @@ class LocalJSONExtractorLlama:
             json_str = _coerce_json(text)
             print(f"[LocalJSONExtractor] Coerced JSON: {json_str}")
             
+            if cache_key is not None:
+                llm_result_cache.put(cache_key, json_str)
+            
             return (json_str,)
             
         except Exception as e:
@@ -226,16 +417,7 @@ class MultiDomainSafetyClassifier:
     
     @classmethod
     def INPUT_TYPES(cls):
-        default_model_path = "C:/LLM/models/Llama-3.1-8B-Instruct-Q5_K_M.gguf"
-        
-        comfy_models_llm = "C:/Users/genfp/AI_avatar/Comfy_vanila/ComfyUI/models/llm"
-        if os.path.exists(comfy_models_llm):
-            try:
-                gguf_files = [f for f in os.listdir(comfy_models_llm) if f.endswith('.gguf')]
-                if gguf_files:
-                    default_model_path = os.path.join(comfy_models_llm, gguf_files[0]).replace("\\", "/")
-            except:
-                pass
+        default_model_path = _default_model_path()
         
         return {
             "required": {
@@ -247,6 +429,8 @@ class MultiDomainSafetyClassifier:
                 "max_new_tokens": ("INT", {"default": 300, "min": 64, "max": 1024, "step": 16}),
                 "n_ctx": ("INT", {"default": 4096, "min": 1024, "max": 8192, "step": 256}),
                 "n_gpu_layers": ("INT", {"default": -1, "min": -1, "max": 80, "step": 1}),
+                "use_result_cache": ("BOOLEAN", {"default": True, "tooltip": "Reuse stored outputs for identical captions (greedy or fixed seed)"}),
+                "constrained_json": ("BOOLEAN", {"default": True, "tooltip": "Constrain decoding with a JSON schema grammar so output is always valid JSON"}),
             }
         }
     
@@ -254,6 +438,7 @@ class MultiDomainSafetyClassifier:
     RETURN_NAMES = ("json",)
     FUNCTION = "classify"
     CATEGORY = "LLM/Local/Safety"
+    RESOURCES = ("llm",)
     
     def classify(
         self,
@@ -263,6 +448,8 @@ class MultiDomainSafetyClassifier:
         max_new_tokens: int = 300,
         n_ctx: int = 4096,
         n_gpu_layers: int = -1,
+        use_result_cache: bool = True,
+        constrained_json: bool = True,
     ):
         if not LLAMA_AVAILABLE:
             error_msg = "llama-cpp-python is not installed."
@@ -287,31 +474,41 @@ class MultiDomainSafetyClassifier:
             }),)
         
         try:
-            llm = _load_llm(model_path=model_path, n_ctx=n_ctx, n_gpu_layers=n_gpu_layers, seed=0)
-            
             # Build multi-domain safety prompt - use few-shot examples
             full_prompt = (
-                "Image: A blue ceramic bowl on a wooden table\n"
-                'JSON: {"classification":{"sexual":"SAFE","violence":"SAFE","hate":"SAFE","disturbing":"SAFE","drugs":"SAFE"},"reasons":["neutral product photo"],"confidence":0.95}\n\n'
-                
-                "Image: A woman wearing a red bikini on a beach\n"
-                'JSON: {"classification":{"sexual":"BORDERLINE","violence":"SAFE","hate":"SAFE","disturbing":"SAFE","drugs":"SAFE"},"reasons":["swimwear in appropriate context"],"confidence":0.85}\n\n'
-                
-                "Image: A person with a bloody knife standing over another person\n"
-                'JSON: {"classification":{"sexual":"SAFE","violence":"UNSAFE","hate":"SAFE","disturbing":"UNSAFE","drugs":"SAFE"},"reasons":["depicts violence and blood"],"confidence":0.92}\n\n'
-                
+                _SAFETY_FEW_SHOT_PREFIX +
                 f'Image: {caption}\n'
                 'JSON:'
             )
             
-            print(f"[MultiDomainSafetyClassifier] Analyzing caption with Llama...")
+            cache_key = None
+            if use_result_cache and llm_result_cache.is_deterministic(temperature, 0):
+                cache_key = llm_result_cache.make_key("MultiDomainSafetyClassifier", model_path, full_prompt, temperature, 0, max_new_tokens,
+                                                      options={"constrained_json": constrained_json})
+                cached = llm_result_cache.get(cache_key)
+                stats = llm_result_cache.stats()
+                if cached is not None:
+                    print(f"[MultiDomainSafetyClassifier] Result cache hit (hits={stats['hits']}, misses={stats['misses']})")
+                    return (cached,)
+                print(f"[MultiDomainSafetyClassifier] Result cache miss (hits={stats['hits']}, misses={stats['misses']})")
+            
+            llm = _load_llm(model_path=model_path, n_ctx=n_ctx, n_gpu_layers=n_gpu_layers, seed=0)
+            grammar = _get_json_grammar("safety", _SAFETY_SCHEMA) if constrained_json else None
+            
+            # Restore the evaluated few-shot prefix so only the caption line is processed
+            llm_key = _llm_cache_key(model_path, n_ctx, n_gpu_layers)
+            reused = _prime_prompt_prefix(llm, llm_key, _SAFETY_FEW_SHOT_PREFIX)
+            
+            print(f"[MultiDomainSafetyClassifier] Analyzing caption with Llama (reusing {reused} prefix tokens)...")
             
             response = llm(
                 full_prompt,
                 max_tokens=max_new_tokens,
                 temperature=temperature,
                 stop=["Image:", "\n\n\n", "```", "Note:", "Here's"],
-                echo=False
+                echo=False,
+                grammar=grammar,
+                seed=0,
             )
             
             raw_output = response["choices"][0]["text"].strip()
@@ -322,7 +519,11 @@ class MultiDomainSafetyClassifier:
             
             print(f"[MultiDomainSafetyClassifier] Classification: {json_result['classification']}")
             
-            return (json.dumps(json_result, ensure_ascii=False, indent=2),)
+            result_str = json.dumps(json_result, ensure_ascii=False, indent=2)
+            if cache_key is not None:
+                llm_result_cache.put(cache_key, result_str)
+            
+            return (result_str,)
         
         except Exception as e:
             error_msg = f"Error in MultiDomainSafetyClassifier: {str(e)}"
@@ -339,7 +540,8 @@ class MultiDomainSafetyClassifier:
                 "confidence": 0.0
             }),)
     
-    def _parse_safety_json(self, raw_output: str) -> dict:
+    @staticmethod
+    def _parse_safety_json(raw_output: str) -> dict:
         """Parse and validate multi-domain safety JSON output"""
         # Find JSON in output
         start = raw_output.find("{")
@@ -393,13 +595,166 @@ class MultiDomainSafetyClassifier:
         return data
 
 
+class LocalSubjectSafetyLlama:
+    """
+    One llama.cpp pass producing both the subject extraction of LocalJSONExtractorLlama
+    and the 5-domain classification of MultiDomainSafetyClassifier.
+    Returns the same two JSON shapes, so it can replace both nodes in a workflow.
+    """
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        default_model_path = _default_model_path()
+        
+        return {
+            "required": {
+                "caption": ("STRING", {"multiline": True, "default": ""}),
+                "model_path": ("STRING", {"default": default_model_path}),
+                "subject_priority": (["auto", "product", "person"], {"default": "product"}),
+            },
+            "optional": {
+                "temperature": ("FLOAT", {"default": 0.1, "min": 0.0, "max": 1.0, "step": 0.05}),
+                "max_new_tokens": ("INT", {"default": 384, "min": 64, "max": 1024, "step": 16}),
+                "n_ctx": ("INT", {"default": 4096, "min": 1024, "max": 8192, "step": 256}),
+                "n_gpu_layers": ("INT", {"default": -1, "min": -1, "max": 80, "step": 1}),
+                "seed": ("INT", {"default": 0, "min": 0, "max": 2**31 - 1}),
+                "use_result_cache": ("BOOLEAN", {"default": True, "tooltip": "Reuse stored outputs for identical captions (greedy or fixed seed)"}),
+                "constrained_json": ("BOOLEAN", {"default": True, "tooltip": "Constrain decoding with a JSON schema grammar so output is always valid JSON"}),
+            }
+        }
+    
+    RETURN_TYPES = ("STRING", "STRING")
+    RETURN_NAMES = ("subject_json", "safety_json")
+    FUNCTION = "analyze"
+    CATEGORY = "LLM/Local/Safety"
+    RESOURCES = ("llm",)
+    
+    @staticmethod
+    def _split_result(data: dict):
+        """Fused output -> (extractor JSON, classifier JSON) in the shapes the separate nodes return"""
+        safety = MultiDomainSafetyClassifier._parse_safety_json(json.dumps({
+            "classification": data.get("classification", {}),
+            "reasons": data.get("reasons"),
+            "confidence": data.get("confidence"),
+        }))
+        classification = safety["classification"]
+        subject_str = _coerce_json(json.dumps({
+            "primary_subject": data.get("primary_subject", ""),
+            "secondary_subjects": data.get("secondary_subjects", []),
+            "nsfw": classification["sexual"] == "UNSAFE",
+            "violence": classification["violence"] == "UNSAFE",
+        }, ensure_ascii=False))
+        return subject_str, json.dumps(safety, ensure_ascii=False, indent=2)
+    
+    def _error_result(self, error_msg: str):
+        subject = {"error": error_msg, "primary_subject": "", "secondary_subjects": [], "nsfw": False, "violence": False}
+        safety = {
+            "error": error_msg,
+            "classification": {
+                "sexual": "SAFE", "violence": "SAFE", "hate": "SAFE",
+                "disturbing": "SAFE", "drugs": "SAFE"
+            },
+            "reasons": [f"Classification failed: {error_msg}"],
+            "confidence": 0.0
+        }
+        return (json.dumps(subject), json.dumps(safety))
+    
+    def analyze(
+        self,
+        caption: str,
+        model_path: str,
+        subject_priority: str = "product",
+        temperature: float = 0.1,
+        max_new_tokens: int = 384,
+        n_ctx: int = 4096,
+        n_gpu_layers: int = -1,
+        seed: int = 0,
+        use_result_cache: bool = True,
+        constrained_json: bool = True,
+    ):
+        if not LLAMA_AVAILABLE:
+            return self._error_result("llama-cpp-python is not installed.")
+        
+        if not caption or not caption.strip():
+            return (
+                '{"primary_subject":"","secondary_subjects":[],"nsfw":false,"violence":false}',
+                json.dumps({
+                    "classification": {
+                        "sexual": "SAFE", "violence": "SAFE", "hate": "SAFE",
+                        "disturbing": "SAFE", "drugs": "SAFE"
+                    },
+                    "reasons": ["Empty caption"],
+                    "confidence": 1.0
+                }),
+            )
+        
+        try:
+            prefix = _build_subject_safety_prefix(subject_priority)
+            full_prompt = prefix + f"Image: {caption}\nJSON:"
+            
+            cache_key = None
+            if use_result_cache and llm_result_cache.is_deterministic(temperature, seed):
+                cache_key = llm_result_cache.make_key("LocalSubjectSafetyLlama", model_path, full_prompt, temperature, seed, max_new_tokens,
+                                                      options={"constrained_json": constrained_json})
+                cached = llm_result_cache.get(cache_key)
+                stats = llm_result_cache.stats()
+                if cached is not None:
+                    print(f"[LocalSubjectSafety] Result cache hit (hits={stats['hits']}, misses={stats['misses']})")
+                    return tuple(json.loads(cached))
+                print(f"[LocalSubjectSafety] Result cache miss (hits={stats['hits']}, misses={stats['misses']})")
+            
+            llm = _load_llm(model_path=model_path, n_ctx=n_ctx, n_gpu_layers=n_gpu_layers, seed=seed)
+            grammar = _get_json_grammar("subject_safety", _SUBJECT_SAFETY_SCHEMA) if constrained_json else None
+            
+            llm_key = _llm_cache_key(model_path, n_ctx, n_gpu_layers)
+            reused = _prime_prompt_prefix(llm, llm_key, prefix)
+            
+            print(f"[LocalSubjectSafety] Analyzing caption with Llama (reusing {reused} prefix tokens): {caption[:100]}...")
+            
+            response = llm(
+                full_prompt,
+                max_tokens=max_new_tokens,
+                temperature=temperature,
+                stop=["Image:", "\n\n\n", "```", "Note:", "Here's"],
+                echo=False,
+                grammar=grammar,
+                seed=seed,
+            )
+            
+            raw_output = response["choices"][0]["text"].strip()
+            print(f"[LocalSubjectSafety] Raw output: {raw_output[:300]}")
+            
+            start = raw_output.find("{")
+            end = raw_output.rfind("}")
+            if start == -1 or end <= start:
+                raise ValueError(f"Model did not return JSON. Output was:\n{raw_output}")
+            subject_str, safety_str = self._split_result(json.loads(raw_output[start : end + 1]))
+            
+            print(f"[LocalSubjectSafety] Subject: {subject_str}")
+            print(f"[LocalSubjectSafety] Classification: {json.loads(safety_str)['classification']}")
+            
+            if cache_key is not None:
+                llm_result_cache.put(cache_key, json.dumps([subject_str, safety_str], ensure_ascii=False))
+            
+            return (subject_str, safety_str)
+        
+        except Exception as e:
+            error_msg = f"Error in LocalSubjectSafetyLlama: {str(e)}"
+            print(f"[LocalSubjectSafety] {error_msg}")
+            import traceback
+            traceback.print_exc()
+            return self._error_result(error_msg)
+
+
 # ComfyUI entrypoint
 NODE_CLASS_MAPPINGS = {
     "LocalJSONExtractorLlama": LocalJSONExtractorLlama,
     "MultiDomainSafetyClassifier": MultiDomainSafetyClassifier,
+    "LocalSubjectSafetyLlama": LocalSubjectSafetyLlama,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
     "LocalJSONExtractorLlama": "Local JSON Extractor (Llama)",
     "MultiDomainSafetyClassifier": "Multi-Domain Safety Classifier (Llama)",
+    "LocalSubjectSafetyLlama": "Subject + Safety in One Pass (Llama)",
 }
@@ -1,10 +1,10 @@
 # nudenet_safety_checker.py
 # NudeNet integration for accurate nudity detection
-import os
 import json
+import threading
 import numpy as np
-from PIL import Image
-import folder_paths
+import torch
+import torch.nn.functional as F
 
 try:
     from nudenet import NudeDetector
@@ -13,16 +13,157 @@ except ImportError:
     NUDENET_AVAILABLE = False
     print("[NudeNetSafetyChecker] WARNING: nudenet not installed. Run: pip install nudenet")
 
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Class order of the NudeNet v3 detector output
+NUDENET_LABELS = [
+    "FEMALE_GENITALIA_COVERED",
+    "FACE_FEMALE",
+    "BUTTOCKS_EXPOSED",
+    "FEMALE_BREAST_EXPOSED",
+    "FEMALE_GENITALIA_EXPOSED",
+    "MALE_BREAST_EXPOSED",
+    "ANUS_EXPOSED",
+    "FEET_EXPOSED",
+    "BELLY_COVERED",
+    "FEET_COVERED",
+    "ARMPITS_COVERED",
+    "ARMPITS_EXPOSED",
+    "FACE_MALE",
+    "BELLY_EXPOSED",
+    "MALE_GENITALIA_EXPOSED",
+    "ANUS_COVERED",
+    "FEMALE_BREAST_COVERED",
+    "BUTTOCKS_COVERED",
+]
+
+NSFW_LABELS = [
+    "FEMALE_BREAST_EXPOSED",
+    "FEMALE_GENITALIA_EXPOSED",
+    "MALE_GENITALIA_EXPOSED",
+    "ANUS_EXPOSED",
+    "BUTTOCKS_EXPOSED"
+]
+
+# Same candidate filtering and NMS settings as NudeDetector.detect
+MIN_CANDIDATE_SCORE = 0.2
+NMS_SCORE_THRESHOLD = 0.25
+NMS_IOU_THRESHOLD = 0.45
+
+_detector = None
+_detector_lock = threading.Lock()
+# Detector sessions that rejected a multi-image batch
+_per_image_only = set()
+
+
+def get_detector():
+    """Process-wide NudeDetector, loaded on first use"""
+    global _detector
+    with _detector_lock:
+        if _detector is None:
+            print("[NudeNetSafetyChecker] Loading NudeNet model...")
+            _detector = NudeDetector()
+            print("[NudeNetSafetyChecker] Model loaded")
+        return _detector
+
+
+def preprocess_batch(image, input_size):
+    """
+    Pad ComfyUI images to square (bottom/right, black) and resize to the detector input,
+    matching NudeNet's own reader without a file round trip
+
+    Returns:
+        ([N,3,size,size] float32 array, padded square side in pixels)
+    """
+    x = image[..., :3].permute(0, 3, 1, 2).float()
+    height, width = x.shape[2], x.shape[3]
+    side = max(height, width)
+    x = F.pad(x, (0, side - width, 0, side - height), value=0.0)
+    x = F.interpolate(x, size=(input_size, input_size), mode='bilinear', align_corners=False)
+    return x.clamp(0, 1).cpu().numpy().astype(np.float32), side
+
+
+def postprocess_output(output, side, width, height, input_size):
+    """
+    Decode one [4 + classes, anchors] YOLOv8 output into NudeNet style detections
+
+    Returns:
+        List of {"class", "score", "box": [x, y, w, h]} in original image pixels
+    """
+    rows = output.T
+    class_scores = rows[:, 4:]
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores.max(axis=1)
+    keep = scores >= MIN_CANDIDATE_SCORE
+    if not keep.any():
+        return []
+    rows, class_ids, scores = rows[keep], class_ids[keep], scores[keep]
+
+    scale = side / input_size
+    w = rows[:, 2] * scale
+    h = rows[:, 3] * scale
+    x = np.clip((rows[:, 0] - rows[:, 2] / 2) * scale, 0, width)
+    y = np.clip((rows[:, 1] - rows[:, 3] / 2) * scale, 0, height)
+    w = np.minimum(w, width - x)
+    h = np.minimum(h, height - y)
+
+    boxes = np.stack([x, y, w, h], axis=1)
+    indices = cv2.dnn.NMSBoxes(boxes.tolist(), scores.tolist(), NMS_SCORE_THRESHOLD, NMS_IOU_THRESHOLD)
+
+    detections = []
+    for i in np.array(indices).reshape(-1):
+        detections.append({
+            "class": NUDENET_LABELS[class_ids[i]],
+            "score": float(scores[i]),
+            "box": [int(v) for v in boxes[i]]
+        })
+    return detections
+
+
+def detect_batch(detector, image):
+    """
+    Run the detector over every image of a ComfyUI IMAGE batch in memory
+
+    Uses the detector's ONNX session directly with one stacked run; detectors
+    without an exposed session get per-image numpy arrays instead
+
+    Returns:
+        List of detection lists, one per image
+    """
+    session = getattr(detector, "onnx_session", None)
+    if session is None or cv2 is None:
+        frames = (image[..., :3].cpu().numpy() * 255).round().astype(np.uint8)
+        # NudeNet expects OpenCV (BGR) channel order for arrays
+        return [detector.detect(np.ascontiguousarray(frame[..., ::-1])) for frame in frames]
+
+    input_name = session.get_inputs()[0].name
+    input_size = getattr(detector, "input_width", None) or session.get_inputs()[0].shape[-1]
+    height, width = image.shape[1], image.shape[2]
+    batch, side = preprocess_batch(image, input_size)
+
+    outputs = None
+    if len(batch) > 1 and id(session) not in _per_image_only:
+        try:
+            outputs = session.run(None, {input_name: batch})[0]
+        except Exception as e:
+            print(f"[NudeNetSafetyChecker] Batched run failed ({e}), checking images one at a time")
+            _per_image_only.add(id(session))
+    if outputs is None:
+        outputs = np.concatenate([session.run(None, {input_name: batch[i:i + 1]})[0] for i in range(len(batch))])
+
+    return [postprocess_output(out, side, width, height, input_size) for out in outputs]
+
 
 class NudeNetSafetyChecker:
     """
     Specialized nudity detector using NudeNet.
     More accurate than text-based classification for sexual content.
+    Every image in the batch is checked; the batch is NSFW if any image is.
     """
     
-    def __init__(self):
-        self.detector = None
-    
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -38,6 +179,7 @@ class NudeNetSafetyChecker:
     RETURN_NAMES = ("json", "is_nsfw", "max_score")
     FUNCTION = "check_nudity"
     CATEGORY = "LLM/Local/Safety"
+    RESOURCES = ("onnx",)
     
     def check_nudity(self, image, threshold=0.6):
         if not NUDENET_AVAILABLE:
@@ -49,57 +191,44 @@ class NudeNetSafetyChecker:
             )
         
         try:
-            # Load detector if not loaded
-            if self.detector is None:
-                print("[NudeNetSafetyChecker] Loading NudeNet model...")
-                self.detector = NudeDetector()
-                print("[NudeNetSafetyChecker] Model loaded")
-            
-            # Convert ComfyUI tensor to PIL Image
-            img_tensor = image[0].cpu() if image[0].is_cuda else image[0]
-            img_np = (img_tensor.numpy() * 255).astype(np.uint8)
-            pil_image = Image.fromarray(img_np)
-            
-            # Save temporarily for NudeNet (it requires file path)
-            temp_dir = os.path.join(folder_paths.get_temp_directory(), "nudenet")
-            os.makedirs(temp_dir, exist_ok=True)
-            temp_path = os.path.join(temp_dir, "check.jpg")
-            pil_image.save(temp_path, quality=95)
+            detector = get_detector()
             
-            print("[NudeNetSafetyChecker] Analyzing image with NudeNet...")
+            print(f"[NudeNetSafetyChecker] Analyzing {image.shape[0]} image(s) with NudeNet...")
             
-            # Run detection
-            detections = self.detector.detect(temp_path)
-            
-            # Clean up temp file
-            try:
-                os.remove(temp_path)
-            except:
-                pass
-            
-            # Classify detections
-            nsfw_labels = [
-                "FEMALE_BREAST_EXPOSED",
-                "FEMALE_GENITALIA_EXPOSED",
-                "MALE_GENITALIA_EXPOSED",
-                "ANUS_EXPOSED",
-                "BUTTOCKS_EXPOSED"
-            ]
+            with torch.no_grad():
+                batch_detections = detect_batch(detector, image)
             
             nsfw_detections = []
+            per_image = []
+            all_detections_count = 0
             max_score = 0.0
+            # Highest NSFW label score regardless of threshold, used by HybridSafetyGate's uncertainty band
+            raw_max_score = 0.0
             
-            for detection in detections:
-                label = detection.get("class", "")
-                score = detection.get("score", 0.0)
+            for index, detections in enumerate(batch_detections):
+                image_max = 0.0
+                image_hits = 0
+                all_detections_count += len(detections)
+                
+                for detection in detections:
+                    label = detection.get("class", "")
+                    score = detection.get("score", 0.0)
+                    
+                    if label in NSFW_LABELS:
+                        raw_max_score = max(raw_max_score, score)
+                    
+                    if label in NSFW_LABELS and score >= threshold:
+                        nsfw_detections.append({
+                            "label": label,
+                            "score": score,
+                            "box": detection.get("box", []),
+                            "image_index": index
+                        })
+                        image_max = max(image_max, score)
+                        image_hits += 1
                 
-                if label in nsfw_labels and score >= threshold:
-                    nsfw_detections.append({
-                        "label": label,
-                        "score": score,
-                        "box": detection.get("box", [])
-                    })
-                    max_score = max(max_score, score)
+                per_image.append({"image_index": index, "is_nsfw": image_hits > 0, "max_score": image_max})
+                max_score = max(max_score, image_max)
             
             is_nsfw = len(nsfw_detections) > 0
             
@@ -110,14 +239,16 @@ class NudeNetSafetyChecker:
             
             if is_nsfw:
                 for det in nsfw_detections:
-                    print(f"    - {det['label']}: {det['score']:.3f}")
+                    print(f"    - [{det['image_index']}] {det['label']}: {det['score']:.3f}")
             
             result = {
                 "is_nsfw": is_nsfw,
                 "max_score": max_score,
+                "raw_max_score": raw_max_score,
                 "threshold": threshold,
                 "detections": nsfw_detections,
-                "all_detections_count": len(detections),
+                "all_detections_count": all_detections_count,
+                "images": per_image,
                 "model": "NudeNet"
             }
             
@@ -139,6 +270,10 @@ class HybridSafetyGate:
     """
     Combines NudeNet (for sexual content) + Multi-Domain Classifier (for other categories).
     Best of both worlds: specialized model + contextual understanding.
+    
+    The multi-domain input is lazy: the caption + LLM branch only runs when NudeNet
+    has not settled the image on its own (see llm_check). By default images NudeNet is
+    confident are clean skip it, so the other domains are only checked for uncertain ones.
     """
     
     @classmethod
@@ -147,12 +282,14 @@ class HybridSafetyGate:
             "required": {
                 "image": ("IMAGE",),
                 "nudenet_json": ("STRING", {"forceInput": True}),
-                "multidomain_json": ("STRING", {"forceInput": True}),
+                "multidomain_json": ("STRING", {"forceInput": True, "lazy": True}),
             },
             "optional": {
                 "block_unsafe": ("BOOLEAN", {"default": True}),
                 "block_borderline": ("BOOLEAN", {"default": False}),
                 "nudenet_overrides_llama": ("BOOLEAN", {"default": True}),
+                "llm_check": (["uncertain_only", "when_not_blocked"], {"default": "uncertain_only", "tooltip": "uncertain_only: run the LLM branch only for NudeNet scores from uncertain_low up to the threshold, clean images skip it (violence/hate/disturbing/drugs are then not checked). when_not_blocked: run it unless NudeNet already blocks"}),
+                "uncertain_low": ("FLOAT", {"default": 0.2, "min": 0.0, "max": 1.0, "step": 0.05, "tooltip": "NudeNet scores from here up to the NudeNet threshold are uncertain and get the LLM check"}),
             }
         }
     
@@ -160,15 +297,52 @@ class HybridSafetyGate:
     RETURN_NAMES = ("image", "status")
     FUNCTION = "check_hybrid"
     CATEGORY = "LLM/Local/Safety"
+    RESOURCES = ()
+    
+    @staticmethod
+    def _nudenet_verdict(nudenet_json, llm_check, uncertain_low):
+        """
+        "unsafe" or "safe" when NudeNet alone settles the image, None when the LLM branch is needed
+        """
+        try:
+            data = json.loads(nudenet_json)
+        except (TypeError, ValueError):
+            return None
+        if data.get("error"):
+            return None
+        if data.get("is_nsfw", False):
+            return "unsafe"
+        if llm_check == "uncertain_only":
+            score = data.get("raw_max_score", data.get("max_score", 0.0))
+            if score < uncertain_low:
+                return "safe"
+        return None
+    
+    def check_lazy_status(
+        self,
+        image,
+        nudenet_json,
+        multidomain_json=None,
+        block_unsafe=True,
+        block_borderline=False,
+        nudenet_overrides_llama=True,
+        llm_check="uncertain_only",
+        uncertain_low=0.2,
+    ):
+        if multidomain_json is None and self._nudenet_verdict(nudenet_json, llm_check, uncertain_low) is None:
+            return ["multidomain_json"]
+        return []
     
     def check_hybrid(
         self,
         image,
         nudenet_json: str,
-        multidomain_json: str,
+        multidomain_json: str = None,
         block_unsafe: bool = True,
         block_borderline: bool = False,
         nudenet_overrides_llama: bool = True,
+        llm_check: str = "uncertain_only",
+        uncertain_low: float = 0.2,
     ):
         violations = []
         
@@ -178,33 +352,38 @@ class HybridSafetyGate:
             is_nsfw = nudenet_data.get("is_nsfw", False)
             nudenet_score = nudenet_data.get("max_score", 0.0)
             
-            # Parse Multi-Domain results
-            multidomain_data = json.loads(multidomain_json)
-            classification = multidomain_data.get("classification", {})
-            
             print("[HybridSafetyGate] Combined Safety Check:")
             print(f"  NudeNet NSFW: {is_nsfw} (score: {nudenet_score:.3f})")
             
             # Check NudeNet (sexual content)
             if is_nsfw:
                 violations.append(f"Sexual content detected by NudeNet (score: {nudenet_score:.3f})")
-            elif not nudenet_overrides_llama:
-                # Also check Llama's sexual classification if NudeNet didn't override
-                sexual_status = classification.get("sexual", "SAFE")
-                if block_unsafe and sexual_status == "UNSAFE":
-                    violations.append(f"Sexual content (Llama: {sexual_status})")
-                elif block_borderline and sexual_status == "BORDERLINE":
-                    violations.append(f"Sexual content (Llama: {sexual_status})")
             
-            # Check other domains from Multi-Domain Classifier
-            for domain in ["violence", "hate", "disturbing", "drugs"]:
-                status = classification.get(domain, "SAFE")
-                print(f"  {domain.capitalize()}: {status}")
+            if multidomain_json is None:
+                # check_lazy_status skipped the caption + LLM branch
+                print("  Multi-Domain: skipped (NudeNet result was conclusive)")
+            else:
+                # Parse Multi-Domain results
+                multidomain_data = json.loads(multidomain_json)
+                classification = multidomain_data.get("classification", {})
+                
+                if not is_nsfw and not nudenet_overrides_llama:
+                    # Also check Llama's sexual classification if NudeNet didn't override
+                    sexual_status = classification.get("sexual", "SAFE")
+                    if block_unsafe and sexual_status == "UNSAFE":
+                        violations.append(f"Sexual content (Llama: {sexual_status})")
+                    elif block_borderline and sexual_status == "BORDERLINE":
+                        violations.append(f"Sexual content (Llama: {sexual_status})")
                 
-                if block_unsafe and status == "UNSAFE":
-                    violations.append(f"{domain.capitalize()} content ({status})")
-                elif block_borderline and status == "BORDERLINE":
-                    violations.append(f"{domain.capitalize()} content ({status})")
+                # Check other domains from Multi-Domain Classifier
+                for domain in ["violence", "hate", "disturbing", "drugs"]:
+                    status = classification.get(domain, "SAFE")
+                    print(f"  {domain.capitalize()}: {status}")
+                    
+                    if block_unsafe and status == "UNSAFE":
+                        violations.append(f"{domain.capitalize()} content ({status})")
+                    elif block_borderline and status == "BORDERLINE":
+                        violations.append(f"{domain.capitalize()} content ({status})")
             
             # Block if violations found
             if violations:
@@ -214,7 +393,11 @@ class HybridSafetyGate:
                 raise ValueError(error_msg)
             
             # All safe
-            status_msg = "SAFE: Passed NudeNet + Multi-Domain checks"
+            if multidomain_json is None:
+                raw_score = nudenet_data.get("raw_max_score", nudenet_score)
+                status_msg = f"SAFE: NudeNet clean (score {raw_score:.3f} < {uncertain_low:.2f}), Multi-Domain check skipped"
+            else:
+                status_msg = "SAFE: Passed NudeNet + Multi-Domain checks"
             print(f"[HybridSafetyGate] ✅ {status_msg}")
             return (image, status_msg)
         
@@ -2055,6 +2055,13 @@ class Florence2LanguageModel(Florence2LanguagePreTrainedModel):
         )
 
 
+def _get_past_length(past_key_values):
+    """Number of decoded tokens held by a legacy tuple cache or a transformers Cache"""
+    if hasattr(past_key_values, "get_seq_length"):
+        return past_key_values.get_seq_length()
+    return past_key_values[0][0].shape[2]
+
+
 class Florence2LanguageForConditionalGeneration(Florence2LanguagePreTrainedModel, GenerationMixin):
     base_model_prefix = "model"
     _tied_weights_keys = ["encoder.embed_tokens.weight", "decoder.embed_tokens.weight", "lm_head.weight"]
@@ -2068,6 +2075,12 @@ class Florence2LanguageForConditionalGeneration(Florence2LanguagePreTrainedModel
 
         # Initialize weights and apply final processing
         self.post_init()
+
+    @classmethod
+    def _supports_default_dynamic_cache(cls):
+        # Decoder layers exchange legacy (self_k, self_v, cross_k, cross_v) tuples, so generate()
+        # must let the model build its own cache instead of passing in a DynamicCache
+        return False
     
     def _tie_weights(self):
         if self.config.tie_word_embeddings:
@@ -2197,7 +2210,7 @@ class Florence2LanguageForConditionalGeneration(Florence2LanguagePreTrainedModel
     ):
         # cut decoder_input_ids if past_key_values is used
         if past_key_values is not None:
-            past_length = past_key_values[0][0].shape[2]
+            past_length = _get_past_length(past_key_values)
 
             # Some generation methods already pass only the last input ID
             if decoder_input_ids.shape[1] > past_length:
@@ -2820,7 +2833,7 @@ class Florence2ForConditionalGeneration(Florence2PreTrainedModel, GenerationMixi
     ):
         # cut decoder_input_ids if past_key_values is used
         if past_key_values is not None:
-            past_length = past_key_values[0][0].shape[2]
+            past_length = _get_past_length(past_key_values)
 
             # Some generation methods already pass only the last input ID
             if decoder_input_ids.shape[1] > past_length:
@@ -304,6 +304,8 @@ class Florence2Run:
                 "do_sample": ("BOOLEAN", {"default": True}),
                 "output_mask_select": ("STRING", {"default": ""}),
                 "seed": ("INT", {"default": 1, "min": 1, "max": 0xffffffffffffffff}),
+                "use_cache": ("BOOLEAN", {"default": True, "tooltip": "Reuse decoder key/values between generated tokens instead of recomputing attention over the whole sequence"}),
+                "batch_size": ("INT", {"default": 8, "min": 1, "max": 64, "tooltip": "Images captioned per generate call"}),
             }
         }
     
@@ -324,7 +326,7 @@ class Florence2Run:
         return hashed_seed % (2**32)
 
     def encode(self, image, text_input, florence2_model, task, fill_mask, keep_model_loaded=False, 
-            num_beams=3, max_new_tokens=1024, do_sample=True, output_mask_select="", seed=None):
+            num_beams=3, max_new_tokens=1024, do_sample=True, output_mask_select="", seed=None, use_cache=True, batch_size=8):
         device = mm.get_torch_device()
         _, height, width, _ = image.shape
         offload_device = mm.unet_offload_device()
@@ -368,16 +370,18 @@ class Florence2Run:
         else:
             prompt = task_prompt
 
+        if task == 'docvqa' and text_input == "":
+            raise ValueError("Text input (prompt) is required for 'docvqa'")
+
         image = image.permute(0, 3, 1, 2)
-        
-        out = []
-        out_masks = []
-        out_results = []
-        out_data = []
-        pbar = ProgressBar(len(image))
-        for img in image:
-            image_pil = F.to_pil_image(img)
-            inputs = processor(text=prompt, images=image_pil, return_tensors="pt", do_rescale=False).to(dtype).to(device)
+        images_pil = [F.to_pil_image(img) for img in image]
+
+        # every image shares the prompt, so a batch only pads the generated sequences
+        batch_results = []
+        pad_token = processor.tokenizer.pad_token
+        for start in range(0, len(images_pil), batch_size):
+            batch_images = images_pil[start:start + batch_size]
+            inputs = processor(text=[prompt] * len(batch_images), images=batch_images, return_tensors="pt", padding=True, do_rescale=False).to(dtype).to(device)
 
             generated_ids = model.generate(
                 input_ids=inputs["input_ids"],
@@ -385,10 +389,21 @@ class Florence2Run:
                 max_new_tokens=max_new_tokens,
                 do_sample=do_sample,
                 num_beams=num_beams,
-                use_cache=False,
+                use_cache=use_cache,
             )
 
-            results = processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
+            for results in processor.batch_decode(generated_ids, skip_special_tokens=False):
+                # shorter sequences in the batch are right padded after </s>
+                if pad_token:
+                    results = results.replace(pad_token, '')
+                batch_results.append(results)
+
+        out = []
+        out_masks = []
+        out_results = []
+        out_data = []
+        pbar = ProgressBar(len(image))
+        for image_pil, results in zip(images_pil, batch_results):
             print(results)
             # cleanup the special tokens from the final list
             if task == 'ocr_with_region':
@@ -644,28 +659,7 @@ class Florence2Run:
                 pbar.update(1)
             
             elif task == 'docvqa':
-                if text_input == "":
-                    raise ValueError("Text input (prompt) is required for 'docvqa'")
-                prompt = "<DocVQA> " + text_input
-
-                inputs = processor(text=prompt, images=image_pil, return_tensors="pt", do_rescale=False).to(dtype).to(device)
-                generated_ids = model.generate(
-                    input_ids=inputs["input_ids"],
-                    pixel_values=inputs["pixel_values"],
-                    max_new_tokens=max_new_tokens,
-                    do_sample=do_sample,
-                    num_beams=num_beams,
-                    use_cache=False,
-                )
-
-                results = processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
-                clean_results = results.replace('</s>', '').replace('<s>', '')
-                
-                if len(image) == 1:
-                    out_results = clean_results
-                else:
-                    out_results.append(clean_results)
-                    
+                # the answer was already generated above with the same "<DocVQA> question" prompt
                 out.append(F.to_tensor(image_pil).unsqueeze(0).permute(0, 2, 3, 1).cpu().float())
 
                 pbar.update(1)
@@ -1,18 +1,57 @@
 from __future__ import annotations
 import torch
 import os
+import zlib
+import asyncio
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import folder_paths
 from datetime import datetime
 
 
+# Encoding runs on a bounded pool shared by every SaveImageNoMetadata node, so a batch is
+# encoded in parallel without the executor thread (or the event loop) doing the work.
+# SAVE_IMAGE_ENCODE_WORKERS overrides the pool size.
+ENCODE_WORKERS = int(os.environ.get('SAVE_IMAGE_ENCODE_WORKERS', min(4, os.cpu_count() or 1)))
+_encode_pool = ThreadPoolExecutor(max_workers=max(1, ENCODE_WORKERS), thread_name_prefix="save_image_encode")
+
+FORMATS = ["png", "webp_lossless", "webp"]
+EXTENSIONS = {"png": "png", "webp_lossless": "webp", "webp": "webp"}
+PNG_STRATEGIES = {
+    "default": zlib.Z_DEFAULT_STRATEGY,
+    "rle": zlib.Z_RLE,
+    "filtered": zlib.Z_FILTERED,
+    "huffman": zlib.Z_HUFFMAN_ONLY,
+}
+
+
+def encoder_options(format, compress_level, png_strategy, quality):
+    """PIL save() arguments for the chosen format"""
+    if format == "png":
+        return {"format": "PNG", "compress_level": compress_level, "compress_type": PNG_STRATEGIES[png_strategy]}
+    # WebP effort (method 0-6) follows compress_level so 0 is the fastest for both formats
+    method = round(compress_level * 6 / 9)
+    if format == "webp_lossless":
+        return {"format": "WEBP", "lossless": True, "method": method, "quality": round(compress_level * 100 / 9)}
+    return {"format": "WEBP", "quality": quality, "method": method}
+
+
+def encode_and_write(pixels, path, options):
+    """Convert one [H,W,C] float image to 8-bit, encode it and write it to path"""
+    img = Image.fromarray(np.clip(255. * pixels, 0, 255).astype(np.uint8))
+    tmp_path = f"{path}.tmp"
+    # Written under a temporary name so a partially written file is never served
+    img.save(tmp_path, **options)
+    os.replace(tmp_path, path)
+
+
 class SaveImageNoMetadata:
     """
     Custom node to save images without any metadata.
     This removes all workflow information and prompts from the saved image file.
     """
-    
+
     def __init__(self):
         self.output_dir = folder_paths.get_output_directory()
         self.type = "output"
@@ -26,6 +65,12 @@ class SaveImageNoMetadata:
                 "images": ("IMAGE", {"tooltip": "The images to save without metadata."}),
                 "filename_prefix": ("STRING", {"default": "Untitled image", "tooltip": "The prefix for the file to save."})
             },
+            "optional": {
+                "format": (FORMATS, {"default": "png", "tooltip": "png: lossless, widely supported. webp_lossless: lossless, smaller and faster to encode. webp: lossy."}),
+                "compress_level": ("INT", {"default": 4, "min": 0, "max": 9, "tooltip": "Compression effort. 1 with the rle strategy is a fast PNG setting, for WebP this sets the encoder method."}),
+                "png_strategy": (list(PNG_STRATEGIES.keys()), {"default": "default", "tooltip": "zlib strategy for PNG. rle is usually much faster at a similar size."}),
+                "quality": ("INT", {"default": 90, "min": 1, "max": 100, "tooltip": "Quality for lossy WebP."}),
+            }
         }
 
     RETURN_TYPES = ()
@@ -34,40 +79,46 @@ class SaveImageNoMetadata:
     CATEGORY = "image"
     DESCRIPTION = "Saves images without any metadata (no workflow, no prompts)."
 
-    def save_images(self, images, filename_prefix="Untitled image"):
+    async def save_images(self, images, filename_prefix="Untitled image", format="png", compress_level=None, png_strategy="default", quality=90):
+        if compress_level is None:
+            compress_level = self.compress_level
         filename_prefix += self.prefix_append
         full_output_folder, filename, counter, subfolder, filename_prefix = folder_paths.get_save_image_path(
             filename_prefix, self.output_dir, images[0].shape[1], images[0].shape[0]
         )
         results = list()
-        
+        options = encoder_options(format, compress_level, png_strategy, quality)
+        extension = EXTENSIONS[format]
+
         # Generate timestamp once for this batch
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        
-        for (batch_number, image) in enumerate(images):
-            # Convert tensor to numpy array
-            i = 255. * image.cpu().numpy()
-            img = Image.fromarray(np.clip(i, 0, 255).astype(np.uint8))
-            
+
+        # One device transfer for the batch, the 8-bit conversion happens on the encode pool
+        pixels = images.detach().to("cpu", torch.float32).numpy()
+        loop = asyncio.get_running_loop()
+        pending = []
+        for (batch_number, image) in enumerate(pixels):
             # No metadata - this is the key difference from SaveImage
             # We simply don't pass pnginfo parameter
-            
+
             # Use timestamp instead of counter
             if batch_number > 0:
                 # For batches, append batch number to timestamp
-                file = f"{filename_prefix}_{timestamp}_{batch_number}.png"
+                file = f"{filename_prefix}_{timestamp}_{batch_number}.{extension}"
             else:
-                file = f"{filename_prefix}_{timestamp}.png"
-            
-            # Save without metadata
-            img.save(os.path.join(full_output_folder, file), compress_level=self.compress_level)
-            
+                file = f"{filename_prefix}_{timestamp}.{extension}"
+
+            # Queue the encode + write, the prompt only completes once every file is flushed
+            pending.append(loop.run_in_executor(_encode_pool, encode_and_write, image, os.path.join(full_output_folder, file), options))
+
             results.append({
                 "filename": file,
                 "subfolder": subfolder,
                 "type": self.type
             })
 
+        await asyncio.gather(*pending)
+        folder_paths.save_counter_index.record_saved(full_output_folder, [r["filename"] for r in results])
         return { "ui": { "images": results } }
 
 
@@ -1,6 +1,8 @@
+import contextvars
 import copy
 import heapq
 import inspect
+import json
 import logging
 import sys
 import threading
@@ -9,11 +11,15 @@ import traceback
 from enum import Enum
 from typing import List, Literal, NamedTuple, Optional, Union
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
 
 import comfy.model_management
+from comfy.cli_args import args
+import folder_paths
 import nodes
+from comfy_execution.attachments import attachment_store
 from comfy_execution.caching import (
     BasicCache,
     CacheKeySetID,
@@ -29,7 +35,8 @@ from comfy_execution.graph import (
     get_input_info,
 )
 from comfy_execution.graph_utils import GraphBuilder, is_link
-from comfy_execution.validation import validate_node_input
+from comfy_execution.scheduling import ResourceScheduler, get_node_resources, hold_process_resources
+from comfy_execution.validation import ValidationTemplate, ValidationTemplateCache, literal_inputs, prompt_structure_key, validate_node_input
 from comfy_execution.progress import get_progress_state, reset_progress_state, add_progress_handler, WebUIProgressHandler
 from comfy_execution.utils import CurrentNodeContext
 from comfy_api.internal import _ComfyNodeInternal, _NodeOutputInternal, first_real_override, is_class, make_locked_method_func
@@ -214,6 +221,17 @@ async def resolve_map_node_over_list_results(results):
                 raise exc
         return [x.result() if isinstance(x, asyncio.Task) else x for x in results]
 
+# Set while the concurrent scheduler is running a prompt. Synchronous node functions are then
+# run on this pool instead of blocking the event loop, so independent branches overlap.
+node_worker_pool: contextvars.ContextVar[Optional[ThreadPoolExecutor]] = contextvars.ContextVar("node_worker_pool", default=None)
+
+def _call_node_function_in_worker(f, inputs, prompt_id, unique_id, index, pre_execute_cb):
+    # Worker threads don't inherit the inference mode, node context or graph prefix of the event loop thread
+    if pre_execute_cb is not None and index is not None:
+        pre_execute_cb(index)
+    with torch.inference_mode(), CurrentNodeContext(prompt_id, unique_id, index):
+        return f(**inputs)
+
 async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, func, allow_interrupt=False, execution_block_cb=None, pre_execute_cb=None, hidden_inputs=None):
     # check if node wants the lists
     input_is_list = getattr(obj, "INPUT_IS_LIST", False)
@@ -242,8 +260,6 @@ async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, f
                 execution_block = execution_block_cb(v) if execution_block_cb else v
                 break
         if execution_block is None:
-            if pre_execute_cb is not None and index is not None:
-                pre_execute_cb(index)
             # V3
             if isinstance(obj, _ComfyNodeInternal) or (is_class(obj) and issubclass(obj, _ComfyNodeInternal)):
                 # if is just a class, then assign no resources or state, just create clone
@@ -260,6 +276,15 @@ async def _async_map_node_over_list(prompt_id, unique_id, obj, input_data_all, f
             # V1
             else:
                 f = getattr(obj, func)
+            worker_pool = node_worker_pool.get()
+            if worker_pool is not None and not inspect.iscoroutinefunction(f):
+                loop = asyncio.get_running_loop()
+                context = contextvars.copy_context()
+                result = await loop.run_in_executor(worker_pool, context.run, _call_node_function_in_worker, f, inputs, prompt_id, unique_id, index, pre_execute_cb)
+                results.append(result)
+                return
+            if pre_execute_cb is not None and index is not None:
+                pre_execute_cb(index)
             if inspect.iscoroutinefunction(f):
                 async def async_wrapper(f, prompt_id, unique_id, list_index, args):
                     with CurrentNodeContext(prompt_id, unique_id, list_index):
@@ -597,10 +622,13 @@ async def execute(server, dynprompt, caches, current_item, extra_data, executed,
     return (ExecutionResult.SUCCESS, None, None)
 
 class PromptExecutor:
-    def __init__(self, server, cache_type=False, cache_size=None):
+    def __init__(self, server, cache_type=False, cache_size=None, parallel_branches=1):
         self.cache_size = cache_size
         self.cache_type = cache_type
         self.server = server
+        # Above 1, independent branches of a prompt run concurrently (see execute_branches_parallel)
+        self.parallel_branches = max(1, parallel_branches)
+        self.worker_pool = None
         self.reset()
 
     def reset(self):
@@ -645,12 +673,82 @@ class PromptExecutor:
             }
             self.add_message("execution_error", mes, broadcast=False)
 
+    async def execute_branches_parallel(self, dynamic_prompt, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes):
+        """
+        Run every ready node whose resource tags are free, up to parallel_branches at a time.
+        Synchronous node functions run on the worker pool while all graph and cache
+        bookkeeping stays on the event loop. Returns (error, ex) of the first failure.
+        """
+        if self.worker_pool is None:
+            self.worker_pool = ThreadPoolExecutor(max_workers=self.parallel_branches, thread_name_prefix="node_worker")
+        scheduler = ResourceScheduler(self.parallel_branches)
+        running = {}
+        failure = None
+
+        def node_resources(node_id):
+            class_type = dynamic_prompt.get_node(node_id)["class_type"]
+            return get_node_resources(nodes.NODE_CLASS_MAPPINGS[class_type])
+
+        token = node_worker_pool.set(self.worker_pool)
+        try:
+            while True:
+                if failure is None:
+                    candidates = execution_list.get_schedulable_nodes(scheduler.running)
+                    for node_id in scheduler.pick(candidates, node_resources):
+                        task = asyncio.create_task(self.execute_node(dynamic_prompt, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes))
+                        running[task] = node_id
+
+                if len(running) == 0:
+                    if failure is not None or execution_list.is_empty():
+                        break
+                    if execution_list.externalBlocks == 0:
+                        failure = execution_list.get_cycle_error()
+                        break
+
+                waiters = set(running)
+                unblocked = None
+                if execution_list.externalBlocks > 0:
+                    # Wait for an external block to be released as well as for running nodes
+                    unblocked = asyncio.create_task(execution_list.unblockedEvent.wait())
+                    waiters.add(unblocked)
+                done, _ = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+                if unblocked is not None:
+                    unblocked.cancel()
+                    execution_list.unblockedEvent.clear()
+
+                for task in done:
+                    if task is unblocked:
+                        continue
+                    node_id = running.pop(task)
+                    scheduler.release(node_id)
+                    result, error, ex = task.result()
+                    if result == ExecutionResult.FAILURE:
+                        # Nodes already running are allowed to finish, nothing new is started
+                        if failure is None:
+                            failure = (error, ex)
+                    elif result == ExecutionResult.SUCCESS:
+                        execution_list.pop_node(node_id)
+        finally:
+            node_worker_pool.reset(token)
+
+        self.success = failure is None
+        return failure if failure is not None else (None, None)
+
+    async def execute_node(self, dynamic_prompt, node_id, *args):
+        # Nodes on other prompt workers may hold the same process-wide resources
+        class_type = dynamic_prompt.get_node(node_id)["class_type"]
+        async with hold_process_resources(get_node_resources(nodes.NODE_CLASS_MAPPINGS[class_type])):
+            return await execute(self.server, dynamic_prompt, self.caches, node_id, *args)
+
     def execute(self, prompt, prompt_id, extra_data={}, execute_outputs=[]):
-        asyncio.run(self.execute_async(prompt, prompt_id, extra_data, execute_outputs))
+        # Interrupts are per prompt, so other prompt workers don't consume or clear this one's
+        token = comfy.model_management.begin_prompt_processing(prompt_id)
+        try:
+            asyncio.run(self.execute_async(prompt, prompt_id, extra_data, execute_outputs))
+        finally:
+            comfy.model_management.end_prompt_processing(token)
 
     async def execute_async(self, prompt, prompt_id, extra_data={}, execute_outputs=[]):
-        nodes.interrupt_processing(False)
-
         if "client_id" in extra_data:
             self.server.client_id = extra_data["client_id"]
         else:
@@ -673,7 +771,8 @@ class PromptExecutor:
                 if self.caches.outputs.get(node_id) is not None:
                     cached_nodes.append(node_id)
 
-            comfy.model_management.cleanup_models_gc()
+            async with hold_process_resources(["gpu"]):
+                comfy.model_management.cleanup_models_gc()
             self.add_message("execution_cached",
                           { "nodes": cached_nodes, "prompt_id": prompt_id},
                           broadcast=False)
@@ -685,25 +784,32 @@ class PromptExecutor:
             for node_id in list(execute_outputs):
                 execution_list.add_node(node_id)
 
-            while not execution_list.is_empty():
-                node_id, error, ex = await execution_list.stage_node_execution()
+            if self.parallel_branches > 1:
+                error, ex = await self.execute_branches_parallel(dynamic_prompt, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes)
                 if error is not None:
                     self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
-                    break
-
-                assert node_id is not None, "Node ID should not be None at this point"
-                result, error, ex = await execute(self.server, dynamic_prompt, self.caches, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes)
-                self.success = result != ExecutionResult.FAILURE
-                if result == ExecutionResult.FAILURE:
-                    self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
-                    break
-                elif result == ExecutionResult.PENDING:
-                    execution_list.unstage_node_execution()
-                else: # result == ExecutionResult.SUCCESS:
-                    execution_list.complete_node_execution()
+                else:
+                    self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
             else:
-                # Only execute when the while-loop ends without break
-                self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
+                while not execution_list.is_empty():
+                    node_id, error, ex = await execution_list.stage_node_execution()
+                    if error is not None:
+                        self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
+                        break
+
+                    assert node_id is not None, "Node ID should not be None at this point"
+                    result, error, ex = await self.execute_node(dynamic_prompt, node_id, extra_data, executed, prompt_id, execution_list, pending_subgraph_results, pending_async_nodes)
+                    self.success = result != ExecutionResult.FAILURE
+                    if result == ExecutionResult.FAILURE:
+                        self.handle_execution_error(prompt_id, dynamic_prompt.original_prompt, current_outputs, executed, error, ex)
+                        break
+                    elif result == ExecutionResult.PENDING:
+                        execution_list.unstage_node_execution()
+                    else: # result == ExecutionResult.SUCCESS:
+                        execution_list.complete_node_execution()
+                else:
+                    # Only execute when the while-loop ends without break
+                    self.add_message("execution_success", { "prompt_id": prompt_id }, broadcast=False)
 
             ui_outputs = {}
             meta_outputs = {}
@@ -719,10 +825,11 @@ class PromptExecutor:
             }
             self.server.last_node_id = None
             if comfy.model_management.DISABLE_SMART_MEMORY:
-                comfy.model_management.unload_all_models()
+                async with hold_process_resources(["gpu"]):
+                    comfy.model_management.unload_all_models()
 
 
-async def validate_inputs(prompt_id, prompt, item, validated):
+async def validate_inputs(prompt_id, prompt, item, validated, dependencies=None):
     unique_id = item
     if unique_id in validated:
         return validated[unique_id]
@@ -731,7 +838,10 @@ async def validate_inputs(prompt_id, prompt, item, validated):
     class_type = prompt[unique_id]['class_type']
     obj_class = nodes.NODE_CLASS_MAPPINGS[class_type]
 
-    class_inputs = obj_class.INPUT_TYPES()
+    with folder_paths.record_listing_dependencies() as node_dependencies:
+        class_inputs = obj_class.INPUT_TYPES()
+    if dependencies is not None:
+        dependencies[unique_id] = node_dependencies
     valid_inputs = set(class_inputs.get('required',{})).union(set(class_inputs.get('optional',{})))
 
     errors = []
@@ -805,7 +915,7 @@ async def validate_inputs(prompt_id, prompt, item, validated):
                 errors.append(error)
                 continue
             try:
-                r = await validate_inputs(prompt_id, prompt, o_id, validated)
+                r = await validate_inputs(prompt_id, prompt, o_id, validated, dependencies)
                 if r[0] is False:
                     # `r` will be set in `validated[o_id]` already
                     valid = False
@@ -963,7 +1073,57 @@ def full_type_name(klass):
         return klass.__qualname__
     return module + '.' + klass.__qualname__
 
+validation_templates = ValidationTemplateCache()
+
+def count_output_nodes(prompt, partial_execution_list):
+    count = 0
+    for node_id, node in prompt.items():
+        class_ = nodes.NODE_CLASS_MAPPINGS[node['class_type']]
+        if getattr(class_, 'OUTPUT_NODE', False) is True and (partial_execution_list is None or node_id in partial_execution_list):
+            count += 1
+    return count
+
+def has_validate_function(obj_class):
+    if issubclass(obj_class, _ComfyNodeInternal):
+        return first_real_override(obj_class, "validate_inputs") is not None
+    return getattr(obj_class, "VALIDATE_INPUTS", None) is not None
+
 async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[str], None]):
+    """
+    Validate a prompt. Prompts with the same graph as one validated before (widget values may
+    differ) only validate the nodes whose values or listed directories changed, and the nodes
+    with their own validation function.
+    """
+    key = None
+    raw = None
+    if all(isinstance(node, dict) and node.get('class_type') in nodes.NODE_CLASS_MAPPINGS for node in prompt.values()):
+        key = prompt_structure_key(prompt, partial_execution_list)
+        raw = {node_id: literal_inputs(node) for node_id, node in prompt.items()}
+        template = validation_templates.get(key)
+        if template is not None:
+            changed = template.changed_nodes(raw)
+            template.apply(prompt, changed)
+            validated = {node_id: (True, [], node_id) for node_id in template.dependencies if node_id not in changed}
+            dependencies = {}
+            try:
+                results = [await validate_inputs(prompt_id, prompt, node_id, validated, dependencies) for node_id in changed]
+            except Exception:
+                results = [(False,)]
+            if all(r[0] is True for r in results):
+                template.update(prompt, raw, dependencies)
+                return (True, None, list(template.outputs), {})
+            # Something is wrong with the new values, validate everything to report it the usual way
+
+    dependencies = {}
+    result = await validate_prompt_full(prompt_id, prompt, partial_execution_list, dependencies)
+    if key is not None and result[0] is True and len(result[3]) == 0 and len(result[2]) == count_output_nodes(prompt, partial_execution_list):
+        always_validate = {node_id for node_id in dependencies if has_validate_function(nodes.NODE_CLASS_MAPPINGS[prompt[node_id]['class_type']])}
+        converted = {node_id: literal_inputs(prompt[node_id]) for node_id in dependencies}
+        raw = {node_id: raw[node_id] for node_id in dependencies}
+        validation_templates.put(key, ValidationTemplate(list(result[2]), raw, converted, dependencies, always_validate))
+    return result
+
+async def validate_prompt_full(prompt_id, prompt, partial_execution_list: Union[list[str], None], dependencies=None):
     outputs = set()
     for x in prompt:
         if 'class_type' not in prompt[x]:
@@ -1007,7 +1167,7 @@ async def validate_prompt(prompt_id, prompt, partial_execution_list: Union[list[
         valid = False
         reasons = []
         try:
-            m = await validate_inputs(prompt_id, prompt, o, validated)
+            m = await validate_inputs(prompt_id, prompt, o, validated, dependencies)
             valid = m[0]
             reasons = m[1]
         except Exception as ex:
@@ -1082,8 +1242,11 @@ class PromptQueue:
         self.task_counter = 0
         self.queue = []
         self.currently_running = {}
-        self.history = {}
+        self.history: dict[str, bytes] = {}  # prompt_id -> serialized history entry, oldest first
+        self.history_bytes = 0
+        self.max_history_bytes = int(args.max_history_size * 1024 * 1024)
         self.flags = {}
+        self.worker_flags = {}
 
     def put(self, item):
         with self.mutex:
@@ -1099,7 +1262,8 @@ class PromptQueue:
                     return None
             item = heapq.heappop(self.queue)
             i = self.task_counter
-            self.currently_running[i] = copy.deepcopy(item)
+            # Queue items are never modified once queued, so they are shared instead of copied
+            self.currently_running[i] = item
             self.task_counter += 1
             self.server.queue_updated()
             return (item, i)
@@ -1111,35 +1275,42 @@ class PromptQueue:
 
     def task_done(self, item_id, history_result,
                   status: Optional['PromptQueue.ExecutionStatus']):
+        # Serialized before taking the item off currently_running, so pollers always find the
+        # prompt either running or in the history
         with self.mutex:
-            prompt = self.currently_running.pop(item_id)
-            if len(self.history) > MAXIMUM_HISTORY_SIZE:
-                self.history.pop(next(iter(self.history)))
-
-            status_dict: Optional[dict] = None
-            if status is not None:
-                status_dict = copy.deepcopy(status._asdict())
-
-            # Remove sensitive data from extra_data before storing in history
-            for sensitive_val in SENSITIVE_EXTRA_DATA_KEYS:
-                if sensitive_val in prompt[3]:
-                    prompt[3].pop(sensitive_val)
-
-            self.history[prompt[1]] = {
-                "prompt": prompt,
-                "outputs": {},
-                'status': status_dict,
-            }
-            self.history[prompt[1]].update(history_result)
+            prompt = self.currently_running[item_id]
+
+        # Remove sensitive data from extra_data before storing in history
+        extra_data = {k: v for k, v in prompt[3].items() if k not in SENSITIVE_EXTRA_DATA_KEYS}
+        entry = {
+            "prompt": [prompt[0], prompt[1], prompt[2], extra_data, prompt[4]],
+            "outputs": {},
+            'status': status._asdict() if status is not None else None,
+        }
+        entry.update(history_result)
+        # The history keeps a serialized snapshot, polling it never copies or re-encodes the prompt
+        try:
+            data = json.dumps(entry).encode("utf-8")
+        except (TypeError, ValueError) as e:
+            logging.warning(f"History entry of prompt {prompt[1]} is not JSON serializable ({e}), storing unsupported values as strings")
+            data = json.dumps(entry, default=str).encode("utf-8")
+
+        with self.mutex:
+            self.currently_running.pop(item_id)
+            attachment_store.release(prompt[1])
+            self.delete_history_item(prompt[1])
+            self.history[prompt[1]] = data
+            self.history_bytes += len(data)
+            while len(self.history) > 1 and (len(self.history) > MAXIMUM_HISTORY_SIZE or self.history_bytes > self.max_history_bytes):
+                self.history_bytes -= len(self.history.pop(next(iter(self.history))))
             self.server.queue_updated()
 
-    # Note: slow
     def get_current_queue(self):
         with self.mutex:
             out = []
             for x in self.currently_running.values():
                 out += [x]
-            return (out, copy.deepcopy(self.queue))
+            return (out, copy.copy(self.queue))
 
     # read-safe as long as queue items are immutable
     def get_current_queue_volatile(self):
@@ -1154,6 +1325,8 @@ class PromptQueue:
 
     def wipe_queue(self):
         with self.mutex:
+            for item in self.queue:
+                attachment_store.release(item[1])
             self.queue = []
             self.server.queue_updated()
 
@@ -1164,54 +1337,78 @@ class PromptQueue:
                     if len(self.queue) == 1:
                         self.wipe_queue()
                     else:
-                        self.queue.pop(x)
+                        attachment_store.release(self.queue.pop(x)[1])
                         heapq.heapify(self.queue)
                     self.server.queue_updated()
                     return True
         return False
 
+    def _history_items(self, prompt_id=None, max_items=None, offset=-1):
+        if prompt_id is not None:
+            return [(prompt_id, self.history[prompt_id])] if prompt_id in self.history else []
+        if offset < 0 and max_items is not None:
+            offset = len(self.history) - max_items
+        items = list(self.history.items())[max(offset, 0):]
+        if max_items is not None:
+            items = items[:max_items]
+        return items
+
     def get_history(self, prompt_id=None, max_items=None, offset=-1, map_function=None):
+        """
+        Decoded history entries, keyed by prompt id.
+
+        Every call decodes the selected entries from their stored JSON, so the returned values
+        are fresh copies the caller may modify, and the cost grows with the number of entries
+        requested. Callers that only forward the history (such as the /history routes) should
+        use get_history_json() instead.
+        """
         with self.mutex:
-            if prompt_id is None:
-                out = {}
-                i = 0
-                if offset < 0 and max_items is not None:
-                    offset = len(self.history) - max_items
-                for k in self.history:
-                    if i >= offset:
-                        p = self.history[k]
-                        if map_function is not None:
-                            p = map_function(p)
-                        out[k] = p
-                        if max_items is not None and len(out) >= max_items:
-                            break
-                    i += 1
-                return out
-            elif prompt_id in self.history:
-                p = self.history[prompt_id]
-                if map_function is None:
-                    p = copy.deepcopy(p)
-                else:
-                    p = map_function(p)
-                return {prompt_id: p}
-            else:
-                return {}
+            items = self._history_items(prompt_id, max_items, offset)
+        out = {}
+        for k, data in items:
+            p = json.loads(data)
+            if map_function is not None:
+                p = map_function(p)
+            out[k] = p
+        return out
+
+    def get_history_json(self, prompt_id=None, max_items=None, offset=-1) -> bytes:
+        """Same as get_history() but already serialized, built from the stored snapshots"""
+        with self.mutex:
+            items = self._history_items(prompt_id, max_items, offset)
+        return b"{" + b", ".join(json.dumps(k).encode("utf-8") + b": " + data for k, data in items) + b"}"
 
     def wipe_history(self):
         with self.mutex:
             self.history = {}
+            self.history_bytes = 0
 
     def delete_history_item(self, id_to_delete):
         with self.mutex:
-            self.history.pop(id_to_delete, None)
+            data = self.history.pop(id_to_delete, None)
+            if data is not None:
+                self.history_bytes -= len(data)
+
+    def register_worker(self, worker_id):
+        # Each prompt worker gets its own copy of the flags, so every worker frees its own cache
+        with self.mutex:
+            self.worker_flags[worker_id] = {}
 
     def set_flag(self, name, data):
         with self.mutex:
             self.flags[name] = data
-            self.not_empty.notify()
+            for flags in self.worker_flags.values():
+                flags[name] = data
+            self.not_empty.notify_all()
 
-    def get_flags(self, reset=True):
+    def get_flags(self, reset=True, worker_id=None):
         with self.mutex:
+            if worker_id is not None:
+                ret = self.worker_flags[worker_id]
+                if reset:
+                    self.worker_flags[worker_id] = {}
+                    return ret
+                return ret.copy()
             if reset:
                 ret = self.flags
                 self.flags = {}
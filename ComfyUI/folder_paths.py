@@ -2,9 +2,12 @@ from __future__ import annotations
 
 import os
 import time
+import threading
+import contextlib
+import contextvars
 import mimetypes
 import logging
-from typing import Literal, List
+from typing import Iterable, Literal, List
 from collections.abc import Collection
 
 from comfy.cli_args import args
@@ -356,18 +359,142 @@ def get_filename_list(folder_name: str) -> list[str]:
         global filename_list_cache
         filename_list_cache[folder_name] = out
     cache_helper.set(folder_name, out)
+    dependencies = _listing_dependencies.get()
+    if dependencies is not None:
+        dependencies.setdefault(("filename_list", folder_name), out[2])
     return list(out[0])
 
-def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, image_height=0) -> tuple[str, str, int, str, str]:
-    def map_filename(filename: str) -> tuple[int, str]:
-        prefix_len = len(os.path.basename(filename_prefix))
-        prefix = filename[:prefix_len + 1]
-        try:
-            digits = int(filename[prefix_len + 1:].split('_')[0])
-        except:
-            digits = 0
-        return digits, prefix
+_listing_dependencies: contextvars.ContextVar[dict | None] = contextvars.ContextVar("listing_dependencies", default=None)
 
+# Seconds before a recording that found no dependencies is out of date. Its code may read
+# something that isn't tracked (a config file, a registry), so it can't be kept forever.
+UNTRACKED_DEPENDENCY_TTL = 10.0
+
+def record_directory_dependency(path: str):
+    """Mark the active record_listing_dependencies() block, if any, as depending on the contents of the directory path"""
+    dependencies = _listing_dependencies.get()
+    if dependencies is not None:
+        key = ("directory", os.path.abspath(path))
+        if key not in dependencies:
+            dependencies[key] = listing_dependency_stamp(key)
+
+@contextlib.contextmanager
+def record_listing_dependencies():
+    """
+    Record the model lists (get_filename_list) and directories (record_directory_dependency) read
+    inside the block, e.g. by INPUT_TYPES.
+    Yields a dict of dependency -> stamp, it is out of date once listing_dependency_stamp() differs.
+    """
+    dependencies = {}
+    token = _listing_dependencies.set(dependencies)
+    try:
+        yield dependencies
+    finally:
+        _listing_dependencies.reset(token)
+        if len(dependencies) == 0:
+            dependencies[("expires", time.monotonic() + UNTRACKED_DEPENDENCY_TTL)] = True
+
+def listing_dependency_stamp(dependency: tuple):
+    """Current stamp of a dependency recorded by record_listing_dependencies()"""
+    kind, name = dependency
+    if kind == "filename_list":
+        out = cached_filename_list_(name)
+        return out[2] if out is not None else None
+    if kind == "expires":
+        return time.monotonic() < name
+    try:
+        return os.stat(name).st_mtime_ns
+    except OSError:
+        return None
+
+def parse_save_counter(name: str, prefix: str) -> int | None:
+    """Counter of a "<prefix>_<counter>_..." file name, or None if it belongs to another prefix. prefix must be normcased."""
+    head = name[:len(prefix) + 1]
+    if head[-1:] != "_" or os.path.normcase(head[:-1]) != prefix:
+        return None
+    try:
+        return int(name[len(prefix) + 1:].split('_')[0])
+    except ValueError:
+        return 0
+
+class SaveCounterIndex:
+    """
+    Next free filename counter per (folder, filename prefix), so a save doesn't have to list and
+    parse a folder that may hold tens of thousands of outputs.
+    Savers report the files they wrote with record_saved, which also takes the folder mtime their
+    writes produced as known. A folder is listed again only when its mtime changes some other way,
+    and then only names that weren't there before are parsed. Counters are reserved when handed out,
+    so concurrent saves never share one. Counters don't go back down when files are deleted while
+    the process runs, and a change by another process that lands while a save is being written is
+    only picked up at the next outside change.
+    """
+    # Directory mtimes this recent can still change without the value changing (coarse timestamps)
+    RACY_MTIME_NS = 2 * 1000 * 1000 * 1000
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.folders: dict[str, dict] = {}
+
+    def _add_names(self, state: dict, new_names: set[str]):
+        for known_prefix, next_counter in state["counters"].items():
+            for name in new_names:
+                c = parse_save_counter(name, known_prefix)
+                if c is not None and c >= next_counter:
+                    next_counter = c + 1
+            state["counters"][known_prefix] = next_counter
+        state["names"] |= new_names
+
+    def reserve(self, folder: str, prefix: str, count: int = 1) -> int:
+        """Reserve count consecutive counters for prefix in folder and return the first. Raises FileNotFoundError if folder doesn't exist."""
+        folder_key = os.path.normcase(os.path.abspath(folder))
+        prefix = os.path.normcase(prefix)
+        with self.lock:
+            mtime_ns = os.stat(folder).st_mtime_ns
+            state = self.folders.get(folder_key)
+            if state is None or state["mtime_ns"] is None or state["mtime_ns"] != mtime_ns:
+                names = set(os.listdir(folder))
+                if state is None:
+                    state = {"names": set(), "counters": {}}
+                    self.folders[folder_key] = state
+                self._add_names(state, names - state["names"])
+                state["names"] = names
+                racy = time.time_ns() - mtime_ns < self.RACY_MTIME_NS
+                state["mtime_ns"] = None if racy else mtime_ns
+
+            counters = state["counters"]
+            if prefix not in counters:
+                next_counter = 1
+                for name in state["names"]:
+                    c = parse_save_counter(name, prefix)
+                    if c is not None and c >= next_counter:
+                        next_counter = c + 1
+                counters[prefix] = next_counter
+
+            counter = counters[prefix]
+            counters[prefix] = counter + max(1, count)
+            return counter
+
+    def record_saved(self, folder: str, names: Iterable[str]):
+        """Add the files a save just wrote to folder, so the mtime change they made doesn't cause a listing"""
+        folder_key = os.path.normcase(os.path.abspath(folder))
+        with self.lock:
+            state = self.folders.get(folder_key)
+            if state is None:
+                return
+            self._add_names(state, set(names) - state["names"])
+            try:
+                state["mtime_ns"] = os.stat(folder).st_mtime_ns
+            except OSError:
+                state["mtime_ns"] = None
+
+    def clear(self):
+        with self.lock:
+            self.folders.clear()
+
+save_counter_index = SaveCounterIndex()
+
+def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, image_height=0, batch_size=1) -> tuple[str, str, int, str, str]:
+    """batch_size is the number of consecutive counters the caller will use, they are reserved for it."""
     def compute_vars(input: str, image_width: int, image_height: int) -> str:
         input = input.replace("%width%", str(image_width))
         input = input.replace("%height%", str(image_height))
@@ -397,12 +524,10 @@ def get_save_image_path(filename_prefix: str, output_dir: str, image_width=0, im
         raise Exception(err)
 
     try:
-        counter = max(filter(lambda a: os.path.normcase(a[1][:-1]) == os.path.normcase(filename) and a[1][-1] == "_", map(map_filename, os.listdir(full_output_folder))))[0] + 1
-    except ValueError:
-        counter = 1
+        counter = save_counter_index.reserve(full_output_folder, filename, batch_size)
     except FileNotFoundError:
         os.makedirs(full_output_folder, exist_ok=True)
-        counter = 1
+        counter = save_counter_index.reserve(full_output_folder, filename, batch_size)
     return full_output_folder, filename, counter, subfolder, filename_prefix
 
 def get_input_subfolders() -> list[str]:
@@ -12,7 +12,8 @@ import utils.extra_config
 import logging
 import sys
 from comfy_execution.progress import get_progress_state
-from comfy_execution.utils import get_executing_context
+from comfy_execution.utils import get_executing_context, get_worker_context, current_worker_context, configured_worker_contexts
+from comfy_execution.scheduling import get_process_lock
 from comfy_api import feature_flags
 
 if __name__ == "__main__":
@@ -167,15 +168,56 @@ def cuda_malloc_warning():
             logging.warning("\nWARNING: this card most likely does not support cuda-malloc, if you get \"CUDA error\" please run ComfyUI with: --disable-cuda-malloc\n")
 
 
-def prompt_worker(q, server_instance):
+class PromptWorkerServer:
+    """
+    Per-worker view of the PromptServer. The ids of the prompt a worker is running are kept
+    here so concurrent workers report to the right client, everything else is the shared server.
+    """
+    WORKER_ATTRIBUTES = ("client_id", "last_node_id", "last_prompt_id")
+
+    def __init__(self, server_instance):
+        self.__dict__["server"] = server_instance
+        for name in self.WORKER_ATTRIBUTES:
+            self.__dict__[name] = None
+        # Lets a reconnecting client get the node its prompt is on
+        server_instance.prompt_worker_servers.append(self)
+
+    def __getattr__(self, name):
+        return getattr(self.server, name)
+
+    def __setattr__(self, name, value):
+        if name in self.WORKER_ATTRIBUTES:
+            self.__dict__[name] = value
+        else:
+            setattr(self.server, name, value)
+
+
+def get_prompt_workers(server_instance):
+    if args.prompt_workers <= 1:
+        return [None]
+    workers = []
+    for worker in configured_worker_contexts(args):
+        workers.append(worker._replace(server=PromptWorkerServer(server_instance)))
+        logging.info(f"Prompt worker {worker.worker_id}: device {worker.device or 'default'}, {worker.threads} CPU threads")
+    return workers
+
+
+def prompt_worker(q, server_instance, worker=None):
     current_time: float = 0.0
+    worker_id = None
+    if worker is not None:
+        current_worker_context.set(worker)
+        server_instance = worker.server
+        worker_id = worker.worker_id
+        q.register_worker(worker_id)
+
     cache_type = execution.CacheType.CLASSIC
     if args.cache_lru > 0:
         cache_type = execution.CacheType.LRU
     elif args.cache_none:
         cache_type = execution.CacheType.DEPENDENCY_AWARE
 
-    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_size=args.cache_lru)
+    e = execution.PromptExecutor(server_instance, cache_type=cache_type, cache_size=args.cache_lru, parallel_branches=args.parallel_branches)
     last_gc_collect = 0
     need_gc = False
     gc_collect_interval = 10.0
@@ -213,16 +255,19 @@ def prompt_worker(q, server_instance):
             else:
                 logging.info("Prompt executed in {:.2f} seconds".format(execution_time))
 
-        flags = q.get_flags()
+        flags = q.get_flags(worker_id=worker_id)
         free_memory = flags.get("free_memory", False)
 
+        # Models and patched functions are shared with the other prompt workers
         if flags.get("unload_models", free_memory):
-            comfy.model_management.unload_all_models()
+            with get_process_lock("gpu"):
+                comfy.model_management.unload_all_models()
             need_gc = True
             last_gc_collect = 0
 
         if free_memory:
-            e.reset()
+            with get_process_lock("gpu"):
+                e.reset()
             need_gc = True
             last_gc_collect = 0
 
@@ -230,10 +275,11 @@ def prompt_worker(q, server_instance):
             current_time = time.perf_counter()
             if (current_time - last_gc_collect) > gc_collect_interval:
                 gc.collect()
-                comfy.model_management.soft_empty_cache()
+                with get_process_lock("gpu"):
+                    comfy.model_management.soft_empty_cache()
+                    hook_breaker_ac10a0.restore_functions()
                 last_gc_collect = current_time
                 need_gc = False
-                hook_breaker_ac10a0.restore_functions()
 
 
 async def run(server_instance, address='', port=8188, verbose=True, call_on_start=None):
@@ -245,7 +291,10 @@ async def run(server_instance, address='', port=8188, verbose=True, call_on_star
     )
 
 def hijack_progress(server_instance):
+    default_server = server_instance
     def hook(value, total, preview_image, prompt_id=None, node_id=None):
+        worker = get_worker_context()
+        server_instance = worker.server if worker is not None else default_server
         executing_context = get_executing_context()
         if prompt_id is None and executing_context is not None:
             prompt_id = executing_context.prompt_id
@@ -327,7 +376,8 @@ def start_comfyui(asyncio_loop=None):
     prompt_server.add_routes()
     hijack_progress(prompt_server)
 
-    threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server,)).start()
+    for worker in get_prompt_workers(prompt_server):
+        threading.Thread(target=prompt_worker, daemon=True, args=(prompt_server.prompt_queue, prompt_server, worker)).start()
 
     if args.quick_test_for_ci:
         exit(0)
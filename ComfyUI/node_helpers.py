@@ -1,9 +1,16 @@
 import hashlib
+import io
+import os
+import threading
 import torch
+from collections import OrderedDict
+from typing import Iterable, Optional
 
 from comfy.cli_args import args
+from comfy_execution.attachments import attachment_name, attachment_store, is_attachment
+import folder_paths
 
-from PIL import ImageFile, UnidentifiedImageError
+from PIL import Image, ImageFile, UnidentifiedImageError
 
 def conditioning_set_values(conditioning, values={}, append=False):
     c = []
@@ -43,6 +50,118 @@ def hasher():
     }
     return hashfuncs[args.default_hashing_function]
 
+FILE_DIGEST_CHUNK_SIZE = 1024 * 1024
+
+
+def _stat_key(path: str) -> Optional[tuple]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class FileDigestCache:
+    """
+    Memoizes file content digests keyed by (path, size, mtime_ns, inode), so unchanged
+    files cost a stat instead of a full read and hash.
+    """
+    def __init__(self, max_entries: int = 8192):
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[tuple[str, str], tuple[tuple, str]] = OrderedDict()
+
+    def digest(self, path: str, algorithm: str = "sha256") -> str:
+        """Hex digest of the file's contents"""
+        path = os.path.abspath(path)
+        stamp = _stat_key(path)
+        key = (path, algorithm)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and stamp is not None and entry[0] == stamp:
+                self.entries.move_to_end(key)
+                return entry[1]
+
+        hasher = hashlib.new(algorithm)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(FILE_DIGEST_CHUNK_SIZE), b""):
+                hasher.update(chunk)
+        hexdigest = hasher.hexdigest()
+
+        # Only remember the digest if the file didn't change while it was read
+        if stamp is not None and _stat_key(path) == stamp:
+            self._store(key, stamp, hexdigest)
+        return hexdigest
+
+    def record(self, path: str, digests: dict[str, str]):
+        """Remember digests computed while the file was written (e.g. an upload streamed to disk)"""
+        path = os.path.abspath(path)
+        stamp = _stat_key(path)
+        self.invalidate(path)
+        if stamp is None:
+            return
+        for algorithm, hexdigest in digests.items():
+            self._store((path, algorithm), stamp, hexdigest)
+
+    def invalidate(self, path: str):
+        path = os.path.abspath(path)
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == path]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def _store(self, key, stamp, hexdigest):
+        with self.lock:
+            self.entries[key] = (stamp, hexdigest)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def hash_stream(stream, algorithms: Iterable[str], out=None) -> dict[str, str]:
+    """
+    Hash a binary stream with each algorithm in one pass, optionally copying it to out.
+    Reads from the current position and leaves the stream at its end.
+    """
+    hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+    for chunk in iter(lambda: stream.read(FILE_DIGEST_CHUNK_SIZE), b""):
+        for hasher in hashers.values():
+            hasher.update(chunk)
+        if out is not None:
+            out.write(chunk)
+    return {algorithm: hasher.hexdigest() for algorithm, hasher in hashers.items()}
+
+
+# Shared by the loader nodes (IS_CHANGED) and the upload routes
+file_digests = FileDigestCache()
+
+
+def file_digest(path: str, algorithm: str = "sha256") -> str:
+    return file_digests.digest(path, algorithm)
+
+def open_input_image(name: str):
+    """Open an image input: a file from the input/output/temp folders or an attachment posted with the prompt"""
+    if is_attachment(name):
+        data = attachment_store.get(attachment_name(name))
+        if data is None:
+            raise FileNotFoundError(f"Attachment not found: {name}")
+        return pillow(lambda d: Image.open(io.BytesIO(d)), data)
+    return pillow(Image.open, folder_paths.get_annotated_filepath(name))
+
+def input_image_digest(name: str) -> str:
+    """sha256 of an image input's contents, the same for a file and an attachment with the same bytes"""
+    if is_attachment(name):
+        return attachment_store.digest(attachment_name(name))
+    return file_digest(folder_paths.get_annotated_filepath(name), "sha256")
+
+def input_image_exists(name: str) -> bool:
+    if is_attachment(name):
+        return attachment_name(name) in attachment_store
+    return folder_paths.exists_annotated_filepath(name)
+
 def string_to_torch_dtype(string):
     if string == "fp32":
         return torch.float32
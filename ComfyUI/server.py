@@ -14,7 +14,7 @@ import struct
 import ssl
 import socket
 import ipaddress
-from PIL import Image, ImageOps
+from PIL import Image
 from PIL.PngImagePlugin import PngInfo
 from io import BytesIO
 
@@ -30,7 +30,11 @@ from comfy_api import feature_flags
 import node_helpers
 from comfyui_version import __version__
 from app.frontend_management import FrontendManager
+from app.node_info_cache import NodeInfoCache
+from app.preview_sender import PreviewSender, encode_preview_image, encode_preview_image_with_metadata
 from comfy_api.internal import _ComfyNodeInternal
+from comfy_execution.utils import get_worker_context
+from comfy_execution.attachments import ATTACHMENT_SUFFIX, AttachmentStoreFull, attachment_name, attachment_store, is_attachment, pin_prompt_attachments
 
 from app.user_manager import UserManager
 from app.model_manager import ModelFileManager
@@ -140,7 +144,35 @@ def create_origin_only_middleware():
 
     return origin_only_middleware
 
+class WorkerLocal:
+    """
+    PromptServer attribute that is kept per prompt worker. Code running on a worker reads and
+    writes that worker's value (see main.PromptWorkerServer), everything else the server's own.
+    """
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.shared_name = "_shared_" + name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        worker = get_worker_context()
+        if worker is not None and worker.server is not instance:
+            return getattr(worker.server, self.name)
+        return instance.__dict__.get(self.shared_name)
+
+    def __set__(self, instance, value):
+        worker = get_worker_context()
+        if worker is not None and worker.server is not instance:
+            setattr(worker.server, self.name, value)
+        else:
+            instance.__dict__[self.shared_name] = value
+
+
 class PromptServer():
+    client_id = WorkerLocal()
+    last_node_id = WorkerLocal()
+
     def __init__(self, loop):
         PromptServer.instance = self
 
@@ -156,6 +188,7 @@ class PromptServer():
         self.prompt_queue = execution.PromptQueue(self)
         self.loop = loop
         self.messages = asyncio.Queue()
+        self.preview_sender = PreviewSender(self.send_bytes)
         self.client_session:Optional[aiohttp.ClientSession] = None
         self.number = 0
 
@@ -182,6 +215,7 @@ class PromptServer():
         self.routes = routes
         self.last_node_id = None
         self.client_id = None
+        self.prompt_worker_servers = []
 
         self.on_prompt_handlers = []
 
@@ -205,8 +239,9 @@ class PromptServer():
                 # Send initial state to the new client
                 await self.send("status", {"status": self.get_queue_info(), "sid": sid}, sid)
                 # On reconnect if we are the currently executing client send the current node
-                if self.client_id == sid and self.last_node_id is not None:
-                    await self.send("executing", { "node": self.last_node_id }, sid)
+                for view in [self] + self.prompt_worker_servers:
+                    if view.client_id == sid and view.last_node_id is not None:
+                        await self.send("executing", { "node": view.last_node_id }, sid)
 
                 # Flag to track if we've received the first message
                 first_message = True
@@ -299,24 +334,26 @@ class PromptServer():
 
             return type_dir, dir_type
 
-        def compare_image_hash(filepath, image):
-            hasher = node_helpers.hasher()
+        def upload_digest_algorithms():
+            # The duplicate check uses the configured hash, the loader nodes' IS_CHANGED uses sha256
+            return sorted({args.default_hashing_function, "sha256"})
 
+        def compare_image_hash(filepath, image, image_digests=None):
             # function to compare hashes of two images to see if it already exists, fix to #3465
+            # The existing file's digest is memoized by stat, the upload is hashed once per request
             if os.path.exists(filepath):
-                a = hasher()
-                b = hasher()
-                with open(filepath, "rb") as f:
-                    a.update(f.read())
-                    b.update(image.file.read())
+                algorithm = args.default_hashing_function
+                if image_digests is None:
+                    image_digests = node_helpers.hash_stream(image.file, [algorithm])
                     image.file.seek(0)
-                return a.hexdigest() == b.hexdigest()
+                return node_helpers.file_digests.digest(filepath, algorithm) == image_digests[algorithm]
             return False
 
         def image_upload(post, image_save_function=None):
             image = post.get("image")
             overwrite = post.get("overwrite")
             image_is_duplicate = False
+            image_digests = None
 
             image_upload_type = post.get("type")
             upload_dir, image_upload_type = get_dir_by_type(image_upload_type)
@@ -343,7 +380,10 @@ class PromptServer():
                 else:
                     i = 1
                     while os.path.exists(filepath):
-                        if compare_image_hash(filepath, image): #compare hash to prevent saving of duplicates with same name, fix for #3465
+                        if image_digests is None:
+                            image_digests = node_helpers.hash_stream(image.file, upload_digest_algorithms())
+                            image.file.seek(0)
+                        if compare_image_hash(filepath, image, image_digests): #compare hash to prevent saving of duplicates with same name, fix for #3465
                             image_is_duplicate = True
                             break
                         filename = f"{split[0]} ({i}){split[1]}"
@@ -353,9 +393,12 @@ class PromptServer():
                 if not image_is_duplicate:
                     if image_save_function is not None:
                         image_save_function(image, post, filepath)
+                        node_helpers.file_digests.invalidate(filepath)
                     else:
+                        # Digests are recorded while the upload streams to disk, so loading it costs a stat
                         with open(filepath, "wb") as f:
-                            f.write(image.file.read())
+                            digests = node_helpers.hash_stream(image.file, upload_digest_algorithms(), out=f)
+                        node_helpers.file_digests.record(filepath, digests)
 
                 return web.json_response({"name" : filename, "subfolder": subfolder, "type": image_upload_type})
             else:
@@ -595,7 +638,7 @@ class PromptServer():
                 return obj_class.GET_NODE_INFO_V1()
             info = {}
             info['input'] = obj_class.INPUT_TYPES()
-            info['input_order'] = {key: list(value.keys()) for (key, value) in obj_class.INPUT_TYPES().items()}
+            info['input_order'] = {key: list(value.keys()) for (key, value) in info['input'].items()}
             info['output'] = obj_class.RETURN_TYPES
             info['output_is_list'] = obj_class.OUTPUT_IS_LIST if hasattr(obj_class, 'OUTPUT_IS_LIST') else [False] * len(obj_class.RETURN_TYPES)
             info['output_name'] = obj_class.RETURN_NAMES if hasattr(obj_class, 'RETURN_NAMES') else info['output']
@@ -624,25 +667,29 @@ class PromptServer():
                 info['api_node'] = obj_class.API_NODE
             return info
 
+        self.node_info_cache = NodeInfoCache(node_info)
+
         @routes.get("/object_info")
         async def get_object_info(request):
             with folder_paths.cache_helper:
-                out = {}
-                for x in nodes.NODE_CLASS_MAPPINGS:
-                    try:
-                        out[x] = node_info(x)
-                    except Exception:
-                        logging.error(f"[ERROR] An error occurred while retrieving information for the '{x}' node.")
-                        logging.error(traceback.format_exc())
-                return web.json_response(out)
+                body, etag = self.node_info_cache.get_catalog(list(nodes.NODE_CLASS_MAPPINGS))
+            # no-cache: browsers keep the catalog but revalidate it with If-None-Match
+            headers = {"ETag": etag, "Cache-Control": "no-cache"}
+            if request.headers.get("If-None-Match") == etag:
+                return web.Response(status=304, headers=headers)
+            return web.Response(body=body, content_type="application/json", headers=headers)
 
         @routes.get("/object_info/{node_class}")
         async def get_object_info_node(request):
             node_class = request.match_info.get("node_class", None)
-            out = {}
+            data = None
             if (node_class is not None) and (node_class in nodes.NODE_CLASS_MAPPINGS):
-                out[node_class] = node_info(node_class)
-            return web.json_response(out)
+                with folder_paths.cache_helper:
+                    data = self.node_info_cache.get_node(node_class)
+            if data is None:
+                return web.json_response({})
+            body = b"{" + json.dumps(node_class).encode("utf-8") + b": " + data + b"}"
+            return web.Response(body=body, content_type="application/json")
 
         @routes.get("/history")
         async def get_history(request):
@@ -656,12 +703,12 @@ class PromptServer():
             else:
                 offset = -1
 
-            return web.json_response(self.prompt_queue.get_history(max_items=max_items, offset=offset))
+            return web.Response(body=self.prompt_queue.get_history_json(max_items=max_items, offset=offset), content_type="application/json")
 
         @routes.get("/history/{prompt_id}")
         async def get_history_prompt_id(request):
             prompt_id = request.match_info.get("prompt_id", None)
-            return web.json_response(self.prompt_queue.get_history(prompt_id=prompt_id))
+            return web.Response(body=self.prompt_queue.get_history_json(prompt_id=prompt_id), content_type="application/json")
 
         @routes.get("/queue")
         async def get_queue(request):
@@ -671,53 +718,124 @@ class PromptServer():
             queue_info['queue_pending'] = current_queue[1]
             return web.json_response(queue_info)
 
+        async def read_prompt_with_attachments(request):
+            # multipart/form-data: a "prompt" field with the usual JSON body, and image files that the
+            # prompt references as "<filename> [attachment]", kept in memory instead of the input dir
+            # request.multipart() isn't limited by client_max_size, so the parts are read against --max-upload-size
+            json_data = None
+            files = []
+            max_size = round(args.max_upload_size * 1024 * 1024)
+            remaining = max_size
+            reader = await request.multipart()
+            async for part in reader:
+                data = bytearray()
+                while chunk := await part.read_chunk():
+                    remaining -= len(chunk)
+                    if remaining < 0:
+                        raise web.HTTPRequestEntityTooLarge(max_size=max_size, actual_size=max_size - remaining)
+                    data.extend(chunk)
+                if part.filename:
+                    files.append((part.filename, bytes(data)))
+                elif part.name == "prompt":
+                    json_data = json.loads(data.decode(part.get_charset(default="utf-8")))
+            if json_data is None:
+                json_data = {}
+            prompt_id = str(json_data.get("prompt_id", uuid.uuid4()))
+            json_data["prompt_id"] = prompt_id
+
+            names = {}
+            try:
+                for filename, data in files:
+                    names[filename] = attachment_store.put(data, filename, prompt_id)
+            except AttachmentStoreFull:
+                attachment_store.release(prompt_id)
+                raise
+            for node in json_data.get("prompt", {}).values():
+                inputs = node.get("inputs", {}) if isinstance(node, dict) else {}
+                for key, value in inputs.items():
+                    if is_attachment(value) and attachment_name(value) in names:
+                        inputs[key] = names[attachment_name(value)] + ATTACHMENT_SUFFIX
+            return json_data
+
+        @routes.post("/upload/attachment")
+        async def upload_attachment(request):
+            # Raw image bytes in the body, for prompts posted separately. Not pinned to a prompt
+            # until one references it, so it may be evicted when the store is full.
+            filename = request.rel_url.query.get("filename", "")
+            try:
+                name = attachment_store.put(await request.read(), filename)
+            except AttachmentStoreFull as e:
+                return web.json_response({"error": str(e)}, status=413)
+            return web.json_response({"name": name + ATTACHMENT_SUFFIX})
+
         @routes.post("/prompt")
         async def post_prompt(request):
             logging.info("got prompt")
-            json_data =  await request.json()
-            json_data = self.trigger_on_prompt(json_data)
-
-            if "number" in json_data:
-                number = float(json_data['number'])
+            # Attachments stay pinned only for a prompt that gets queued
+            pinned_ids = set()
+            if request.content_type == "multipart/form-data":
+                try:
+                    json_data = await read_prompt_with_attachments(request)
+                    pinned_ids.add(json_data["prompt_id"])
+                except AttachmentStoreFull as e:
+                    error = {"type": "attachment_store_full", "message": str(e), "details": str(e), "extra_info": {}}
+                    return web.json_response({"error": error, "node_errors": {}}, status=413)
+                except web.HTTPRequestEntityTooLarge as e:
+                    error = {"type": "request_too_large", "message": "Request too large", "details": e.text, "extra_info": {}}
+                    return web.json_response({"error": error, "node_errors": {}}, status=413)
             else:
-                number = self.number
-                if "front" in json_data:
-                    if json_data['front']:
-                        number = -number
-
-                self.number += 1
-
-            if "prompt" in json_data:
-                prompt = json_data["prompt"]
-                prompt_id = str(json_data.get("prompt_id", uuid.uuid4()))
-
-                partial_execution_targets = None
-                if "partial_execution_targets" in json_data:
-                    partial_execution_targets = json_data["partial_execution_targets"]
-
-                valid = await execution.validate_prompt(prompt_id, prompt, partial_execution_targets)
-                extra_data = {}
-                if "extra_data" in json_data:
-                    extra_data = json_data["extra_data"]
-
-                if "client_id" in json_data:
-                    extra_data["client_id"] = json_data["client_id"]
-                if valid[0]:
-                    outputs_to_execute = valid[2]
-                    self.prompt_queue.put((number, prompt_id, prompt, extra_data, outputs_to_execute))
-                    response = {"prompt_id": prompt_id, "number": number, "node_errors": valid[3]}
-                    return web.json_response(response)
+                json_data =  await request.json()
+            try:
+                json_data = self.trigger_on_prompt(json_data)
+
+                if "number" in json_data:
+                    number = float(json_data['number'])
                 else:
-                    logging.warning("invalid prompt: {}".format(valid[1]))
-                    return web.json_response({"error": valid[1], "node_errors": valid[3]}, status=400)
-            else:
-                error = {
-                    "type": "no_prompt",
-                    "message": "No prompt provided",
-                    "details": "No prompt provided",
-                    "extra_info": {}
-                }
-                return web.json_response({"error": error, "node_errors": {}}, status=400)
+                    number = self.number
+                    if "front" in json_data:
+                        if json_data['front']:
+                            number = -number
+
+                    self.number += 1
+
+                if "prompt" in json_data:
+                    prompt = json_data["prompt"]
+                    prompt_id = str(json_data.get("prompt_id", uuid.uuid4()))
+
+                    partial_execution_targets = None
+                    if "partial_execution_targets" in json_data:
+                        partial_execution_targets = json_data["partial_execution_targets"]
+
+                    # Missing attachments are reported by the loader node's validation
+                    pinned_ids.add(prompt_id)
+                    pin_prompt_attachments(prompt, prompt_id)
+                    valid = await execution.validate_prompt(prompt_id, prompt, partial_execution_targets)
+                    extra_data = {}
+                    if "extra_data" in json_data:
+                        extra_data = json_data["extra_data"]
+
+                    if "client_id" in json_data:
+                        extra_data["client_id"] = json_data["client_id"]
+                    if valid[0]:
+                        outputs_to_execute = valid[2]
+                        self.prompt_queue.put((number, prompt_id, prompt, extra_data, outputs_to_execute))
+                        pinned_ids.discard(prompt_id)
+                        response = {"prompt_id": prompt_id, "number": number, "node_errors": valid[3]}
+                        return web.json_response(response)
+                    else:
+                        logging.warning("invalid prompt: {}".format(valid[1]))
+                        return web.json_response({"error": valid[1], "node_errors": valid[3]}, status=400)
+                else:
+                    error = {
+                        "type": "no_prompt",
+                        "message": "No prompt provided",
+                        "details": "No prompt provided",
+                        "extra_info": {}
+                    }
+                    return web.json_response({"error": error, "node_errors": {}}, status=400)
+            finally:
+                for pinned_id in pinned_ids:
+                    attachment_store.release(pinned_id)
 
         @routes.post("/queue")
         async def post_queue(request):
@@ -755,7 +873,7 @@ class PromptServer():
                         break
 
                 if should_interrupt:
-                    nodes.interrupt_processing()
+                    nodes.interrupt_processing(prompt_id=prompt_id)
                 else:
                     logging.info(f"Prompt {prompt_id} is not currently running, skipping interrupt")
             else:
@@ -842,15 +960,14 @@ class PromptServer():
         return prompt_info
 
     async def send(self, event, data, sid=None):
-        if event == BinaryEventTypes.UNENCODED_PREVIEW_IMAGE:
-            await self.send_image(data, sid=sid)
-        elif event == BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA:
-            # data is (preview_image, metadata)
-            preview_image, metadata = data
-            await self.send_image_with_metadata(preview_image, metadata, sid=sid)
+        if event == BinaryEventTypes.UNENCODED_PREVIEW_IMAGE or event == BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA:
+            # Encoded on the preview pool and sent when ready, superseded previews are dropped
+            self.preview_sender.submit(event, data, sid)
         elif isinstance(data, (bytes, bytearray)):
             await self.send_bytes(event, data, sid)
         else:
+            if event == "executing":
+                self.preview_sender.node_changed(sid)
             await self.send_json(event, data, sid)
 
     def encode_bytes(self, event, data):
@@ -863,64 +980,13 @@ class PromptServer():
         return message
 
     async def send_image(self, image_data, sid=None):
-        image_type = image_data[0]
-        image = image_data[1]
-        max_size = image_data[2]
-        if max_size is not None:
-            if hasattr(Image, 'Resampling'):
-                resampling = Image.Resampling.BILINEAR
-            else:
-                resampling = Image.Resampling.LANCZOS
-
-            image = ImageOps.contain(image, (max_size, max_size), resampling)
-        type_num = 1
-        if image_type == "JPEG":
-            type_num = 1
-        elif image_type == "PNG":
-            type_num = 2
-
-        bytesIO = BytesIO()
-        header = struct.pack(">I", type_num)
-        bytesIO.write(header)
-        image.save(bytesIO, format=image_type, quality=95, compress_level=1)
-        preview_bytes = bytesIO.getvalue()
+        loop = asyncio.get_running_loop()
+        preview_bytes = await loop.run_in_executor(self.preview_sender.pool, encode_preview_image, image_data)
         await self.send_bytes(BinaryEventTypes.PREVIEW_IMAGE, preview_bytes, sid=sid)
 
     async def send_image_with_metadata(self, image_data, metadata=None, sid=None):
-        image_type = image_data[0]
-        image = image_data[1]
-        max_size = image_data[2]
-        if max_size is not None:
-            if hasattr(Image, 'Resampling'):
-                resampling = Image.Resampling.BILINEAR
-            else:
-                resampling = Image.Resampling.LANCZOS
-
-            image = ImageOps.contain(image, (max_size, max_size), resampling)
-
-        mimetype = "image/png" if image_type == "PNG" else "image/jpeg"
-
-        # Prepare metadata
-        if metadata is None:
-            metadata = {}
-        metadata["image_type"] = mimetype
-
-        # Serialize metadata as JSON
-        import json
-        metadata_json = json.dumps(metadata).encode('utf-8')
-        metadata_length = len(metadata_json)
-
-        # Prepare image data
-        bytesIO = BytesIO()
-        image.save(bytesIO, format=image_type, quality=95, compress_level=1)
-        image_bytes = bytesIO.getvalue()
-
-        # Combine metadata and image
-        combined_data = bytearray()
-        combined_data.extend(struct.pack(">I", metadata_length))
-        combined_data.extend(metadata_json)
-        combined_data.extend(image_bytes)
-
+        loop = asyncio.get_running_loop()
+        combined_data = await loop.run_in_executor(self.preview_sender.pool, encode_preview_image_with_metadata, image_data, metadata)
         await self.send_bytes(BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, combined_data, sid=sid)
 
     async def send_bytes(self, event, data, sid=None):
@@ -0,0 +1,64 @@
+import json
+import os
+
+import folder_paths
+from app.node_info_cache import NodeInfoCache
+
+
+def listing_node_info(folder, calls):
+    def node_info(node_class):
+        calls.append(node_class)
+        if node_class == "Lister":
+            folder_paths.record_directory_dependency(folder)
+            return {"files": sorted(os.listdir(folder))}
+        if node_class == "Broken":
+            raise ValueError("broken node")
+        return {"name": node_class}
+    return node_info
+
+
+def set_mtime(folder, offset_s):
+    st = os.stat(folder)
+    os.utime(folder, ns=(st.st_atime_ns, st.st_mtime_ns + offset_s * 1000 * 1000 * 1000))
+
+
+def test_catalog_is_cached(tmp_path):
+    calls = []
+    cache = NodeInfoCache(listing_node_info(str(tmp_path), calls))
+    body, etag = cache.get_catalog(["Static", "Lister"])
+    assert json.loads(body) == {"Static": {"name": "Static"}, "Lister": {"files": []}}
+    assert cache.get_catalog(["Static", "Lister"]) == (body, etag)
+    assert calls == ["Static", "Lister"]
+
+
+def test_listed_directory_change_rebuilds_only_that_node(tmp_path):
+    calls = []
+    cache = NodeInfoCache(listing_node_info(str(tmp_path), calls))
+    _, etag = cache.get_catalog(["Static", "Lister"])
+    (tmp_path / "new.png").write_bytes(b"")
+    set_mtime(str(tmp_path), 5)
+    body, new_etag = cache.get_catalog(["Static", "Lister"])
+    assert json.loads(body)["Lister"] == {"files": ["new.png"]}
+    assert new_etag != etag
+    assert calls == ["Static", "Lister", "Lister"]
+
+
+def test_failing_node_is_skipped(tmp_path):
+    calls = []
+    cache = NodeInfoCache(listing_node_info(str(tmp_path), calls))
+    body, _ = cache.get_catalog(["Broken", "Static"])
+    assert json.loads(body) == {"Static": {"name": "Static"}}
+    cache.get_catalog(["Broken", "Static"])
+    assert calls.count("Broken") == 2
+
+
+def test_untracked_node_expires(tmp_path, monkeypatch):
+    calls = []
+    cache = NodeInfoCache(listing_node_info(str(tmp_path), calls))
+    cache.get_catalog(["Static", "Lister"])
+    monkeypatch.setattr(folder_paths, "UNTRACKED_DEPENDENCY_TTL", 0.0)
+    cache.invalidate("Static")
+    cache.get_catalog(["Static", "Lister"])
+    cache.get_catalog(["Static", "Lister"])
+    # Static reads nothing that is tracked, so it isn't trusted past the TTL
+    assert calls == ["Static", "Lister", "Static", "Static"]
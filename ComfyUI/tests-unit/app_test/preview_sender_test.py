@@ -0,0 +1,100 @@
+import asyncio
+import json
+import struct
+
+import pytest
+from PIL import Image
+
+from app.preview_sender import PreviewSender, encode_preview
+from protocol import BinaryEventTypes
+
+
+def preview(color, size=64):
+    return ("JPEG", Image.new("RGB", (size, size), color), None)
+
+
+def test_encode_preview_with_metadata():
+    event, payload = encode_preview(BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, (preview("red"), {"node_id": "3"}))
+    assert event == BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA
+    length = struct.unpack(">I", payload[:4])[0]
+    assert json.loads(payload[4:4 + length]) == {"node_id": "3", "image_type": "image/jpeg"}
+    assert payload[4 + length:4 + length + 2] == b"\xff\xd8"
+
+
+@pytest.mark.asyncio
+async def test_superseded_previews_are_dropped():
+    sent = []
+    release = asyncio.Event()
+
+    async def send_bytes(event, data, sid=None):
+        await release.wait()
+        sent.append((event, sid))
+
+    sender = PreviewSender(send_bytes)
+    for color in ["red", "green", "blue", "white"]:
+        sender.submit(BinaryEventTypes.UNENCODED_PREVIEW_IMAGE, preview(color), "client")
+    # The first is encoding, only the newest of the rest is still waiting
+    assert sender.clients["client"].dropped == 2
+    release.set()
+    while "client" in sender.clients:
+        await asyncio.sleep(0.01)
+    assert sent == [(BinaryEventTypes.PREVIEW_IMAGE, "client")] * 2
+
+
+@pytest.mark.asyncio
+async def test_byte_budget_keeps_newest():
+    sent = []
+    release = asyncio.Event()
+
+    async def send_bytes(event, data, sid=None):
+        await release.wait()
+        sent.append(len(data))
+
+    sender = PreviewSender(send_bytes, max_client_bytes=1)
+    for color in ["red", "green", "blue"]:
+        sender.submit(BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, (preview(color), {}), "client")
+        while sender.clients["client"].encoding:
+            await asyncio.sleep(0.01)
+    # One is being sent, the budget only leaves room for the newest encoded preview
+    assert len(sender.clients["client"].outbox) == 1
+    release.set()
+    while "client" in sender.clients:
+        await asyncio.sleep(0.01)
+    assert len(sent) == 2
+
+
+@pytest.mark.asyncio
+async def test_node_change_drops_stale_previews():
+    sent = []
+
+    async def send_bytes(event, data, sid=None):
+        sent.append(event)
+
+    sender = PreviewSender(send_bytes)
+    sender.submit(BinaryEventTypes.UNENCODED_PREVIEW_IMAGE, preview("red"), "client")
+    sender.submit(BinaryEventTypes.UNENCODED_PREVIEW_IMAGE, preview("green"), "client")
+    sender.node_changed("client")
+    while "client" in sender.clients:
+        await asyncio.sleep(0.01)
+    assert sent == []
+
+
+@pytest.mark.asyncio
+async def test_interleaved_nodes_keep_their_previews():
+    sent = []
+    release = asyncio.Event()
+
+    async def send_bytes(event, data, sid=None):
+        await release.wait()
+        length = struct.unpack(">I", data[:4])[0]
+        sent.append(json.loads(data[4:4 + length])["node_id"])
+
+    sender = PreviewSender(send_bytes)
+    for node_id, color in [("A", "red"), ("B", "red"), ("A", "green"), ("B", "green"), ("B", "blue")]:
+        sender.submit(BinaryEventTypes.PREVIEW_IMAGE_WITH_METADATA, (preview(color), {"node_id": node_id}), "client")
+    # Only B's own frames replaced each other, A's last one is still waiting
+    assert sender.clients["client"].dropped == 2
+    release.set()
+    while "client" in sender.clients:
+        await asyncio.sleep(0.01)
+    assert sorted(sent) == ["A", "A", "B"]
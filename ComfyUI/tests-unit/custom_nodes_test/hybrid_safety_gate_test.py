@@ -0,0 +1,35 @@
+import importlib.util
+import json
+import os
+
+import pytest
+
+MODULE_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "custom_nodes", "ComfyUI_LocalJSONExtractor", "nudenet_safety_checker.py")
+
+
+@pytest.fixture(scope="module")
+def gate():
+    spec = importlib.util.spec_from_file_location("nudenet_safety_checker", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.HybridSafetyGate()
+
+
+def nudenet_json(score, is_nsfw=False):
+    return json.dumps({"is_nsfw": is_nsfw, "max_score": score, "raw_max_score": score, "threshold": 0.6})
+
+
+def test_confidently_clean_image_skips_llm_by_default(gate):
+    assert gate.check_lazy_status(None, nudenet_json(0.05)) == []
+
+
+def test_uncertain_image_gets_llm_check(gate):
+    assert gate.check_lazy_status(None, nudenet_json(0.4)) == ["multidomain_json"]
+
+
+def test_blocked_image_skips_llm(gate):
+    assert gate.check_lazy_status(None, nudenet_json(0.9, is_nsfw=True)) == []
+
+
+def test_when_not_blocked_checks_clean_images(gate):
+    assert gate.check_lazy_status(None, nudenet_json(0.05), llm_check="when_not_blocked") == ["multidomain_json"]
@@ -0,0 +1,25 @@
+import importlib.util
+import os
+
+import pytest
+import torch
+
+MODULE_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "custom_nodes", "ComfyUI_BEN2_ONNX", "mask_cache.py")
+
+
+@pytest.fixture
+def mask_cache(monkeypatch):
+    monkeypatch.setenv("REMBG_MASK_CACHE_DIR", "")
+    spec = importlib.util.spec_from_file_location("mask_cache", MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_miss_returns_the_mask_a_hit_will(mask_cache):
+    mask = torch.rand(32, 48)
+    stored = mask_cache.put("key", mask)
+    assert stored.dtype == torch.float32
+    assert torch.equal(stored, mask_cache.get("key"))
+    assert (stored - mask).abs().max() <= 0.5 / 255 + 1e-6
+
@@ -0,0 +1,36 @@
+import hashlib
+
+import pytest
+
+from comfy_execution.attachments import AttachmentStore, AttachmentStoreFull, attachment_name, is_attachment
+
+
+def test_content_addressed_names():
+    store = AttachmentStore(1024)
+    name = store.put(b"pixels", "Photo.PNG")
+    assert name == hashlib.sha256(b"pixels").hexdigest() + ".png"
+    assert store.put(b"pixels", "other.png") == name
+    assert store.get(name) == b"pixels"
+    assert store.digest(name) == hashlib.sha256(b"pixels").hexdigest()
+    assert is_attachment(name + " [attachment]")
+    assert attachment_name(name + " [attachment]") == name
+    assert not is_attachment(name)
+
+
+def test_unpinned_evicted_first():
+    store = AttachmentStore(10)
+    pinned = store.put(b"aaaa", "a.png", prompt_id="p1")
+    old = store.put(b"bbbb", "b.png")
+    new = store.put(b"cccc", "c.png")
+    assert pinned in store and new in store
+    assert old not in store
+
+
+def test_full_when_pinned():
+    store = AttachmentStore(8)
+    store.put(b"aaaa", "a.png", prompt_id="p1")
+    store.put(b"bbbb", "b.png", prompt_id="p2")
+    with pytest.raises(AttachmentStoreFull):
+        store.put(b"cccc", "c.png")
+    store.release("p1")
+    store.put(b"cccc", "c.png")
@@ -0,0 +1,19 @@
+import threading
+
+from comfy_execution.progress import get_progress_state, reset_progress_state
+
+
+def test_progress_state_per_worker():
+    # Prompt workers run on their own threads, each must see the registry of its own prompt
+    seen = {}
+    started = threading.Barrier(2)
+    def worker(prompt_id):
+        reset_progress_state(prompt_id, None)
+        started.wait()
+        seen[prompt_id] = get_progress_state().prompt_id
+    threads = [threading.Thread(target=worker, args=(p,)) for p in ("a", "b")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert seen == {"a": "a", "b": "b"}
@@ -0,0 +1,76 @@
+import asyncio
+import threading
+
+import pytest
+
+from comfy_execution.graph_utils import GraphBuilder
+from comfy_execution.scheduling import DEFAULT_NODE_RESOURCES, ResourceScheduler, get_node_resources, get_process_lock, hold_process_resources
+
+
+class UntaggedNode:
+    pass
+
+class CpuNode:
+    RESOURCES = ("CPU",)
+
+class FreeNode:
+    RESOURCES = ()
+
+class LlmNode:
+    RESOURCES = "llm"
+
+
+def test_node_resources():
+    assert get_node_resources(UntaggedNode) == DEFAULT_NODE_RESOURCES
+    assert get_node_resources(CpuNode) == frozenset(["cpu"])
+    assert get_node_resources(FreeNode) == frozenset()
+    assert get_node_resources(LlmNode) == frozenset(["llm"])
+
+
+def test_shared_tag_is_serialized():
+    resources = {"a": frozenset(["gpu"]), "b": frozenset(["gpu"]), "c": frozenset(["cpu"])}
+    scheduler = ResourceScheduler(4)
+    assert scheduler.pick(["a", "b", "c"], resources.get) == ["a", "c"]
+    assert scheduler.pick(["b"], resources.get) == []
+    scheduler.release("a")
+    assert scheduler.pick(["b"], resources.get) == ["b"]
+
+
+def test_max_workers():
+    scheduler = ResourceScheduler(2)
+    assert scheduler.pick(["a", "b", "c"], lambda _: frozenset()) == ["a", "b"]
+    scheduler.release("b")
+    assert scheduler.pick(["a", "c"], lambda _: frozenset()) == ["c"]
+
+
+def test_capacity():
+    scheduler = ResourceScheduler(4, capacities={"cpu": 2})
+    assert scheduler.pick(["a", "b", "c"], lambda _: frozenset(["cpu"])) == ["a", "b"]
+
+
+def test_graph_prefix_per_thread():
+    GraphBuilder.set_default_prefix("main", 0)
+    prefixes = []
+    def worker():
+        GraphBuilder.set_default_prefix("worker", 1)
+        prefixes.append(GraphBuilder.alloc_prefix())
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    assert prefixes == ["worker.1.0."]
+    assert GraphBuilder.alloc_prefix() == "main.0.0."
+
+
+@pytest.mark.asyncio
+async def test_cancelled_wait_does_not_keep_lock():
+    lock = get_process_lock("llm")
+    lock.acquire()
+    waiting = asyncio.ensure_future(hold_process_resources(["llm"]).__aenter__())
+    await asyncio.sleep(0.05)
+    waiting.cancel()
+    lock.release()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    await asyncio.sleep(0.3)
+    assert lock.acquire(blocking=False)
+    lock.release()
@@ -0,0 +1,62 @@
+import os
+import time
+
+from comfy_execution.validation import ValidationTemplate, literal_inputs, prompt_structure_key
+
+
+def make_prompt(prefix="a", width="512"):
+    return {
+        "1": {"class_type": "LoadImage", "inputs": {"image": "a.png"}},
+        "2": {"class_type": "ImageScale", "inputs": {"image": ["1", 0], "width": width}},
+        "3": {"class_type": "SaveImage", "inputs": {"images": ["2", 0], "filename_prefix": prefix}},
+    }
+
+
+def make_template(prompt, dependencies=None):
+    raw = {node_id: literal_inputs(node) for node_id, node in prompt.items()}
+    converted = {node_id: dict(raw[node_id]) for node_id in prompt}
+    converted["2"]["width"] = int(converted["2"]["width"])
+    return ValidationTemplate(["3"], raw, converted, dependencies or {node_id: {} for node_id in prompt}, {"1"})
+
+
+def test_structure_key_ignores_widget_values():
+    assert prompt_structure_key(make_prompt("a"), None) == prompt_structure_key(make_prompt("b", "256"), None)
+    relinked = make_prompt()
+    relinked["3"]["inputs"]["images"] = ["1", 0]
+    assert prompt_structure_key(relinked, None) != prompt_structure_key(make_prompt(), None)
+    assert prompt_structure_key(make_prompt(), ["3"]) != prompt_structure_key(make_prompt(), None)
+
+
+def test_only_changed_nodes_are_revalidated():
+    template = make_template(make_prompt())
+    prompt = make_prompt(prefix="b")
+    raw = {node_id: literal_inputs(node) for node_id, node in prompt.items()}
+    # "1" has its own validation function so it is always validated again
+    assert template.changed_nodes(raw) == {"1", "3"}
+
+
+def test_unchanged_nodes_get_converted_values():
+    template = make_template(make_prompt())
+    prompt = make_prompt()
+    template.apply(prompt, skip={"1"})
+    assert prompt["2"]["inputs"]["width"] == 512
+    assert prompt["2"]["inputs"]["image"] == ["1", 0]
+
+
+def test_listed_directory_change(tmp_path):
+    dependency = ("directory", str(tmp_path))
+    stamp = os.stat(tmp_path).st_mtime_ns
+    prompt = make_prompt()
+    template = make_template(prompt, {"1": {}, "2": {dependency: stamp}, "3": {}})
+    raw = {node_id: literal_inputs(node) for node_id, node in prompt.items()}
+    assert template.changed_nodes(raw) == {"1"}
+    os.utime(tmp_path, ns=(stamp, stamp + 10 ** 9))
+    assert template.changed_nodes(raw) == {"1", "2"}
+
+
+def test_untracked_node_expires():
+    prompt = make_prompt()
+    expired = {("expires", time.monotonic() - 1): True}
+    template = make_template(prompt, {"1": {}, "2": expired, "3": {}})
+    raw = {node_id: literal_inputs(node) for node_id, node in prompt.items()}
+    assert template.changed_nodes(raw) == {"1", "2"}
@@ -0,0 +1,91 @@
+import os
+import threading
+
+import pytest
+
+import folder_paths
+from folder_paths import SaveCounterIndex, get_save_image_path
+
+
+def touch(folder, name):
+    with open(os.path.join(folder, name), "w") as f:
+        f.write("x")
+
+
+def save(index, folder, prefix="ComfyUI"):
+    counter = index.reserve(folder, prefix)
+    name = f"{prefix}_{counter:05}_.png"
+    touch(folder, name)
+    index.record_saved(folder, [name])
+    return counter
+
+
+def count_listings(monkeypatch):
+    calls = []
+    listdir = os.listdir
+    def counting_listdir(path):
+        calls.append(path)
+        return listdir(path)
+    monkeypatch.setattr(folder_paths.os, "listdir", counting_listdir)
+    return calls
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    folder_paths.save_counter_index.clear()
+    return str(tmp_path)
+
+
+def test_counter_follows_existing_files(output_dir):
+    touch(output_dir, "ComfyUI_00007_.png")
+    touch(output_dir, "ComfyUI_extra_00050_.png")
+    touch(output_dir, "Other_00099_.png")
+    _, filename, counter, _, _ = get_save_image_path("ComfyUI", output_dir)
+    assert filename == "ComfyUI"
+    assert counter == 8
+
+
+def test_missing_subfolder_is_created(output_dir):
+    full_output_folder, _, counter, subfolder, _ = get_save_image_path("sub/ComfyUI", output_dir)
+    assert os.path.isdir(full_output_folder)
+    assert subfolder == "sub"
+    assert counter == 1
+
+
+def test_batches_are_reserved(output_dir):
+    assert get_save_image_path("ComfyUI", output_dir, batch_size=4)[2] == 1
+    assert get_save_image_path("ComfyUI", output_dir)[2] == 5
+
+
+def test_back_to_back_saves_list_once(output_dir, monkeypatch):
+    index = SaveCounterIndex()
+    touch(output_dir, "ComfyUI_00003_.png")
+    calls = count_listings(monkeypatch)
+    assert [save(index, output_dir) for _ in range(5)] == [4, 5, 6, 7, 8]
+    assert len(calls) == 1
+
+
+def test_external_files_are_picked_up(output_dir, monkeypatch):
+    index = SaveCounterIndex()
+    assert save(index, output_dir) == 1
+    calls = count_listings(monkeypatch)
+    touch(output_dir, "ComfyUI_00020_.png")
+    # Another writer, in a later mtime tick than the recorded save
+    st = os.stat(output_dir)
+    os.utime(output_dir, ns=(st.st_atime_ns, st.st_mtime_ns + 1000 * 1000 * 1000))
+    assert save(index, output_dir) == 21
+    assert len(calls) == 1
+
+
+def test_concurrent_reservations_are_unique(output_dir):
+    index = SaveCounterIndex()
+    counters = []
+    def worker():
+        for _ in range(50):
+            counters.append(index.reserve(output_dir, "ComfyUI", 2))
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(counters) == list(range(1, 400, 2))
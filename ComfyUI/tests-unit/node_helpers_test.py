@@ -0,0 +1,62 @@
+import hashlib
+import io
+import os
+
+from node_helpers import FileDigestCache, hash_stream
+
+
+def test_digest_matches_hashlib(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"pixels" * 1000)
+    cache = FileDigestCache()
+    assert cache.digest(str(path)) == hashlib.sha256(b"pixels" * 1000).hexdigest()
+    assert cache.digest(str(path), "md5") == hashlib.md5(b"pixels" * 1000).hexdigest()
+
+
+def test_unchanged_file_is_not_reread(tmp_path, monkeypatch):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"abc")
+    cache = FileDigestCache()
+    first = cache.digest(str(path))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("file was read again")
+    monkeypatch.setattr("builtins.open", fail)
+    assert cache.digest(str(path)) == first
+
+
+def test_modified_file_is_rehashed(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"abc")
+    cache = FileDigestCache()
+    cache.digest(str(path))
+    path.write_bytes(b"abcd")
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000))
+    assert cache.digest(str(path)) == hashlib.sha256(b"abcd").hexdigest()
+
+
+def test_record_from_stream(tmp_path, monkeypatch):
+    path = tmp_path / "upload.png"
+    upload = io.BytesIO(b"uploaded image")
+    cache = FileDigestCache()
+    with open(path, "wb") as f:
+        digests = hash_stream(upload, ["sha256", "md5"], out=f)
+    cache.record(str(path), digests)
+    assert path.read_bytes() == b"uploaded image"
+    assert digests["md5"] == hashlib.md5(b"uploaded image").hexdigest()
+
+    def fail(*args, **kwargs):
+        raise AssertionError("file was read again")
+    monkeypatch.setattr("builtins.open", fail)
+    assert cache.digest(str(path)) == hashlib.sha256(b"uploaded image").hexdigest()
+
+
+def test_invalidate(tmp_path):
+    path = tmp_path / "a.png"
+    path.write_bytes(b"abc")
+    cache = FileDigestCache()
+    cache.record(str(path), {"sha256": "stale"})
+    assert cache.digest(str(path)) == "stale"
+    cache.invalidate(str(path))
+    assert cache.digest(str(path)) == hashlib.sha256(b"abc").hexdigest()